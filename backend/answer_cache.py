@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from state import STATE_BACKEND, STATE_SYNC_INTERVAL, shared_state
+import asyncio
+import base64
+import json
+import numpy as np
+import os
+import threading
+import time
+import uuid
+
+# Semantic answer cache for /ask: a question whose embedding is within a
+# cosine threshold of an earlier one gets the earlier answer back, as long as
+# the entry is fresh and was produced against the current index version.
+# With a shared state backend (STATE_BACKEND, see state.py) every answer is
+# also appended to a log there, which each worker reads at most every
+# STATE_SYNC_INTERVAL seconds on lookup (in a worker thread with alookup()),
+# so an answer produced by one worker is served by all of them; lookups
+# themselves stay in memory.
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+
+
+def _encode(vector):
+    return base64.b64encode(vector.astype(np.float32).tobytes()).decode("ascii")
+
+
+def _decode(text):
+    return np.frombuffer(base64.b64decode(text), dtype=np.float32)
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticAnswerCache:
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, capacity=ANSWER_CACHE_SIZE,
+                 state=None, name="answers"):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.capacity = capacity
+        self.entries = OrderedDict()  # question -> (vector, answer, version, created)
+        self.matrix = None
+        self.keys = []
+        self.versions = None  # index version of each row of matrix
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "shared": 0}
+        self.state = state or shared_state(STATE_BACKEND)
+        self.log = f"{name}:log"
+        self.origin = uuid.uuid4().hex  # this worker's entries are skipped when read back
+        self.cursor = None
+        self.last_sync = 0.0
+
+    def _rebuild(self):
+        self.keys = list(self.entries)
+        self.matrix = np.stack([self.entries[k][0] for k in self.keys]) if self.keys else None
+        self.versions = np.array([self.entries[k][2] for k in self.keys], dtype=object)
+
+    def _expire(self, now):
+        expired = [k for k, (_, _, _, created) in self.entries.items() if now - created > self.ttl]
+        for k in expired:
+            del self.entries[k]
+        if expired:
+            self.matrix = None
+
+    def _due(self):
+        return self.state is not None and time.time() - self.last_sync >= STATE_SYNC_INTERVAL
+
+    def _sync(self):
+        # Entries other workers have stored since the last read. The log is
+        # read outside self.lock, by one thread at a time.
+        if not self._due() or not self.sync_lock.acquire(blocking=False):
+            return
+        try:
+            now = self.last_sync = time.time()
+            values, self.cursor = self.state.read_log(self.log, self.cursor)
+            entries = [entry for entry in map(json.loads, values)
+                       if entry["origin"] != self.origin and now - entry["created"] <= self.ttl]
+            with self.lock:
+                for entry in entries:
+                    self._add(entry["question"], _decode(entry["vector"]), entry["answer"], entry["version"],
+                              entry["created"])
+                    self.stats["shared"] += 1
+        finally:
+            self.sync_lock.release()
+
+    def _add(self, question, vector, answer, version, created):
+        self.entries[question] = (vector, answer, version, created)
+        self.entries.move_to_end(question)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+        self.matrix = None
+
+    def lookup(self, vector, version):
+        """Return (answer, question) of the closest fresh entry, or None."""
+        self._sync()
+        return self._match(vector, version)
+
+    async def alookup(self, vector, version):
+        """lookup() for the event loop: the shared log is read in a worker thread."""
+        if self._due():
+            await asyncio.to_thread(self._sync)
+        return self._match(vector, version)
+
+    def _match(self, vector, version):
+        with self.lock:
+            now = time.time()
+            self._expire(now)
+            if self.matrix is None:
+                self._rebuild()
+            if self.matrix is None:
+                self.stats["misses"] += 1
+                return None
+            # Entries from other index versions can't answer, however close
+            scores = np.where(self.versions == version, self.matrix @ _normalize(vector), -np.inf)
+            best = int(np.argmax(scores))
+            key = self.keys[best]
+            answer = self.entries[key][1]
+            if scores[best] < self.threshold:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return answer, key
+
+    def store(self, question, vector, answer, version):
+        with self.lock:
+            vector, created = _normalize(vector), time.time()
+            self._add(question, vector, answer, version, created)
+        if self.state is not None:
+            self.state.append(self.log, json.dumps({"question": question, "vector": _encode(vector), "answer": answer,
+                                                    "version": version, "created": created,
+                                                    "origin": self.origin}), self.capacity)
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.matrix = None
+            self.stats["invalidations"] += 1
@@ -0,0 +1,132 @@
+from collections import Counter, defaultdict
+from langchain_core.documents import Document
+from retrievers import metadata_matches
+import json
+import math
+import os
+import re
+
+# Local BM25 keyword index over the same chunks as the vector store. Kept in
+# sync by /build (add/remove by chunk id) and persisted next to the Chroma
+# files, so exact skill queries ("Terraform", "AWS SAA") need no embedding call.
+
+TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9+#]*(?:[.\-][a-z0-9+#]+)*")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    def __init__(self, path=None, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.docs = {}  # id -> {"text", "metadata", "tf", "length"}
+        self.postings = defaultdict(dict)  # term -> {id: tf}
+        self.fields = defaultdict(lambda: defaultdict(set))  # metadata key -> value -> {id}
+        self.total_length = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.docs
+
+    def add(self, doc_id, text, metadata=None):
+        if doc_id in self.docs:
+            self.remove(doc_id)
+        tf = Counter(tokenize(text))
+        length = sum(tf.values())
+        self.docs[doc_id] = {"text": text, "metadata": metadata or {}, "tf": tf, "length": length}
+        for term, count in tf.items():
+            self.postings[term][doc_id] = count
+        for key, value in self.docs[doc_id]["metadata"].items():
+            self.fields[key][value].add(doc_id)
+        self.total_length += length
+
+    def remove(self, doc_id):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return
+        for term in doc["tf"]:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self.postings[term]
+        for key, value in doc["metadata"].items():
+            ids = self.fields[key][value]
+            ids.discard(doc_id)
+            if not ids:
+                del self.fields[key][value]
+        self.total_length -= doc["length"]
+
+    def search(self, query, k=10, ids=None):
+        """[(doc_id, score)] best first; `ids` optionally restricts candidates."""
+        if not self.docs:
+            return []
+        n = len(self.docs)
+        avgdl = self.total_length / n or 1.0
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                if ids is not None and doc_id not in ids:
+                    continue
+                length = self.docs[doc_id]["length"]
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avgdl))
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def ids_where(self, where):
+        """Ids of the docs whose metadata matches a Chroma "where" clause.
+
+        Equality and $in conditions are answered from the per-field index;
+        other operators fall back to checking each doc's metadata.
+        """
+        ids = None
+        for key, condition in where.items():
+            if key == "$and":
+                found = set(self.docs)
+                for c in condition:
+                    found &= self.ids_where(c)
+            elif key == "$or":
+                found = set().union(*(self.ids_where(c) for c in condition))
+            elif not isinstance(condition, dict):
+                found = set(self.fields[key].get(condition, ())) if key in self.fields else set()
+            elif set(condition) <= {"$eq", "$in"}:
+                values = self.fields.get(key, {})
+                found = None
+                for op, operand in condition.items():
+                    matched = set().union(*(values.get(v, ()) for v in (operand if op == "$in" else [operand])))
+                    found = matched if found is None else found & matched
+            else:
+                found = {i for i, doc in self.docs.items() if metadata_matches(doc["metadata"], {key: condition})}
+            ids = found if ids is None else ids & found
+        return set(self.docs) if ids is None else ids
+
+    def document(self, doc_id):
+        doc = self.docs[doc_id]
+        return Document(page_content=doc["text"], metadata=dict(doc["metadata"]))
+
+    def save(self, path=None):
+        path = path or self.path
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({doc_id: {"text": d["text"], "metadata": d["metadata"]} for doc_id, d in self.docs.items()}, f)
+        os.replace(tmp, path)
+
+    def load(self, path=None):
+        with open(path or self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.docs.clear()
+        self.postings.clear()
+        self.fields.clear()
+        self.total_length = 0
+        for doc_id, doc in data.items():
+            self.add(doc_id, doc["text"], doc["metadata"])
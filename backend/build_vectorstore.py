@@ -1,47 +1,92 @@
-from langchain_community.vectorstores import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.document_loaders import PyPDFLoader
-import zipfile
+from bm25 import BM25Index
+from cv_metadata import CandidateTable
+from embedding_cache import CachedEmbeddings
+from embedding_stage import EmbeddingStage
+from ingest import INGEST_SCHEMA, INGEST_WORKERS, iter_parsed, iter_sources
+from manifest import Manifest, chunk_ids, source_sha256
+from index_versions import index_versions
+from numpy_store import close_vectorstore, open_vectorstore, vector_writer
+import asyncio
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# 1. Load documents
+# 1. Load documents (read straight from the archive, nothing is extracted)
 zip_path = "../CVs_1page.zip"
-extract_to = "/content/cv"
 
-# Unzip
-with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-    zip_ref.extractall(extract_to)
+# The process pool re-imports this module in its workers on spawn-based
+# platforms, so the build itself must only run from __main__.
+if __name__ == "__main__":
+    # 2. Embeddings
+    embeddings = CachedEmbeddings(
+        GoogleGenerativeAIEmbeddings(model="models/embedding-001",google_api_key=os.getenv("GOOGLE_API_KEY")),
+        model="models/embedding-001",
+    )
 
-def load_pdfs_as_dicts(folder_path):
-    documents = []
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".pdf"):
-            loader = PyPDFLoader(os.path.join(folder_path, filename))
-            documents.append(loader.load())
-    return documents
+    # 3. Parse + split across worker processes, embed and persist batch by batch
+    # (VECTOR_BACKEND=chroma|numpy). Like a /build in rag3.py, this updates a
+    # copy of the serving index: CVs added through /build or /upload stay, and
+    # files of the zip that are already indexed unchanged are skipped.
+    versions = index_versions()
+    path = versions.prepare()
+    vectorstore = open_vectorstore(path, embeddings)
+    manifest = Manifest(os.path.join(path, "manifest.json"))
+    if manifest.schema != INGEST_SCHEMA and (manifest.exists or vectorstore.get(limit=1, include=[])["ids"]):
+        # Re-indexing an older layout needs every uploaded file, which only /build reads
+        close_vectorstore(vectorstore)
+        versions.discard(path)
+        raise SystemExit("The serving index was built with an older chunk layout; "
+                         "rebuild it with POST /build instead.")
+    manifest.schema = INGEST_SCHEMA
+    keyword_index = BM25Index(os.path.join(path, "bm25.json"))
+    candidates = CandidateTable(os.path.join(path, "candidates.sqlite3"))
+    hashes = {}
+    stale_ids = []
 
+    def sources():
+        for name, source in iter_sources(zip_path):
+            sha = source_sha256(source)
+            if manifest.is_current(name, sha):
+                continue
+            hashes[name] = sha
+            yield name, source
 
-folder_path = "/content/cv"
-docs = load_pdfs_as_dicts(folder_path)
+    def chunks():
+        for name, file_chunks in iter_parsed(sources(), workers=INGEST_WORKERS):
+            ids = chunk_ids(name, [c.page_content for c in file_chunks])
+            if file_chunks:
+                cv = file_chunks[0].metadata
+                candidates.upsert(name, {"candidate": cv["candidate"], "role": cv["role"],
+                                         "skills": [s for s in cv["skills"].split(", ") if s]})
+            old_ids = set(manifest.chunks(name))
+            stale_ids.extend(old_ids - set(ids))
+            fresh = [(i, chunk) for i, chunk in zip(ids, file_chunks) if i not in old_ids]
+            for i, chunk in fresh:
+                keyword_index.add(i, chunk.page_content, chunk.metadata)
+            manifest.set(name, hashes[name], ids)
+            yield from fresh
 
-# 2. Split into chunks
-splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-chunked_documents = []
-
-for doc in docs:
-    chunks = splitter.split_documents(doc)
-    for i, chunk in enumerate(chunks):
-        chunked_documents.append(chunk)
-print(f"Split documents into {len(chunked_documents)} chunks")
-
-# 3. Embeddings
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001",google_api_key=os.getenv("GOOGLE_API_KEY"))
-
-# 4. Create and persist vectorstore
-vectorstore = Chroma.from_documents(chunked_documents, embeddings, persist_directory="./chroma_db")
-vectorstore.persist()
-print("✅ Vectorstore built and saved.")
+    stage = EmbeddingStage(embeddings, vector_writer(vectorstore))
+    total = asyncio.run(stage.run(chunks()))
+    if stale_ids:
+        vectorstore.delete(ids=stale_ids)
+        for doc_id in stale_ids:
+            keyword_index.remove(doc_id)
+    vectorstore.persist()
+    close_vectorstore(vectorstore)
+    keyword_index.save()
+    candidates.close()
+    if not hashes:
+        versions.discard(path)
+        print("✅ Vectorstore already up to date.")
+        raise SystemExit(0)
+    # Written last: the manifest only records what is on disk. The version
+    # goes up, so answers cached for the old one go stale.
+    manifest.version += 1
+    manifest.save()
+    # Running servers swap it in within INDEX_CHECK_INTERVAL seconds.
+    versions.publish(path)
+    print(f"Indexed {len(hashes)} new or changed files, {total} chunks")
+    print("✅ Vectorstore built and saved.")
@@ -0,0 +1,226 @@
+from fastapi import HTTPException
+from metrics import REGISTRY
+import asyncio
+import heapq
+import math
+import os
+import time
+
+# Admission control and scheduling for upstream LLM work. At most
+# max_concurrency calls run at once; the rest wait, and a freed slot goes to
+# the next waiter by priority class first (interactive chat before batch
+# work), then by weighted fair queuing across users within the class, so one
+# user with hundreds of queued calls gets their share and no more. Before
+# queueing, a call is rejected with 429 + Retry-After when its user is over
+# their request / token quota or has USER_MAX_QUEUED calls waiting already,
+# or when the expected wait for its class exceeds the class's latency SLO;
+# beyond max_queue waiters it is rejected with 503.
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "256"))
+PRIORITIES = ("interactive", "batch")  # served strictly in this order
+# Longest expected queue wait (seconds) a call of each class is admitted with
+LLM_QUEUE_SLO = {"interactive": float(os.getenv("LLM_QUEUE_SLO", "10")),
+                 "batch": float(os.getenv("LLM_BATCH_QUEUE_SLO", "120"))}
+USER_REQUESTS_PER_MINUTE = int(os.getenv("USER_REQUESTS_PER_MINUTE", "0"))  # 0 = no quota
+USER_TOKENS_PER_MINUTE = int(os.getenv("USER_TOKENS_PER_MINUTE", "0"))  # 0 = no quota
+USER_MAX_QUEUED = int(os.getenv("USER_MAX_QUEUED", "32"))  # 0 = no limit
+# Fair-queuing weights, e.g. "recruiter=2,nightly=0.5"; other users weigh 1
+LLM_USER_WEIGHTS = {user.strip(): float(weight) for user, weight in
+                    (item.split("=") for item in os.getenv("LLM_USER_WEIGHTS", "").split(",") if item.strip())}
+SERVICE_SMOOTHING = 0.1  # weight of the newest call in the average slot hold time
+
+SHED = REGISTRY.counter("llm_shed_total", "LLM calls rejected before queueing", ["priority", "reason"])
+QUEUE_WAIT = REGISTRY.histogram("llm_queue_wait_seconds", "Time LLM calls waited for a slot", ["priority"])
+
+
+def rejected(status_code, detail, retry_after):
+    return HTTPException(status_code=status_code, detail=detail,
+                         headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.level
+
+    def wait(self, amount):
+        """Seconds until amount is available (a cost above capacity needs a full bucket)."""
+        missing = min(amount, self.capacity) - self.refill()
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount):
+        # May go negative: usage charged after the fact is paid back before the next call
+        self.refill()
+        self.level -= amount
+
+    def full(self):
+        return self.refill() >= self.capacity
+
+
+class User:
+    def __init__(self, weight, requests_per_minute, tokens_per_minute):
+        self.weight = weight
+        self.finish = 0.0  # virtual finish time of the user's last scheduled call
+        self.queued = 0
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def idle(self, virtual):
+        return (not self.queued and self.finish <= virtual and (self.requests is None or self.requests.full())
+                and (self.tokens is None or self.tokens.full()))
+
+
+class Slot:
+    """One LLM call's turn: async with scheduler.slot(user, priority, tokens)."""
+
+    def __init__(self, scheduler, user, priority, tokens):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}, expected one of {PRIORITIES}")
+        self.scheduler, self.user, self.priority, self.tokens = scheduler, user, priority, tokens
+        self.started = None
+
+    async def __aenter__(self):
+        await self.scheduler.acquire(self)
+        self.started = time.monotonic()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.scheduler.release(time.monotonic() - self.started)
+        return False
+
+    def charge(self, tokens):
+        """Count tokens used beyond the estimate given on entry (e.g. the answer) against the quota."""
+        self.scheduler.charge(self.user, tokens)
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE, slo=LLM_QUEUE_SLO,
+                 requests_per_minute=USER_REQUESTS_PER_MINUTE, tokens_per_minute=USER_TOKENS_PER_MINUTE,
+                 user_max_queued=USER_MAX_QUEUED, weights=LLM_USER_WEIGHTS):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.slo = slo
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.user_max_queued = user_max_queued
+        self.weights = weights
+        self.active = 0
+        self.queues = {priority: [] for priority in PRIORITIES}  # heaps of (finish, seq, future, slot)
+        self.waiting = {priority: 0 for priority in PRIORITIES}
+        self.users = {}  # user -> User; None (internal work) has no quota
+        self.virtual = 0.0  # virtual time: start of the call dispatched last
+        self.seq = 0
+        self.service = None  # average seconds a slot is held
+
+    def slot(self, user=None, priority="interactive", tokens=0):
+        return Slot(self, user, priority, tokens)
+
+    def _user(self, user):
+        state = self.users.get(user)
+        if state is None:
+            if len(self.users) >= 4 * self.max_queue:
+                # Forget users whose state is back to that of a new one
+                for name in [name for name, s in self.users.items() if s.idle(self.virtual)]:
+                    del self.users[name]
+            quota = user is not None
+            state = self.users[user] = User(self.weights.get(user, 1.0), quota and self.requests_per_minute,
+                                            quota and self.tokens_per_minute)
+        return state
+
+    def expected_wait(self, priority):
+        """Seconds a call of this class would wait if it queued now (0 while a slot is free)."""
+        if self.active < self.max_concurrency or not self.service:
+            return 0.0
+        ahead = sum(self.waiting[p] for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+        return (ahead + 1) * self.service / self.max_concurrency
+
+    def check(self, user=None, priority="interactive", tokens=0):
+        """Raise the rejection a call would get now, without taking quota (e.g. before starting a stream)."""
+        state = self._user(user)
+        reason = None
+        if state.requests is not None and state.requests.wait(1):
+            reason, detail, retry_after = "requests_quota", "Request quota exceeded", state.requests.wait(1)
+        elif state.tokens is not None and state.tokens.wait(tokens):
+            reason, detail, retry_after = "tokens_quota", "Token quota exceeded", state.tokens.wait(tokens)
+        elif self.active >= self.max_concurrency:
+            wait = self.expected_wait(priority)
+            if self.user_max_queued and state.queued >= self.user_max_queued:
+                reason, detail, retry_after = "user_queue", "Too many queued requests", self.service or 1
+            elif wait > self.slo[priority]:
+                reason, detail, retry_after = "slo", "Server busy, try again shortly", wait - self.slo[priority]
+            elif sum(self.waiting.values()) >= self.max_queue:
+                SHED.inc(priority=priority, reason="queue_full")
+                raise rejected(503, "Server busy, try again shortly", 1)
+        if reason:
+            SHED.inc(priority=priority, reason=reason)
+            raise rejected(429, detail, retry_after)
+        return state
+
+    async def acquire(self, slot):
+        state = self.check(slot.user, slot.priority, slot.tokens)
+        if state.requests is not None:
+            state.requests.take(1)
+        if state.tokens is not None:
+            state.tokens.take(slot.tokens)
+        start = max(self.virtual, state.finish)
+        state.finish = start + 1 / state.weight
+        if self.active < self.max_concurrency:
+            self.active += 1
+            self.virtual = start
+            QUEUE_WAIT.observe(0.0, priority=slot.priority)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.seq += 1
+        heapq.heappush(self.queues[slot.priority], (state.finish, self.seq, future, start))
+        self.waiting[slot.priority] += 1
+        state.queued += 1
+        queued = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(None)  # handed a slot just as the caller went away
+            else:
+                self.waiting[slot.priority] -= 1  # its heap entry is skipped by release()
+            raise
+        finally:
+            state.queued -= 1
+        QUEUE_WAIT.observe(time.monotonic() - queued, priority=slot.priority)
+
+    def release(self, held):
+        if held is not None:
+            self.service = held if self.service is None else \
+                (1 - SERVICE_SMOOTHING) * self.service + SERVICE_SMOOTHING * held
+        for priority in PRIORITIES:
+            queue = self.queues[priority]
+            while queue:
+                _, _, future, start = heapq.heappop(queue)
+                if future.done():
+                    continue  # cancelled while waiting
+                # The slot passes straight to the waiter, active stays the same
+                self.waiting[priority] -= 1
+                self.virtual = max(self.virtual, start)
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def charge(self, user, tokens):
+        state = self._user(user)
+        if state.tokens is not None and tokens:
+            state.tokens.take(tokens)
+
+    def stats(self):
+        return {"active": self.active, "waiting": sum(self.waiting.values()),
+                **{f"waiting_{priority}": n for priority, n in self.waiting.items()},
+                "users_waiting": sum(bool(s.queued) for s in self.users.values()),
+                "service_seconds": round(self.service, 4) if self.service else 0.0,
+                "max_concurrency": self.max_concurrency, "max_queue": self.max_queue}
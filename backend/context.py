@@ -0,0 +1,148 @@
+from bm25 import tokenize
+from langchain_core.documents import Document
+from metrics import REGISTRY, timed
+import math
+import os
+import re
+
+# Context assembly between retrieval and the LLM. Retrieved chunks are
+# grouped per CV (in rank order), the text they share through the splitter's
+# chunk overlap is removed, each CV is trimmed to the sentences that match the
+# question, and the result is cut to a token budget, best-ranked CVs first.
+# Each CV keeps a "Candidate: name (role)" header so trimmed text stays
+# attributed.
+
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1000"))  # 0 = no budget
+CONTEXT_TRIM = os.getenv("CONTEXT_TRIM", "1") == "1"  # keep only question-relevant sentences
+CONTEXT_RELEVANCE = float(os.getenv("CONTEXT_RELEVANCE", "0.3"))  # sentence score kept, relative to the best
+CONTEXT_LEAD_SENTENCES = 3  # kept from a CV none of whose sentences match (dense hits)
+
+MIN_OVERLAP = 20  # shorter shared text is a coincidence, not chunk overlap
+SENTENCE_RE = re.compile(r"(?<=[a-z0-9)][.!?])\s+(?=[A-Z])")  # not after "B.Sc." etc.
+# Question words that say nothing about which sentence answers it
+STOPWORDS = {"a", "about", "all", "an", "and", "any", "are", "as", "at", "be", "by", "can", "candidate",
+             "candidates", "cv", "cvs", "did", "do", "does", "experience", "for", "from", "give", "has", "have",
+             "how", "i", "in", "is", "it", "know", "knows", "list", "me", "of", "on", "or", "resume", "show",
+             "tell", "that", "the", "their", "them", "they", "this", "to", "was", "were", "what", "which", "who",
+             "whose", "with"}
+
+CONTEXT_TOKENS = REGISTRY.counter("rag_context_tokens_total", "Context tokens retrieved / sent to the LLM", ["kind"])
+
+
+def approx_tokens(text):
+    # Same ~4 characters per token estimate as the session history budget
+    return len(text) // 4
+
+
+def _common(a, b):
+    return len(os.path.commonprefix([a, b]))
+
+
+def overlap_prefix(previous, text):
+    """Length of the longest prefix of text that already appears in previous."""
+    probe = text[:MIN_OVERLAP]
+    if len(probe) < MIN_OVERLAP:
+        return len(text) if text in previous else 0
+    best, start = 0, previous.find(probe)
+    while start != -1:
+        best = max(best, _common(previous[start:start + len(text)], text))
+        start = previous.find(probe, start + 1)
+    return best
+
+
+def strip_overlap(previous, text):
+    """text minus what it shares with previous at either end (adjacent chunks overlap)."""
+    if not previous:
+        return text
+    head = overlap_prefix(previous, text)
+    text = text[head:]
+    tail = overlap_prefix(previous[::-1], text[::-1])
+    return text[:len(text) - tail]
+
+
+def split_sentences(text):
+    # PDF text is broken into lines: a line starting in lowercase continues
+    # the previous one; other lines (headings, "Skills: ...") stand alone.
+    units = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if units and line[0].islower():
+            units[-1] += " " + line
+        else:
+            units.append(line)
+    return [s for unit in units for s in SENTENCE_RE.split(unit) if s]
+
+
+def candidate_header(metadata):
+    name = metadata.get("candidate") or os.path.basename(metadata.get("file") or metadata.get("source") or "")
+    role = metadata.get("role")
+    return f"Candidate: {name} ({role})" if role else f"Candidate: {name}"
+
+
+def group_chunks(docs):
+    """{file: {"metadata", "sentences"}} in rank order, overlap and repeated sentences removed."""
+    groups = {}
+    for doc in docs:
+        key = doc.metadata.get("file") or doc.metadata.get("source") or id(doc)
+        if key not in groups:
+            # Name and role lines are already in the header
+            seen = {" ".join(str(doc.metadata.get(field, "")).lower().split()) for field in ("candidate", "role")}
+            groups[key] = {"metadata": doc.metadata, "text": "", "sentences": [], "seen": seen}
+        group = groups[key]
+        text = strip_overlap(group["text"], doc.page_content)
+        group["text"] += "\n" + doc.page_content
+        for sentence in split_sentences(text):
+            normalized = " ".join(sentence.lower().split())
+            if normalized and normalized not in group["seen"]:
+                group["seen"].add(normalized)
+                group["sentences"].append(sentence)
+    return groups
+
+
+def relevant_sentences(question, groups, relevance=CONTEXT_RELEVANCE):
+    """Per group, the sentences worth keeping for this question, in their original order."""
+    terms = set(tokenize(question)) - STOPWORDS
+    sentences = [s for group in groups.values() for s in group["sentences"]]
+    # BM25-style idf over the retrieved sentences, so words every sentence
+    # has ("the", "and", the role title) count for little.
+    df = {}
+    for sentence in sentences:
+        for term in terms & set(tokenize(sentence)):
+            df[term] = df.get(term, 0) + 1
+    idf = {term: math.log(1 + (len(sentences) - n + 0.5) / (n + 0.5)) for term, n in df.items()}
+    scores = {s: sum(idf.get(term, 0.0) for term in set(tokenize(s))) for s in sentences}
+    best = max(scores.values(), default=0.0)
+    kept = {}
+    for key, group in groups.items():
+        matching = [s for s in group["sentences"] if best and scores[s] >= relevance * best]
+        kept[key] = matching or group["sentences"][:CONTEXT_LEAD_SENTENCES]
+    return kept
+
+
+def compress_context(question, docs, max_tokens=CONTEXT_MAX_TOKENS, trim=CONTEXT_TRIM):
+    """One Document per CV holding the compressed context, best-ranked first."""
+    with timed("compress_context"):
+        groups = group_chunks(docs)
+        if trim:
+            kept = relevant_sentences(question, groups)
+        else:
+            kept = {key: group["sentences"] for key, group in groups.items()}
+        out, used = [], 0
+        for key, group in groups.items():
+            header = candidate_header(group["metadata"])
+            lines = []
+            for sentence in kept[key]:
+                cost = approx_tokens(sentence) + 1
+                if max_tokens and used + approx_tokens(header) + cost > max_tokens:
+                    continue  # a shorter sentence after it may still fit
+                lines.append(sentence)
+                used += cost
+            if not lines:
+                continue  # nothing of this CV fits; a shorter one further down still may
+            used += approx_tokens(header) + 1
+            out.append(Document(page_content="\n".join([header] + lines), metadata=group["metadata"]))
+    CONTEXT_TOKENS.inc(sum(approx_tokens(doc.page_content) for doc in docs), kind="retrieved")
+    CONTEXT_TOKENS.inc(sum(approx_tokens(doc.page_content) for doc in out), kind="sent")
+    return out
@@ -0,0 +1,114 @@
+import re
+import sqlite3
+import threading
+
+# Structured per-CV metadata (candidate name, role title, skills) extracted at
+# ingestion. Every chunk carries file/candidate/role/skills in its metadata,
+# and the candidates side table indexes role and skills so queries can be
+# narrowed to a set of files before any vector search happens.
+
+SKILLS_RE = re.compile(r"^\s*(?:technical\s+|key\s+)?skills?\s*[:\-]\s*(.+)$", re.IGNORECASE | re.MULTILINE)
+SKILL_SPLIT_RE = re.compile(r"[,;|•·]")
+
+
+def extract_cv_metadata(text):
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    candidate = lines[0] if lines else ""
+    # CVs here open with "Name\nRole title\n..."; anything that looks like a
+    # sentence or a "Label: value" line is not a title.
+    role = ""
+    if len(lines) > 1 and len(lines[1]) <= 60 and ":" not in lines[1] and not lines[1].endswith("."):
+        role = lines[1]
+    skills = []
+    for match in SKILLS_RE.finditer(text):
+        for skill in SKILL_SPLIT_RE.split(match.group(1)):
+            skill = skill.strip().strip(".").lower()
+            if skill and skill not in skills:
+                skills.append(skill)
+    return {"candidate": candidate, "role": role, "skills": skills}
+
+
+class CandidateTable:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # WAL: a build upserts one row per file, and rollback-journal commits
+        # cost an fsync each (~50 ms, minutes for a 10k-CV corpus).
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS candidates ("
+            " file TEXT PRIMARY KEY, candidate TEXT NOT NULL, role TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS candidates_role ON candidates (role COLLATE NOCASE);"
+            "CREATE INDEX IF NOT EXISTS candidates_candidate ON candidates (candidate COLLATE NOCASE);"
+            "CREATE TABLE IF NOT EXISTS candidate_skills ("
+            " file TEXT NOT NULL, skill TEXT NOT NULL, PRIMARY KEY (file, skill));"
+            "CREATE INDEX IF NOT EXISTS candidate_skills_skill ON candidate_skills (skill);"
+        )
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM candidates").fetchone()[0]
+
+    def upsert(self, file, metadata):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO candidates VALUES (?, ?, ?)",
+                            (file, metadata.get("candidate", ""), metadata.get("role", "")))
+            self.db.execute("DELETE FROM candidate_skills WHERE file = ?", (file,))
+            self.db.executemany("INSERT OR IGNORE INTO candidate_skills VALUES (?, ?)",
+                                [(file, skill) for skill in metadata.get("skills", [])])
+            self.db.commit()
+
+    def remove(self, file):
+        with self.lock:
+            self.db.execute("DELETE FROM candidates WHERE file = ?", (file,))
+            self.db.execute("DELETE FROM candidate_skills WHERE file = ?", (file,))
+            self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM candidates")
+            self.db.execute("DELETE FROM candidate_skills")
+            self.db.commit()
+
+    def roles(self):
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT DISTINCT role FROM candidates WHERE role != ''")]
+
+    def skills(self):
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT DISTINCT skill FROM candidate_skills")]
+
+    def find(self, roles=None, skills=None, candidates=None):
+        """Files matching any of the roles, all of the skills and any of the candidate names."""
+        sql = "SELECT file FROM candidates WHERE 1 = 1"
+        params = []
+        if roles:
+            sql += f" AND role COLLATE NOCASE IN ({','.join('?' * len(roles))})"
+            params += list(roles)
+        if candidates:
+            sql += f" AND candidate COLLATE NOCASE IN ({','.join('?' * len(candidates))})"
+            params += list(candidates)
+        for skill in skills or []:
+            sql += " AND file IN (SELECT file FROM candidate_skills WHERE skill = ?)"
+            params.append(skill.lower())
+        with self.lock:
+            return [row[0] for row in self.db.execute(sql, params)]
+
+    def rank_by_skills(self, skills, limit=1000):
+        """Files listing any of the skills, those listing the most first."""
+        sql = (f"SELECT file FROM candidate_skills WHERE skill IN ({','.join('?' * len(skills))})"
+               " GROUP BY file ORDER BY COUNT(*) DESC, file LIMIT ?")
+        with self.lock:
+            return [row[0] for row in self.db.execute(sql, [skill.lower() for skill in skills] + [limit])]
+
+    def match_question(self, question):
+        """Roles and skills from the table that the question mentions by name."""
+        text = f" {re.sub(r'[^a-z0-9+#./ ]+', ' ', question.lower())} "
+        roles = [r for r in self.roles() if f" {r.lower()} " in text or f" {r.lower()}s " in text]
+        skills = [s for s in self.skills() if f" {s} " in text]
+        return roles, skills
@@ -0,0 +1,231 @@
+from array import array
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+from metrics import timed
+from single_flight import SingleFlight
+import asyncio
+import hashlib
+import inspect
+import os
+import sqlite3
+import threading
+import time
+
+# Disk-backed embedding cache wrapping any LangChain embeddings object.
+# Keyed by (model, kind, sha256(text)); "kind" separates query and document
+# vectors because the Google model embeds them with different task types.
+
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./embedding_cache.sqlite3")
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+EMBED_CACHE_LRU_SIZE = int(os.getenv("EMBED_CACHE_LRU_SIZE", "10000"))
+TOUCH_BATCH = 1000  # memory hits whose last_used is written in one go
+
+
+def _encode(vector):
+    return array("f", vector).tobytes()
+
+
+def _decode(blob):
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, inner, model, path=EMBED_CACHE_PATH, max_entries=EMBED_CACHE_MAX_ENTRIES,
+                 lru_size=EMBED_CACHE_LRU_SIZE):
+        self.inner = inner
+        self.model = model
+        self.max_entries = max_entries
+        self.lru_size = lru_size
+        self.lru = OrderedDict()
+        self.touched = {}  # (kind, sha256) -> last memory hit not yet written
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self.lock = threading.Lock()
+        # Concurrent misses for the same question share one API call
+        self.flights = SingleFlight("embed_query")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, kind TEXT NOT NULL, sha256 TEXT NOT NULL,"
+            " vector BLOB NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, kind, sha256))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.db.commit()
+        self.size = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @property
+    def hit_rate(self):
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def _remember(self, key, vector):
+        self.lru[key] = vector
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def lookup(self, kind, texts):
+        """Return ({text: vector} for cached texts, [uncached unique texts])."""
+        return self._disk(kind, *self._memory(kind, texts))
+
+    async def alookup(self, kind, texts):
+        # lookup() with the SQLite part, when there is one, in a worker thread
+        found, wanted = self._memory(kind, texts)
+        if not self._disk_due(wanted):
+            return found, []
+        return await asyncio.to_thread(self._disk, kind, found, wanted)
+
+    def _memory(self, kind, texts):
+        # Memory hits only note their use; last_used is written with the next
+        # batch of SQLite work, so the eviction order stays true to them
+        found, wanted = {}, {}
+        now = time.time()
+        with self.lock:
+            for text in texts:
+                if text in found or text in wanted:
+                    continue
+                key = (kind, hashlib.sha256(text.encode("utf-8")).hexdigest())
+                if key in self.lru:
+                    self.lru.move_to_end(key)
+                    found[text] = self.lru[key]
+                    self.touched[key] = now
+                    self.stats["memory_hits"] += 1
+                else:
+                    wanted[text] = key[1]
+        return found, wanted
+
+    def _disk_due(self, wanted):
+        return bool(wanted) or len(self.touched) >= TOUCH_BATCH
+
+    def _disk(self, kind, found, wanted):
+        if not self._disk_due(wanted):
+            return found, []
+        with self.lock:
+            self._write_touched()
+            by_sha = {sha: text for text, sha in wanted.items()}
+            shas = list(by_sha)
+            now = time.time()
+            for start in range(0, len(shas), 500):
+                part = shas[start:start + 500]
+                rows = self.db.execute(
+                    f"SELECT sha256, vector FROM embeddings WHERE model = ? AND kind = ? "
+                    f"AND sha256 IN ({','.join('?' * len(part))})",
+                    [self.model, kind, *part],
+                ).fetchall()
+                for sha, blob in rows:
+                    vector = _decode(blob)
+                    found[by_sha[sha]] = vector
+                    self._remember((kind, sha), vector)
+                    del wanted[by_sha[sha]]
+                    self.stats["disk_hits"] += 1
+                if rows:
+                    self.db.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE model = ? AND kind = ? AND sha256 = ?",
+                        [(now, self.model, kind, sha) for sha, _ in rows],
+                    )
+            self.db.commit()
+            self.stats["misses"] += len(wanted)
+        return found, list(wanted)
+
+    def _write_touched(self):
+        if self.touched:
+            self.db.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND kind = ? AND sha256 = ?",
+                [(used, self.model, kind, sha) for (kind, sha), used in self.touched.items()],
+            )
+            self.touched.clear()
+
+    def store(self, kind, texts, vectors):
+        now = time.time()
+        rows = []
+        with self.lock:
+            for text, vector in zip(texts, vectors):
+                sha = hashlib.sha256(text.encode("utf-8")).hexdigest()
+                self._remember((kind, sha), vector)
+                rows.append((self.model, kind, sha, _encode(vector), now))
+            self._write_touched()
+            # Only rows not cached yet count towards the size
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+            added = self.db.total_changes - before
+            if added < len(rows):
+                self.db.executemany(
+                    "UPDATE embeddings SET vector = ?, last_used = ? WHERE model = ? AND kind = ? AND sha256 = ?",
+                    [(vector, used, model, kind, sha) for model, kind, sha, vector, used in rows],
+                )
+            self.size += added
+            if self.size > self.max_entries:
+                self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        # Drop the least recently used ~10% below the cap in one statement.
+        self.size = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self.size - int(self.max_entries * 0.9)
+        if excess > 0:
+            self.db.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+            )
+            self.size -= excess
+            self.stats["evictions"] += excess
+
+    def embed_documents(self, texts):
+        found, missing = self.lookup("document", texts)
+        if missing:
+            with timed("embed_documents"):
+                vectors = self.inner.embed_documents(missing)
+            self.store("document", missing, vectors)
+            found.update(zip(missing, vectors))
+        return [found[text] for text in texts]
+
+    def embed_query(self, text):
+        found, missing = self.lookup("query", [text])
+        if missing:
+            with timed("embed_query"):
+                vector = self.inner.embed_query(text)
+            self.store("query", [text], [vector])
+            return vector
+        return found[text]
+
+    async def aembed_documents(self, texts):
+        found, missing = await self.alookup("document", texts)
+        if missing:
+            with timed("embed_documents"):
+                vectors = await self.inner.aembed_documents(missing)
+            await asyncio.to_thread(self.store, "document", missing, vectors)
+            found.update(zip(missing, vectors))
+        return [found[text] for text in texts]
+
+    async def aembed_query(self, text):
+        found, missing = await self.alookup("query", [text])
+        if missing:
+            return await self.flights.do(text, lambda: self._aembed_query(text))
+        return found[text]
+
+    async def aembed_queries(self, texts):
+        """Query vectors for many questions; the uncached ones are embedded in one batched request."""
+        found, missing = await self.alookup("query", texts)
+        if missing:
+            with timed("embed_queries"):
+                vectors = await asyncio.to_thread(self._embed_queries, missing)
+            await asyncio.to_thread(self.store, "query", missing, vectors)
+            found.update(zip(missing, vectors))
+        return [found[text] for text in texts]
+
+    def _embed_queries(self, texts):
+        # The Google model needs the query task type that embed_query uses by default
+        if "task_type" in inspect.signature(self.inner.embed_documents).parameters:
+            return self.inner.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+        return self.inner.embed_documents(texts)
+
+    async def _aembed_query(self, text):
+        with timed("embed_query"):
+            vector = await self.inner.aembed_query(text)
+        await asyncio.to_thread(self.store, "query", [text], [vector])
+        return vector
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import random
+import time
+
+# Explicit embedding stage for the build path: chunks are embedded in fixed
+# size batches with bounded concurrency, a token-bucket request limiter and
+# jittered exponential backoff on quota errors and timeouts, and every batch
+# is written to the vector store as soon as its vectors arrive.
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_RATE = float(os.getenv("EMBED_RATE", "10"))  # embedding requests per second, 0 = unlimited
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "60"))  # seconds per batch request, 0 = no limit
+
+_QUOTA_MARKERS = ("429", "quota", "rate limit", "ratelimit", "resource exhausted", "resourceexhausted", "too many requests")
+
+
+def is_quota_error(exc):
+    text = f"{type(exc).__name__} {exc}".lower()
+    return any(marker in text for marker in _QUOTA_MARKERS)
+
+
+def is_retryable(exc):
+    return is_quota_error(exc) or isinstance(exc, (asyncio.TimeoutError, ConnectionError))
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        # Called on a quota error so every caller backs off, not just the one that failed.
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def acquire(self, n=1.0):
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                await asyncio.sleep((n - self.tokens) / self.rate)
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    # "Full jitter": uniform in [0, min(cap, base * 2^attempt)]
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def chroma_writer(vectorstore):
+    def write(ids, docs, vectors):
+        vectorstore._collection.upsert(
+            ids=ids,
+            embeddings=vectors,
+            metadatas=[doc.metadata for doc in docs],
+            documents=[doc.page_content for doc in docs],
+        )
+    return write
+
+
+class EmbeddingStage:
+    def __init__(self, embeddings, write, batch_size=EMBED_BATCH_SIZE, concurrency=EMBED_CONCURRENCY,
+                 rate=EMBED_RATE, max_retries=EMBED_MAX_RETRIES, timeout=EMBED_TIMEOUT):
+        self.embeddings = embeddings
+        self.write = write
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, capacity=concurrency)
+        self.max_retries = max_retries
+        self.timeout = timeout or None
+        self.stats = {"batches": 0, "texts": 0, "retries": 0, "seconds": 0.0}
+
+    async def embed(self, texts):
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                # A hung request times out and is retried with backoff
+                return await asyncio.wait_for(self.embeddings.aembed_documents(texts), self.timeout)
+            except Exception as exc:
+                if attempt >= self.max_retries or not is_retryable(exc):
+                    raise
+                delay = backoff_delay(attempt)
+                if is_quota_error(exc):
+                    self.bucket.pause(delay)
+                self.stats["retries"] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def rebatch(self, items):
+        # items: iterable of (id, Document) in any grouping -> (ids, docs) batches
+        ids, docs = [], []
+        for i, doc in items:
+            ids.append(i)
+            docs.append(doc)
+            if len(ids) >= self.batch_size:
+                yield ids, docs
+                ids, docs = [], []
+        if ids:
+            yield ids, docs
+
+    async def run(self, items):
+        """Embed and write every (id, Document) from items; returns chunks written.
+
+        items may be a slow synchronous generator (e.g. the parsing pool): it is
+        advanced off the event loop, and only when a concurrency slot is free,
+        so a slow embedding API pushes back on parsing instead of buffering.
+        """
+        started = time.monotonic()
+        slots = asyncio.Semaphore(self.concurrency)
+        write_lock = asyncio.Lock()
+        batches = self.rebatch(items)
+        tasks = set()
+        written = 0
+
+        async def process(ids, docs):
+            nonlocal written
+            try:
+                vectors = await self.embed([doc.page_content for doc in docs])
+                async with write_lock:
+                    await asyncio.to_thread(self.write, ids, docs, vectors)
+                written += len(ids)
+                self.stats["batches"] += 1
+                self.stats["texts"] += len(ids)
+            finally:
+                slots.release()
+
+        try:
+            while True:
+                await slots.acquire()
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    slots.release()
+                    break
+                tasks.add(asyncio.create_task(process(*batch)))
+                # Surface failures early instead of after the whole corpus is queued.
+                for task in [t for t in tasks if t.done()]:
+                    tasks.discard(task)
+                    task.result()
+            if tasks:
+                await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            self.stats["seconds"] += time.monotonic() - started
+        return written
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import random
+import time
+from types import SimpleNamespace
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+from typing import Any
+
+# Local stand-ins for the remote providers, used to measure the pipeline
+# offline. Vectors are deterministic per text so results are reproducible.
+
+
+class QuotaExceeded(Exception):
+    def __init__(self):
+        super().__init__("429 Resource exhausted: quota exceeded (fake)")
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self, dim=768, latency=0.0, per_text_latency=0.0, quota_error_rate=0.0, model="fake-embedding", seed=0):
+        self.dim = dim
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.quota_error_rate = quota_error_rate
+        self.model = model
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.texts = 0
+
+    def vector(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        rng = random.Random(digest)
+        return [rng.uniform(-1.0, 1.0) for _ in range(self.dim)]
+
+    def _account(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        if self.quota_error_rate and self.random.random() < self.quota_error_rate:
+            raise QuotaExceeded()
+        return self.latency + self.per_text_latency * len(texts)
+
+    def embed_documents(self, texts):
+        time.sleep(self._account(texts))
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(self._account(texts))
+        return [self.vector(text) for text in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+class ProviderError(Exception):
+    def __init__(self):
+        super().__init__("503 Service unavailable (fake)")
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that answers after `latency` seconds (streamed token by token).
+
+    blocking=True sleeps synchronously even on the async path, which is what a
+    sync client called from an async handler does to the event loop.
+    error_rate fails that share of calls before answering; slow_rate makes
+    that share of calls take slow_latency instead (a latency tail).
+    """
+
+    latency: float = 0.5
+    token_latency: float = 0.0
+    response: str = "This is a stub answer about the candidates in the knowledge base."
+    blocking: bool = False
+    error_rate: float = 0.0
+    slow_rate: float = 0.0
+    slow_latency: float = 5.0
+    seed: int = 0
+    calls: int = 0
+    errors: int = 0
+    _rng: Any = PrivateAttr(default=None)
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _answer(self, messages):
+        self.calls += 1
+        return self.response
+
+    def _delay(self):
+        # Raises for an injected error, else returns this call's latency
+        if self._rng is None:
+            self._rng = random.Random(self.seed)
+        if self.error_rate and self._rng.random() < self.error_rate:
+            self.errors += 1
+            raise ProviderError()
+        return self.slow_latency if self.slow_rate and self._rng.random() < self.slow_rate else self.latency
+
+    def _message(self, messages):
+        # Token counts are approximated by words, enough for the usage metrics
+        answer = self._answer(messages)
+        prompt_tokens = sum(len(str(m.content).split()) for m in messages)
+        usage = {"input_tokens": prompt_tokens, "output_tokens": len(answer.split()),
+                 "total_tokens": prompt_tokens + len(answer.split())}
+        return AIMessage(content=answer, usage_metadata=usage)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._delay())
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.blocking:
+            return self._generate(messages, stop, **kwargs)
+        await asyncio.sleep(self._delay())
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._delay())
+        for i, token in enumerate(self._answer(messages).split(" ")):
+            if self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token if i == 0 else " " + token))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class FakeTogetherClient:
+    """Mimics AsyncTogether.chat.completions.create for the raw /together/chat endpoint."""
+
+    def __init__(self, latency=0.5, response="This is a stub answer."):
+        self.latency = latency
+        self.response = response
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        message = SimpleNamespace(role="assistant", content=self.response)
+        prompt_tokens = sum(len(m["content"].split()) for m in messages)
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(self.response.split()))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
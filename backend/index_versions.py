@@ -0,0 +1,287 @@
+from contextlib import contextmanager
+from numpy_store import VECTOR_BACKEND, index_directory
+import logging
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: builds are serialized within one process only
+    fcntl = None
+
+# Versioned index directories. Every build writes into a fresh version
+# directory (a copy of the serving one, so builds stay incremental), then
+# publishes it by atomically replacing the CURRENT pointer file, and the app
+# swaps its serving index in one assignment. Queries hold a lease on the
+# index they started with; a replaced index is closed and its directory
+# deleted once its last lease is released.
+#
+# Several workers can share INDEX_ROOT: a build holds BUILD_LOCK from
+# prepare() to publish(), so builds run one at a time and each starts from
+# the last one's result; each worker checks CURRENT every
+# INDEX_CHECK_INTERVAL seconds and swaps in a version another worker
+# published; and every worker leaves a lease file for each version it
+# serves, which gc() in any worker leaves alone.
+#
+#   <INDEX_ROOT>/<backend>/CURRENT      name of the serving version, e.g. v000003
+#   <INDEX_ROOT>/<backend>/v000003/     vector store, manifest, BM25 and candidate files
+#   <INDEX_ROOT>/<backend>/leases/      v000003.<host>.<pid> per worker serving v000003
+
+logger = logging.getLogger(__name__)
+
+INDEX_ROOT = os.getenv("INDEX_ROOT", "./indexes")
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "1"))  # previous versions kept on disk for rollback
+INDEX_CHECK_INTERVAL = float(os.getenv("INDEX_CHECK_INTERVAL", "1"))  # seconds between checks for newer versions
+
+VERSION_RE = re.compile(r"^v(\d+)$")
+
+
+def version_number(path):
+    # 0 for the unversioned legacy directory
+    match = path and VERSION_RE.match(os.path.basename(path))
+    return int(match.group(1)) if match else 0
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists, owned by someone else
+    return True
+
+
+class IndexVersions:
+    def __init__(self, root, legacy=None):
+        self.root = root
+        self.legacy = legacy  # unversioned directory served until the first build publishes
+        self.leases = os.path.join(root, "leases")
+        os.makedirs(self.leases, exist_ok=True)
+        self.building = threading.Lock()  # this process's share of BUILD_LOCK
+        self.build_lock = None
+
+    def versions(self):
+        """Version directory names, oldest first."""
+        return sorted((name for name in os.listdir(self.root) if VERSION_RE.match(name)),
+                      key=lambda name: int(name[1:]))
+
+    def current(self):
+        pointer = os.path.join(self.root, "CURRENT")
+        if os.path.exists(pointer):
+            with open(pointer, "r", encoding="utf-8") as f:
+                name = f.read().strip()
+            if os.path.isdir(os.path.join(self.root, name)):
+                return os.path.join(self.root, name)
+            logger.warning("CURRENT points at missing version %s", name)
+        return self.legacy
+
+    def prepare(self, copy=True):
+        """Create the next version directory, seeded with the serving one.
+
+        Blocks while another build (in any worker) is between prepare() and
+        publish() / discard(), and holds the build lock until then.
+        """
+        self._lock()
+        try:
+            while True:
+                versions = self.versions()
+                path = os.path.join(self.root, f"v{int(versions[-1][1:]) + 1 if versions else 1:06d}")
+                try:
+                    os.mkdir(path)  # claims the name, even against a writer not taking the lock
+                    break
+                except FileExistsError:
+                    continue
+            source = self.current()
+            if copy and source and os.path.isdir(source):
+                # Readers never write, so copying under load is consistent.
+                shutil.copytree(source, path, dirs_exist_ok=True)
+            return path
+        except BaseException:
+            self._unlock()
+            raise
+
+    def publish(self, path):
+        pointer = os.path.join(self.root, "CURRENT")
+        with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+            f.write(os.path.basename(path))
+        os.replace(pointer + ".tmp", pointer)
+        self._unlock()
+
+    def discard(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+        self._unlock()
+
+    def _lock(self):
+        self.building.acquire()
+        if fcntl is not None:
+            self.build_lock = open(os.path.join(self.root, "BUILD_LOCK"), "a")
+            fcntl.flock(self.build_lock, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        if not self.building.locked():
+            return
+        if self.build_lock is not None:
+            self.build_lock.close()  # releases the flock
+            self.build_lock = None
+        self.building.release()
+
+    def _lease_name(self, path):
+        return f"{os.path.basename(path)}.{socket.gethostname()}.{os.getpid()}"
+
+    def hold(self, path):
+        """Record that this process serves path, so no worker's gc() deletes it."""
+        if VERSION_RE.match(os.path.basename(path)):
+            open(os.path.join(self.leases, self._lease_name(path)), "a").close()
+
+    def drop(self, path):
+        try:
+            os.remove(os.path.join(self.leases, self._lease_name(path)))
+        except FileNotFoundError:
+            pass
+
+    def leased(self):
+        """Version names some live worker serves; leases of dead local workers are cleared."""
+        host, names = socket.gethostname(), set()
+        for entry in os.listdir(self.leases):
+            name, _, rest = entry.partition(".")
+            lease_host, _, pid = rest.rpartition(".")
+            if lease_host == host and pid.isdigit() and not _alive(int(pid)):
+                self._remove_lease(entry)
+                continue
+            names.add(name)
+        return names
+
+    def _remove_lease(self, entry):
+        try:
+            os.remove(os.path.join(self.leases, entry))
+        except FileNotFoundError:
+            pass
+
+    def gc(self, in_use=(), keep=INDEX_KEEP_VERSIONS):
+        """Delete versions older than the current one, except the ones any worker still serves and the newest `keep`."""
+        current = self.current()
+        if not current or not VERSION_RE.match(os.path.basename(current)):
+            return  # nothing published yet
+        busy = {os.path.abspath(p) for p in in_use if p}
+        leased = self.leased()  # by any worker
+        # Newer ones are builds still being prepared
+        old = [name for name in self.versions() if int(name[1:]) < version_number(current)
+               and name not in leased and os.path.abspath(os.path.join(self.root, name)) not in busy]
+        for name in old[:max(0, len(old) - keep)]:
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+
+def index_versions(backend=VECTOR_BACKEND):
+    return IndexVersions(os.path.join(INDEX_ROOT, backend), legacy=index_directory(backend))
+
+
+class ServingIndex:
+    """The objects queries run against, all opened from one version directory."""
+
+    def __init__(self, path, on_close=None, **parts):
+        self.path = path
+        self.on_close = on_close
+        self.leases = 0
+        self.retired = False
+        self.closed = False
+        self.__dict__.update(parts)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.on_close:
+            try:
+                self.on_close(self)
+            except Exception:
+                logger.exception("Closing index %s failed", self.path)
+
+
+class SwappableIndex:
+    def __init__(self, index, versions, opener=None, check_interval=INDEX_CHECK_INTERVAL):
+        self.current = index
+        self.versions = versions
+        self.opener = opener  # path -> ServingIndex, to follow versions other workers publish
+        self.check_interval = check_interval
+        self.checked = time.monotonic()
+        self.following = False
+        self.draining = []  # replaced indexes with queries still running
+        self.lock = threading.Lock()
+        versions.hold(index.path)
+
+    @contextmanager
+    def lease(self):
+        self._follow()
+        with self.lock:
+            index = self.current
+            index.leases += 1
+        try:
+            yield index
+        finally:
+            with self.lock:
+                index.leases -= 1
+                done = index.retired and not index.leases
+            if done:
+                self._release(index)
+
+    def swap(self, index):
+        self.versions.hold(index.path)
+        with self.lock:
+            old, self.current = self.current, index
+            old.retired = True
+            done = not old.leases
+            if not done:
+                self.draining.append(old)
+        if done:
+            self._release(old)
+        return old
+
+    def _release(self, index):
+        index.close()
+        with self.lock:
+            if index in self.draining:
+                self.draining.remove(index)
+            in_use = [self.current.path] + [i.path for i in self.draining]
+        if os.path.abspath(index.path) not in {os.path.abspath(p) for p in in_use}:
+            self.versions.drop(index.path)
+        self.versions.gc(in_use)
+
+    def _follow(self):
+        # At most every check_interval seconds, look for a version another
+        # worker has published; it is opened in a thread while queries keep
+        # using the current one. Builds in this worker swap for themselves.
+        now = time.monotonic()
+        if self.opener is None or now - self.checked < self.check_interval or self.versions.building.locked():
+            return
+        with self.lock:
+            if self.following:
+                return
+            self.checked, self.following = now, True
+        threading.Thread(target=self._reload, name="index-follower", daemon=True).start()
+
+    def _reload(self):
+        try:
+            path = self.versions.current()
+            if version_number(path) <= version_number(self.current.path):
+                return
+            self.versions.hold(path)  # before opening, so it can't be collected meanwhile
+            if not os.path.isdir(path):
+                self.versions.drop(path)
+                return
+            index = self.opener(path)
+            if version_number(path) > version_number(self.current.path):
+                logger.info("Serving index %s published by another worker", os.path.basename(path))
+                self.swap(index)
+            else:
+                index.close()  # this worker swapped in the same or a newer one meanwhile
+                if os.path.abspath(path) != os.path.abspath(self.current.path):
+                    self.versions.drop(path)
+        except Exception:
+            logger.exception("Following the published index failed")
+        finally:
+            self.following = False
@@ -0,0 +1,127 @@
+from concurrent.futures import ProcessPoolExecutor
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.document_loaders.parsers.pdf import PyPDFParser
+from langchain_core.documents.base import Blob
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from cv_metadata import extract_cv_metadata
+from manifest import open_zip
+import multiprocessing
+import os
+import queue
+import threading
+import zipfile
+
+# Parsing + chunking pipeline. PDF parsing is CPU-bound, so files are spread
+# over a process pool and results are yielded as soon as each file is done.
+# A source is a PDF path, or (zip path, member) for a PDF inside an archive,
+# which is read straight from the zip without extracting it.
+
+# Bump when the chunk text or metadata layout changes; /build then re-indexes
+# everything once (vectors come back from the embedding cache).
+INGEST_SCHEMA = 2
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+# The server has threads running (event loop, embedding stage, job queue), and
+# forking a threaded process can deadlock the child, so workers are started
+# from a clean process instead.
+INGEST_START_METHOD = os.getenv(
+    "INGEST_START_METHOD", "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+_splitters = {}
+
+
+def iter_sources(path):
+    """(name, source) for a PDF, or for every PDF member of a zip."""
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            members = [m.filename for m in archive.infolist()
+                       if not m.is_dir() and m.filename.lower().endswith(".pdf")]
+        for member in members:
+            yield os.path.basename(member), (path, member)
+    elif path.lower().endswith(".pdf"):
+        yield os.path.basename(path), path
+
+
+def load_pdf(source):
+    if isinstance(source, str):
+        return PyPDFLoader(source).load()
+    # One member in memory at a time, parsed like PyPDFLoader would
+    zip_path, member = source
+    data = open_zip(zip_path).read(member)
+    return list(PyPDFParser().lazy_parse(Blob.from_data(data, path=os.path.join(zip_path, member))))
+
+
+def split_documents(pages, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    key = (chunk_size, chunk_overlap)
+    if key not in _splitters:
+        _splitters[key] = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return _splitters[key].split_documents(pages)
+
+
+def parse_and_split(name, source, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    # Worker entry point: must stay a module-level function so it pickles.
+    pages = load_pdf(source)
+    cv = extract_cv_metadata("\n".join(page.page_content for page in pages))
+    for page in pages:
+        # Chroma metadata values must be scalars, so skills travel as one string.
+        page.metadata.update(file=name, candidate=cv["candidate"], role=cv["role"], skills=", ".join(cv["skills"]))
+    return name, split_documents(pages, chunk_size, chunk_overlap)
+
+
+def iter_parsed(files, workers=INGEST_WORKERS, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Yield (name, chunks) in completion order.
+
+    files is a {name: source} dict or an iterable of (name, source) pairs,
+    which may block between items (e.g. files still being uploaded).
+    """
+    if isinstance(files, dict):
+        files = list(files.items())
+        if len(files) <= 1:
+            workers = 1
+    if workers <= 1:
+        for name, source in files:
+            yield parse_and_split(name, source, chunk_size, chunk_overlap)
+        return
+
+    # A feeder thread submits files as they arrive while finished results are
+    # yielded here. Only a small window of files is in flight, so results are
+    # consumed (and freed) instead of piling up for the whole corpus.
+    window = threading.Semaphore(workers * 2)
+    results = queue.Queue()
+    stop = threading.Event()
+    end = object()
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(INGEST_START_METHOD)) as pool:
+        def feed():
+            submitted = 0
+            try:
+                for name, source in files:
+                    while not window.acquire(timeout=0.5):
+                        if stop.is_set():
+                            return
+                    if stop.is_set():
+                        return
+                    pool.submit(parse_and_split, name, source, chunk_size, chunk_overlap).add_done_callback(results.put)
+                    submitted += 1
+            except BaseException as e:
+                results.put(e)
+            finally:
+                results.put((end, submitted))
+
+        threading.Thread(target=feed, daemon=True).start()
+        total, done = None, 0
+        try:
+            while total is None or done < total:
+                item = results.get()
+                if isinstance(item, tuple) and item[0] is end:
+                    total = item[1]
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    window.release()
+                    done += 1
+                    yield item.result()
+        finally:
+            stop.set()
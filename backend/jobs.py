@@ -0,0 +1,161 @@
+from collections import OrderedDict
+from state import STATE_BACKEND, shared_state
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+
+# Background jobs for knowledge-base builds. /build only enqueues; a single
+# worker task runs builds one at a time (they all write the same index),
+# while parsing and embedding inside a build already run in the process
+# pool and worker threads, so chat requests keep being served meanwhile.
+# With a shared state backend (STATE_BACKEND, see state.py) every job's
+# status is written behind to it as it changes, so GET /build/{id} is
+# answered by whichever worker the request lands on.
+
+logger = logging.getLogger(__name__)
+
+BUILD_JOBS_KEPT = int(os.getenv("BUILD_JOBS_KEPT", "50"))  # finished jobs remembered for status queries
+BUILD_JOBS_TTL = float(os.getenv("BUILD_JOBS_TTL", str(24 * 3600)))  # seconds a job's status stays in shared state
+
+
+class Job:
+    def __init__(self, kind, params, payload=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.payload = payload  # runner-only input, not reported (e.g. a feed of uploaded files)
+        self.status = "queued"  # queued | running | done | failed
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.progress = {"stage": "queued", "files_total": 0, "files_parsed": 0,
+                         "chunks_found": 0, "chunks_embedded": 0}
+        self.on_change = None
+
+    def update(self, **progress):
+        self.progress.update(progress)
+        self.changed()
+
+    def advance(self, key, n=1):
+        self.progress[key] += n
+        self.changed()
+
+    def changed(self):
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def eta_seconds(self):
+        # Extrapolate the chunk count from the files parsed so far, then the
+        # remaining time from the embedding rate so far.
+        p = self.progress
+        if self.status != "running" or not p["files_parsed"] or not p["chunks_embedded"]:
+            return None
+        expected = p["chunks_found"] / p["files_parsed"] * p["files_total"]
+        elapsed = time.time() - self.started
+        return round(max(0.0, elapsed / p["chunks_embedded"] * (expected - p["chunks_embedded"])), 1)
+
+    def snapshot(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "elapsed_seconds": round((self.finished or time.time()) - self.started, 2) if self.started else None,
+            "progress": dict(self.progress),
+            "eta_seconds": self.eta_seconds(),
+            "result": self.result,
+            "error": self.error,
+        }
+
+    def dump(self):
+        return json.dumps(self.snapshot())
+
+
+class JobQueue:
+    def __init__(self, runner, kept=BUILD_JOBS_KEPT, state=None, name="build_jobs"):
+        self.runner = runner  # async fn(job) -> result
+        self.kept = kept
+        self.jobs = OrderedDict()  # id -> Job, oldest first
+        self.queue = None
+        self.worker = None
+        self.state = state or shared_state(STATE_BACKEND)
+        self.prefix = f"{name}:"
+        self.log = f"{name}:log"  # ids of recent jobs, from every worker
+
+    def submit(self, kind, params, payload=None):
+        # The same build already waiting is not queued twice.
+        for job in self.jobs.values():
+            if job.status == "queued" and job.kind == kind and job.params == params and payload is None:
+                return job
+        if self.worker is None or self.worker.done():
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.create_task(self._work())
+            for job in self.jobs.values():
+                if job.status == "queued":
+                    self.queue.put_nowait(job)
+        job = Job(kind, params, payload)
+        self.jobs[job.id] = job
+        if self.state is not None:
+            job.on_change = self._publish
+            self.state.append(self.log, job.id, self.kept)
+            self._publish(job)
+        self.queue.put_nowait(job)
+        self._forget()
+        return job
+
+    def _publish(self, job):
+        # Serialized by the state writer, so a burst of progress updates is one write
+        self.state.put(self.prefix + job.id, job.dump, BUILD_JOBS_TTL)
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def snapshot(self, job_id):
+        """Status of a job run by any worker, None if unknown."""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.snapshot()
+        entry = self.state.get(self.prefix + job_id) if self.state is not None else None
+        return json.loads(entry[0]) if entry else None
+
+    def list(self):
+        jobs = {job.id: job.snapshot() for job in self.jobs.values()}
+        if self.state is not None:
+            ids, _ = self.state.read_log(self.log, None)
+            for job_id in ids:
+                if job_id not in jobs:
+                    snapshot = self.snapshot(job_id)
+                    if snapshot is not None:
+                        jobs[job_id] = snapshot
+        return sorted(jobs.values(), key=lambda job: job["created"], reverse=True)
+
+    def _forget(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in ("done", "failed")]
+        for job_id in finished[:max(0, len(finished) - self.kept)]:
+            del self.jobs[job_id]
+
+    async def _work(self):
+        while True:
+            job = await self.queue.get()
+            job.status, job.started = "running", time.time()
+            job.update(stage="starting")
+            try:
+                job.result = await self.runner(job)
+                job.status = "done"
+                job.update(stage="done")
+            except Exception as e:
+                logger.exception("Job %s failed", job.id)
+                job.status, job.error = "failed", str(e)
+                job.update(stage="failed")
+            finally:
+                job.finished = time.time()
+                job.changed()
+                self._forget()
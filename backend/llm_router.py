@@ -0,0 +1,357 @@
+from collections import deque
+from functools import partial
+from langchain_core.language_models.chat_models import BaseChatModel, agenerate_from_stream
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from metrics import REGISTRY
+from startup import lazy
+from typing import Any, List
+import asyncio
+import logging
+import math
+import os
+import time
+
+# One chat model in front of several LLM providers (Gemini, Together, ...).
+# Providers are tried in order: one that errors, times out or has an open
+# circuit breaker is skipped and the next one answers (failover). With
+# LLM_HEDGE=1 a second provider is also started when the first has not
+# produced a token within its recent p95, and whichever streams first wins.
+# Failover and hedging only happen before the first token; a stream that
+# breaks midway raises. Timeouts are per provider: LLM_TIMEOUT_<NAME>
+# overrides LLM_TIMEOUT (same for LLM_FIRST_TOKEN_TIMEOUT).
+
+logger = logging.getLogger(__name__)
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # seconds for a whole answer
+LLM_FIRST_TOKEN_TIMEOUT = float(os.getenv("LLM_FIRST_TOKEN_TIMEOUT", "20"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))  # consecutive failures that open it
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))  # seconds before a trial call
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "2.0"))  # until there are enough samples for a p95
+LLM_HEDGE_MIN_SAMPLES = 20
+
+GEMINI_MODEL = "gemini-1.5-flash"
+TOGETHER_MODEL = "meta-llama/Llama-3.3-70B-Instruct-Turbo-Free"
+API_KEYS = {"gemini": "GOOGLE_API_KEY", "together": "TOGETHER_API_KEY"}
+
+ROUTER_EVENTS = REGISTRY.counter("llm_router_events_total", "LLM router outcomes per provider", ["provider", "event"])
+
+
+def provider_setting(name, key, default):
+    return float(os.getenv(f"LLM_{key}_{name.upper()}", default))
+
+
+class ProvidersUnavailable(RuntimeError):
+    def __init__(self, errors, retry_after=None):
+        self.errors = errors  # [(provider, exception)]
+        self.retry_after = retry_after
+        detail = "; ".join(f"{name}: {error!r}" for name, error in errors) or "all circuit breakers open"
+        super().__init__(f"No LLM provider available ({detail})")
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive errors -> one trial call after `cooldown`."""
+
+    def __init__(self, failures=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN):
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.trial or self.retry_in() == 0 else "open"
+
+    def retry_in(self):
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if self.trial or self.retry_in() > 0:
+            return False
+        self.trial = True
+        return True
+
+    def success(self):
+        self.failures, self.opened_at, self.trial = 0, None, False
+
+    def failure(self):
+        self.failures += 1
+        if self.trial or self.failures >= self.max_failures:
+            self.opened_at, self.trial = time.monotonic(), False
+
+    def release(self):
+        # A trial call that was cancelled (lost a hedge) proves nothing
+        self.trial = False
+
+
+class Provider:
+    def __init__(self, name, model, timeout=None, first_token_timeout=None):
+        self.name = name
+        self.model = model
+        self.timeout = timeout or provider_setting(name, "TIMEOUT", LLM_TIMEOUT)
+        self.first_token_timeout = first_token_timeout or provider_setting(
+            name, "FIRST_TOKEN_TIMEOUT", LLM_FIRST_TOKEN_TIMEOUT)
+        self.breaker = CircuitBreaker()
+        self.first_token = deque(maxlen=200)  # recent seconds to first token
+
+    def hedge_delay(self):
+        if len(self.first_token) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_AFTER
+        ordered = sorted(self.first_token)
+        return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+    def succeeded(self):
+        self.breaker.success()
+        ROUTER_EVENTS.inc(provider=self.name, event="success")
+
+    def failed(self, error):
+        self.breaker.failure()
+        event = "timeout" if isinstance(error, asyncio.TimeoutError) else "error"
+        ROUTER_EVENTS.inc(provider=self.name, event=event)
+        logger.warning("LLM provider %s failed: %r", self.name, error)
+
+
+class Attempt:
+    """One provider's stream, started and waiting for its first chunk."""
+
+    def __init__(self, provider, messages, stop, kwargs):
+        self.provider = provider
+        self.started = time.monotonic()
+        # No callbacks: the router's own run is the one that gets timed / traced
+        self.stream = provider.model.astream(messages, stop=stop, config={"callbacks": []}, **kwargs)
+        self.first = asyncio.ensure_future(self._first())
+
+    async def _first(self):
+        try:
+            return await asyncio.wait_for(self.stream.__anext__(), self.provider.first_token_timeout)
+        except StopAsyncIteration:
+            return None
+
+    async def close(self):
+        self.first.cancel()
+        await asyncio.gather(self.first, return_exceptions=True)
+        await self.stream.aclose()
+
+
+def tagged(chunk, provider):
+    # Only the first chunk carries the provider: chunk metadata is merged by
+    # concatenating strings.
+    return ChatGenerationChunk(message=AIMessageChunk(
+        content=chunk.content, usage_metadata=getattr(chunk, "usage_metadata", None),
+        response_metadata={**chunk.response_metadata, "provider": provider.name} if provider else chunk.response_metadata,
+    ))
+
+
+class LLMRouter(BaseChatModel):
+    providers: List[Any]  # Provider, in order of preference
+    hedge: bool = LLM_HEDGE
+
+    @classmethod
+    def from_models(cls, models, order=None, **kwargs):
+        """models: {name: chat model}, tried in `order` (default: as given)."""
+        providers = [Provider(name, models[name]) for name in (order or models) if name in models]
+        if not providers:
+            raise ValueError("No LLM provider configured")
+        return cls(providers=providers, **kwargs)
+
+    @property
+    def _llm_type(self):
+        return "llm-router"
+
+    @property
+    def _identifying_params(self):
+        return {"providers": [provider.name for provider in self.providers], "hedge": self.hedge}
+
+    def retry_after(self):
+        return min((provider.breaker.retry_in() for provider in self.providers), default=0.0)
+
+    def breaker_states(self):
+        return {(provider.name,): {"closed": 0, "half_open": 1, "open": 2}[provider.breaker.state]
+                for provider in self.providers}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        # Sync callers get failover only (no hedging, no timeouts of our own).
+        errors = []
+        for provider in self.providers:
+            if not provider.breaker.allow():
+                continue
+            try:
+                message = provider.model.invoke(messages, stop=stop, config={"callbacks": []}, **kwargs)
+            except NotImplementedError as e:
+                # An async-only model (ClientChatModel) isn't a failing provider
+                provider.breaker.release()
+                ROUTER_EVENTS.inc(provider=provider.name, event="skipped_sync")
+                errors.append((provider.name, e))
+                continue
+            except Exception as e:
+                provider.failed(e)
+                errors.append((provider.name, e))
+                continue
+            provider.succeeded()
+            message = AIMessage(content=message.content, usage_metadata=getattr(message, "usage_metadata", None),
+                                response_metadata={**message.response_metadata, "provider": provider.name})
+            return ChatResult(generations=[ChatGeneration(message=message)])
+        raise ProvidersUnavailable(errors, self.retry_after())
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        return await agenerate_from_stream(self._astream(messages, stop, run_manager, **kwargs))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        winner, first = await self._race(messages, stop, kwargs)
+        provider = winner.provider
+        resolved = False
+        try:
+            chunk = tagged(first, provider) if first is not None else None
+            while chunk is not None:
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+                remaining = winner.started + provider.timeout - time.monotonic()
+                try:
+                    chunk = tagged(await asyncio.wait_for(winner.stream.__anext__(), max(remaining, 0.001)), None)
+                except StopAsyncIteration:
+                    chunk = None
+            provider.succeeded()
+            resolved = True
+        except Exception as e:
+            provider.failed(e)
+            resolved = True
+            raise
+        finally:
+            # Cancelled or closed by the consumer (GeneratorExit) mid-answer:
+            # neither outcome, but a half-open trial must not stay taken
+            if not resolved:
+                provider.breaker.release()
+            await winner.stream.aclose()
+
+    async def _race(self, messages, stop, kwargs):
+        """Start providers (failing over, hedging) until one yields a first chunk."""
+        queue = list(self.providers)
+        running, errors = {}, []
+
+        def launch():
+            while queue:
+                provider = queue.pop(0)
+                if provider.breaker.allow():
+                    attempt = Attempt(provider, messages, stop, kwargs)
+                    running[attempt.first] = attempt
+                    return attempt
+                ROUTER_EVENTS.inc(provider=provider.name, event="skipped_open")
+            return None
+
+        launch()
+        hedged = False
+        try:
+            while True:
+                if not running:
+                    raise ProvidersUnavailable(errors, self.retry_after())
+                timeout = None
+                if self.hedge and not hedged and queue:
+                    oldest = min(running.values(), key=lambda a: a.started)
+                    timeout = max(0.0, oldest.started + oldest.provider.hedge_delay() - time.monotonic())
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    attempt = launch()
+                    if attempt:
+                        ROUTER_EVENTS.inc(provider=attempt.provider.name, event="hedge")
+                    continue
+                for task in done:
+                    attempt = running.pop(task)
+                    if task.exception() is None:
+                        attempt.provider.first_token.append(time.monotonic() - attempt.started)
+                        return attempt, task.result()
+                    attempt.provider.failed(task.exception())
+                    errors.append((attempt.provider.name, task.exception()))
+                    await attempt.stream.aclose()
+                if not running:
+                    attempt = launch()
+                    if attempt:
+                        ROUTER_EVENTS.inc(provider=attempt.provider.name, event="failover")
+        finally:
+            # Hedge losers (and everything, if the caller went away)
+            for attempt in running.values():
+                attempt.provider.breaker.release()
+                await attempt.close()
+
+
+class ClientChatModel(BaseChatModel):
+    """Chat model over an OpenAI-style async client (client.chat.completions.create), e.g. AsyncTogether."""
+
+    client: Any
+    model: str
+
+    @property
+    def _llm_type(self):
+        return "openai-client"
+
+    @property
+    def _identifying_params(self):
+        return {"model": self.model}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError("ClientChatModel wraps an async client; use ainvoke / astream")
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        roles = {"human": "user", "ai": "assistant", "system": "system"}
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": roles.get(m.type, "user"), "content": m.content} for m in messages],
+            **({"stop": stop} if stop else {}),
+        )
+        usage = None
+        if getattr(response, "usage", None):
+            usage = {"input_tokens": response.usage.prompt_tokens, "output_tokens": response.usage.completion_tokens,
+                     "total_tokens": response.usage.prompt_tokens + response.usage.completion_tokens}
+        message = AIMessage(content=response.choices[0].message.content, usage_metadata=usage,
+                            response_metadata={"model_name": self.model})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def build_model(name, temperature=0, http_async_client=None):
+    if name == "gemini":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(model=GEMINI_MODEL, google_api_key=os.getenv("GOOGLE_API_KEY"),
+                                      temperature=temperature)
+    if name == "together":
+        from langchain_together import ChatTogether
+        return ChatTogether(model=TOGETHER_MODEL, api_key=os.getenv("TOGETHER_API_KEY"), temperature=temperature,
+                            http_async_client=http_async_client)
+    raise ValueError(f"Unknown LLM provider {name!r}")
+
+
+def build_router(order, temperature=0, http_async_client=None, name="llm", **models):
+    """Router over `order` (LLM_PROVIDERS overrides it): the first provider
+    always, the others only when their API key is set. Keyword arguments
+    replace a provider's default model. Default models are built on first
+    use (or at warm-up) as startup components "<name>.<provider>"."""
+    order = [name.strip() for name in (os.getenv("LLM_PROVIDERS") or ",".join(order)).split(",")]
+    built = {}
+    for i, provider in enumerate(order):
+        if provider in models:
+            built[provider] = models[provider]
+        elif i == 0 or os.getenv(API_KEYS.get(provider, "")):
+            built[provider] = lazy(f"{name}.{provider}", partial(build_model, provider, temperature, http_async_client))
+    return LLMRouter.from_models(built, order)
+
+
+def providers_unavailable(request, exc):
+    """FastAPI exception handler: every provider failed or is cooling down -> 503."""
+    from fastapi.responses import JSONResponse
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after or 0)))})
+
+
+def register_routers(routers):
+    """Breaker state gauge for {name: LLMRouter}."""
+    REGISTRY.gauge("llm_breaker_state", "Circuit breaker per provider (0 closed, 1 half open, 2 open)",
+                   lambda: {(name, *key): value for name, router in routers.items()
+                            for key, value in router.breaker_states().items()}, ["router", "provider"])
@@ -0,0 +1,108 @@
+from functools import lru_cache
+import hashlib
+import json
+import os
+import zipfile
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=8)
+def _open_zip(path, mtime_ns, size, pid):
+    return zipfile.ZipFile(path)
+
+
+def open_zip(path):
+    """Shared read-only handle on an archive, reopened when the file changes.
+
+    Opening a zip parses its whole central directory, so opening it once per
+    member is quadratic for a 10k-CV archive. Keyed by pid too: a forked
+    parsing worker must not share the parent's file offset.
+    """
+    stat = os.stat(path)
+    return _open_zip(path, stat.st_mtime_ns, stat.st_size, os.getpid())
+
+
+def source_sha256(source, block_size=1 << 20):
+    # source: a file path, or (zip path, member name) for a file inside an archive
+    if isinstance(source, str):
+        return file_sha256(source, block_size)
+    digest = hashlib.sha256()
+    with open_zip(source[0]).open(source[1]) as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_ids(name, texts):
+    # Stable ids: same file + same chunk text -> same id, so unchanged chunks
+    # of an edited CV keep their vectors. Repeated texts get an occurrence suffix.
+    seen = {}
+    ids = []
+    for text in texts:
+        h = text_sha256(text)
+        n = seen.get(h, 0)
+        seen[h] = n + 1
+        ids.append(text_sha256(f"{name}\0{h}\0{n}"))
+    return ids
+
+
+class Manifest:
+    """Per-file and per-chunk content hashes of everything in the vector store.
+
+    Layout: {"version": <n>, "schema": <n>, "files": {name: {"sha256": <file hash>, "chunks": [<chunk id>, ...]}}}
+    "version" is bumped by every build that changes the store, so caches
+    keyed on it go stale automatically. "schema" is the ingest layout the
+    chunks were produced with.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.exists = os.path.exists(path)
+        self.files = {}
+        self.version = 0
+        self.schema = 0
+        if self.exists:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.version = data.get("version", 0)
+            self.schema = data.get("schema", 1)
+
+    def diff(self, current):
+        # current: {name: sha256} of the files on disk right now
+        changed = [name for name, sha in current.items()
+                   if self.files.get(name, {}).get("sha256") != sha]
+        removed = [name for name in self.files if name not in current]
+        unchanged = [name for name in current if name not in changed]
+        return changed, removed, unchanged
+
+    def is_current(self, name, sha):
+        return self.files.get(name, {}).get("sha256") == sha
+
+    def chunks(self, name):
+        return self.files.get(name, {}).get("chunks", [])
+
+    def set(self, name, sha, ids):
+        self.files[name] = {"sha256": sha, "chunks": list(ids)}
+
+    def remove(self, name):
+        return self.files.pop(name, {}).get("chunks", [])
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "schema": self.schema, "files": self.files}, f, indent=1)
+        os.replace(tmp, self.path)
+        self.exists = True
@@ -0,0 +1,281 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from langchain_core.callbacks import BaseCallbackHandler
+import bisect
+import logging
+import os
+import threading
+import time
+import uuid
+
+# Per-stage latency, token and cache metrics in the Prometheus text format,
+# served by GET /metrics. Stages are timed with `timed()` or by StageTimer,
+# a LangChain callback handler attached to the chains (retriever, prompt,
+# LLM). Every request also gets a trace id (X-Request-ID), which is added
+# to log lines when LOG_TRACE_IDS=1.
+
+LOG_TRACE_IDS = os.getenv("LOG_TRACE_IDS", "0") == "1"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+trace_id = ContextVar("trace_id", default="-")
+
+
+def _escape(value):
+    # Label values as the Prometheus text format wants them
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, _labels(self.labelnames, key), value) for key, value in self.values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self.lock:
+            row = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def samples(self):
+        out = []
+        with self.lock:
+            for key, row in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, row):
+                    cumulative += count
+                    out.append((f"{self.name}_bucket", _labels(self.labelnames + ("le",), key + (bound,)), cumulative))
+                out.append((f"{self.name}_bucket", _labels(self.labelnames + ("le",), key + ("+Inf",)), row[-1]))
+                out.append((f"{self.name}_sum", _labels(self.labelnames, key), row[-2]))
+                out.append((f"{self.name}_count", _labels(self.labelnames, key), row[-1]))
+        return out
+
+
+class Gauge:
+    """Read at scrape time from fn() -> {label tuple: value} (or a plain number)."""
+
+    def __init__(self, name, help, fn, labelnames=(), kind="gauge"):
+        self.name, self.help, self.fn, self.labelnames, self.kind = name, help, fn, tuple(labelnames), kind
+
+    def samples(self):
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, _labels(self.labelnames, key), value) for key, value in values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        # Re-registering a name (e.g. a module imported twice) keeps the first
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, fn, labelnames=(), kind="gauge"):
+        # Gauges read live objects, so a later registration replaces the earlier one
+        self.metrics[name] = Gauge(name, help, fn, labelnames, kind)
+        return self.metrics[name]
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("rag_stage_seconds", "Time spent in each pipeline stage", ["stage"])
+REQUEST_SECONDS = REGISTRY.histogram("http_request_seconds", "HTTP request latency", ["method", "path", "status"])
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "LLM tokens per direction", ["model", "kind"])
+
+
+def register_caches(caches):
+    """Expose the .stats counters of {name: cache} plus a hit ratio where it has hits and misses."""
+    def events():
+        return {(name, outcome): value for name, cache in caches.items() for outcome, value in cache.stats.items()}
+
+    def hit_ratio():
+        ratios = {}
+        for name, cache in caches.items():
+            hits = sum(v for k, v in cache.stats.items() if k.endswith("hits"))
+            if "misses" in cache.stats and hits + cache.stats["misses"]:
+                ratios[(name,)] = hits / (hits + cache.stats["misses"])
+        return ratios
+
+    REGISTRY.gauge("cache_events_total", "Cache events by outcome", events, ["cache", "outcome"], kind="counter")
+    REGISTRY.gauge("cache_hit_ratio", "Cache hits / lookups since start", hit_ratio, ["cache"])
+
+
+def register_limiter(limiter, name="llm"):
+    REGISTRY.gauge("limiter_state", "LLM scheduler state: slots in use, queue depth by priority",
+                   lambda: {(name, key): value for key, value in limiter.stats().items()}, ["limiter", "field"])
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def _model_name(serialized, kwargs):
+    params = kwargs.get("invocation_params") or {}
+    return str(params.get("model") or params.get("model_name") or (serialized or {}).get("name") or "llm")
+
+
+class StageTimer(BaseCallbackHandler):
+    """Times retriever, prompt and LLM runs (and the LLM's first token), counts tokens."""
+
+    run_inline = True  # only dict updates, no need for a thread hop
+
+    def __init__(self):
+        self.started = {}  # run_id -> (stage, start, model)
+        self.first_token = set()  # streaming LLM runs whose first token was seen
+
+    def _start(self, run_id, stage, model=None):
+        self.started[run_id] = (stage, time.perf_counter(), model)
+
+    def _end(self, run_id):
+        entry = self.started.pop(run_id, None)
+        self.first_token.discard(run_id)
+        if entry:
+            STAGE_SECONDS.observe(time.perf_counter() - entry[1], stage=entry[0])
+        return entry
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id, "retrieve")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        if kwargs.get("run_type") == "prompt":
+            self._start(run_id, "prompt")
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        if run_id in self.started:
+            self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        if run_id in self.started:
+            self._end(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "llm", _model_name(serialized, kwargs))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "llm", _model_name(serialized, kwargs))
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        entry = self.started.get(run_id)
+        if entry and run_id not in self.first_token:
+            self.first_token.add(run_id)
+            STAGE_SECONDS.observe(time.perf_counter() - entry[1], stage="llm_first_token")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        entry = self._end(run_id)
+        model = entry[2] if entry else "llm"
+        usage = {}
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                metadata = getattr(message, "usage_metadata", None)
+                if metadata:
+                    usage = metadata
+                # The LLM router reports which provider actually answered
+                model = getattr(message, "response_metadata", {}).get("provider", model)
+        if not usage:
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            usage = {"input_tokens": usage.get("prompt_tokens", 0), "output_tokens": usage.get("completion_tokens", 0)}
+        LLM_TOKENS.inc(usage.get("input_tokens", 0), model=model, kind="prompt")
+        LLM_TOKENS.inc(usage.get("output_tokens", 0), model=model, kind="completion")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record):
+        record.trace_id = trace_id.get()
+        return True
+
+
+def install(app):
+    """Trace-id + latency middleware and GET /metrics on a FastAPI app."""
+    from fastapi import Request, Response
+
+    if LOG_TRACE_IDS:
+        handler = logging.StreamHandler()
+        handler.addFilter(TraceIdFilter())
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s"))
+        logging.getLogger().addHandler(handler)
+        logging.getLogger().setLevel(logging.INFO)
+
+    @app.middleware("http")
+    async def trace_requests(request: Request, call_next):
+        token = trace_id.set(request.headers.get("x-request-id") or uuid.uuid4().hex[:16])
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            response.headers["X-Request-ID"] = trace_id.get()
+            return response
+        finally:
+            # Streaming responses are timed to their first byte here; the
+            # stream itself shows up in the llm stage. Requests no route
+            # matched (404s, scanners) share one path label.
+            route = request.scope.get("route")
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method,
+                                    path=getattr(route, "path", "<unmatched>"), status=status)
+            trace_id.reset(token)
+
+    @app.get("/metrics")
+    async def metrics():
+        return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
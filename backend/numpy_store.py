@@ -0,0 +1,296 @@
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from embedding_stage import chroma_writer
+from retrievers import metadata_matches
+import json
+import numpy as np
+import os
+import threading
+
+# In-process vector index: one matrix of unit-length rows (float32, or int8
+# with a per-row scale), memory-mapped from disk and searched with a single
+# matrix product per batch of queries. Exact top-k, no server, no SQLite
+# round trip; at a few thousand CV chunks this is faster than Chroma's HNSW.
+#
+# Layout of the index directory:
+#   index.json              ids, texts, metadatas, dtype and the current generation
+#   vectors-<gen>.npy       float32 rows, or int8 codes when dtype is int8
+#   scales-<gen>.npy        int8 only: per-row dequantisation scale
+# A save writes the next generation's arrays, then swaps index.json, so a
+# crash mid-save leaves the previous index intact.
+
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")  # chroma | numpy
+NUMPY_INDEX_DTYPE = os.getenv("NUMPY_INDEX_DTYPE", "float32")  # float32 | int8
+SEARCH_BLOCK_ROWS = 16384
+
+
+def normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize(matrix):
+    # Symmetric per-row int8: row ~= codes * scale
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+class NumpyVectorStore(VectorStore):
+    def __init__(self, persist_directory, embedding_function, dtype=NUMPY_INDEX_DTYPE):
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"Unsupported index dtype: {dtype}")
+        self.persist_directory = persist_directory
+        self._embedding = embedding_function
+        self.dtype = dtype
+        self.lock = threading.RLock()
+        self.generation = 0
+        self.ids, self.texts, self.metadatas = [], [], []
+        self.positions = {}  # id -> row
+        self.matrix = np.zeros((0, 0), dtype=self.dtype)
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.pending = []  # (codes, scales) appended since the last compaction
+        self.dead = set()  # rows replaced or deleted since the last compaction
+        self.masks = {}  # filter -> row mask, valid until the rows change
+        os.makedirs(persist_directory, exist_ok=True)
+        self.load()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def __len__(self):
+        return len(self.positions)
+
+    # --- writes ---
+
+    def write_vectors(self, ids, texts, metadatas, vectors):
+        codes = normalize(vectors)
+        scales = np.ones(len(ids), dtype=np.float32)
+        if self.dtype == "int8":
+            codes, scales = quantize(codes)
+        with self.lock:
+            for doc_id in ids:
+                if doc_id in self.positions:
+                    self.dead.add(self.positions[doc_id])
+            start = len(self.ids)
+            for offset, (doc_id, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+                self.positions[doc_id] = start + offset
+            self.ids.extend(ids)
+            self.texts.extend(texts)
+            self.metadatas.extend(metadata or {} for metadata in metadatas)
+            self.pending.append((codes, scales))
+            self.masks.clear()
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        ids = list(ids) if ids else [os.urandom(16).hex() for _ in texts]
+        self.write_vectors(ids, texts, metadatas or [{} for _ in texts], self._embedding.embed_documents(texts))
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        with self.lock:
+            for doc_id in ids or []:
+                row = self.positions.pop(doc_id, None)
+                if row is not None:
+                    self.dead.add(row)
+            self.masks.clear()
+
+    def _compact(self):
+        # Fold pending rows in and drop dead ones; called under the lock
+        # before a search or save, so a build pays for it once, not per batch.
+        if not self.pending and not self.dead:
+            return
+        parts = [self.matrix] if len(self.matrix) else []
+        codes = np.concatenate(parts + [c for c, _ in self.pending])
+        scales = np.concatenate([self.scales] + [s for _, s in self.pending])
+        if self.dead:
+            keep = np.ones(len(self.ids), dtype=bool)
+            keep[list(self.dead)] = False
+            codes, scales = codes[keep], scales[keep]
+            self.ids = [doc_id for doc_id, k in zip(self.ids, keep) if k]
+            self.texts = [text for text, k in zip(self.texts, keep) if k]
+            self.metadatas = [metadata for metadata, k in zip(self.metadatas, keep) if k]
+            self.positions = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.matrix, self.scales = codes, scales
+        self.pending, self.dead = [], set()
+        self.masks.clear()
+
+    # --- persistence ---
+
+    def persist(self):
+        with self.lock:
+            self._compact()
+            generation = self.generation + 1
+            vectors_path = os.path.join(self.persist_directory, f"vectors-{generation}.npy")
+            np.save(vectors_path, self.matrix)
+            if self.dtype == "int8":
+                np.save(os.path.join(self.persist_directory, f"scales-{generation}.npy"), self.scales)
+            index_path = os.path.join(self.persist_directory, "index.json")
+            with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"generation": generation, "dtype": self.dtype, "ids": self.ids,
+                           "texts": self.texts, "metadatas": self.metadatas}, f)
+            os.replace(index_path + ".tmp", index_path)
+            self.generation = generation
+        current = {f"vectors-{generation}.npy", f"scales-{generation}.npy"}
+        for name in os.listdir(self.persist_directory):
+            if name.endswith(".npy") and name not in current:
+                try:
+                    os.remove(os.path.join(self.persist_directory, name))
+                except OSError:
+                    pass  # still mapped by another process on Windows; removed by a later save
+
+    def load(self):
+        index_path = os.path.join(self.persist_directory, "index.json")
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        stored = data["dtype"]
+        with self.lock:
+            self.generation = data["generation"]
+            self.ids, self.texts, self.metadatas = data["ids"], data["texts"], data["metadatas"]
+            self.positions = {doc_id: row for row, doc_id in enumerate(self.ids)}
+            # Memory-mapped: pages are read on first use and shared between workers
+            self.matrix = np.load(os.path.join(self.persist_directory, f"vectors-{self.generation}.npy"),
+                                  mmap_mode="r")
+            if stored == "int8":
+                self.scales = np.load(os.path.join(self.persist_directory, f"scales-{self.generation}.npy"))
+            else:
+                self.scales = np.ones(len(self.ids), dtype=np.float32)
+            if stored != self.dtype:
+                # NUMPY_INDEX_DTYPE changed: re-encode in memory, saved by the next persist()
+                vectors = np.asarray(self.matrix, dtype=np.float32) * self.scales[:, None]
+                self.matrix, self.scales = (quantize(vectors) if self.dtype == "int8"
+                                            else (normalize(vectors), np.ones(len(self.ids), dtype=np.float32)))
+            self.pending, self.dead = [], set()
+            self.masks.clear()
+
+    def close(self):
+        # Drop the memory map so the version directory can be deleted
+        with self.lock:
+            self.matrix = np.zeros((0, 0), dtype=self.dtype)
+            self.scales = np.zeros(0, dtype=np.float32)
+            self.ids, self.texts, self.metadatas, self.positions = [], [], [], {}
+            self.pending, self.dead = [], set()
+            self.masks.clear()
+
+    # --- reads ---
+
+    def get(self, ids=None, include=("documents", "metadatas"), limit=None, **kwargs):
+        # Same shape as Chroma's get(), for the code paths that use both.
+        with self.lock:
+            rows = [self.positions[i] for i in ids if i in self.positions] if ids else sorted(self.positions.values())
+            rows = rows[:limit]
+            result = {"ids": [self.ids[row] for row in rows]}
+            if "documents" in include:
+                result["documents"] = [self.texts[row] for row in rows]
+            if "metadatas" in include:
+                result["metadatas"] = [self.metadatas[row] for row in rows]
+        return result
+
+    def _mask(self, where):
+        key = json.dumps(where, sort_keys=True)
+        if key not in self.masks:
+            self.masks[key] = np.fromiter((metadata_matches(m, where) for m in self.metadatas),
+                                          dtype=bool, count=len(self.metadatas))
+        return self.masks[key]
+
+    def search_vectors(self, vectors, k=4, filter=None):
+        """Exact cosine top-k for a batch of query vectors: [[(row, score)], ...]."""
+        queries = normalize(np.atleast_2d(vectors))
+        with self.lock:
+            self._compact()
+            n = len(self.ids)
+            if not n:
+                return [[] for _ in queries]
+            scores = np.empty((len(queries), n), dtype=np.float32)
+            for start in range(0, n, SEARCH_BLOCK_ROWS):
+                block = np.asarray(self.matrix[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+                scores[:, start:start + len(block)] = queries @ block.T
+            if self.dtype == "int8":
+                scores *= self.scales
+            if filter:
+                scores[:, ~self._mask(filter)] = -np.inf
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row_scores, rows in zip(scores, top):
+            rows = rows[np.argsort(-row_scores[rows])]
+            results.append([(int(r), float(row_scores[r])) for r in rows if row_scores[r] != -np.inf])
+        return results
+
+    def similarity_search_by_vectors(self, vectors, k=4, filter=None):
+        with self.lock:  # rows must not move between the search and the lookup
+            results = self.search_vectors(vectors, k, filter)
+            return [[(Document(page_content=self.texts[row], metadata=dict(self.metadatas[row])), score)
+                     for row, score in hits] for hits in results]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vectors([embedding], k, filter)[0]]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vectors([self._embedding.embed_query(query)], k, filter)[0]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k, filter)
+
+    async def asimilarity_search(self, query, k=4, filter=None, **kwargs):
+        # The embedding call is the slow part; the matrix product is sub-ms.
+        return self.similarity_search_by_vector(await self._embedding.aembed_query(query), k, filter)
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory="./numpy_index", **kwargs):
+        store = cls(persist_directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+
+def open_vectorstore(persist_directory, embeddings, backend=VECTOR_BACKEND):
+    if backend == "numpy":
+        return NumpyVectorStore(persist_directory, embeddings)
+    if backend == "chroma":
+        return Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+    raise ValueError(f"Unknown VECTOR_BACKEND: {backend}")
+
+
+def search_by_vectors(vectorstore, vectors, k=4, filter=None):
+    """One Document list per query vector, from a single store call."""
+    if isinstance(vectorstore, NumpyVectorStore):
+        return [[doc for doc, _ in hits] for hits in vectorstore.similarity_search_by_vectors(vectors, k, filter)]
+    # Chroma: one collection query for all the vectors
+    result = vectorstore._collection.query(query_embeddings=vectors, n_results=k, where=filter or None,
+                                           include=["documents", "metadatas"])
+    return [[Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+            for texts, metadatas in zip(result["documents"], result["metadatas"])]
+
+
+def close_vectorstore(vectorstore):
+    if isinstance(vectorstore, NumpyVectorStore):
+        vectorstore.close()
+        return
+    # Chroma: release the client's shared system (sqlite handles, HNSW segments)
+    close = getattr(getattr(vectorstore, "_client", None), "close", None)
+    if close:
+        close()
+
+
+def vector_writer(vectorstore):
+    """EmbeddingStage writer for either backend."""
+    if isinstance(vectorstore, NumpyVectorStore):
+        def write(ids, docs, vectors):
+            vectorstore.write_vectors(ids, [doc.page_content for doc in docs], [doc.metadata for doc in docs], vectors)
+        return write
+    return chroma_writer(vectorstore)
+
+
+def index_directory(backend=VECTOR_BACKEND):
+    # Each backend keeps its own directory (and manifest / BM25 / candidate
+    # files alongside), so switching backends rebuilds instead of mixing.
+    return "./chroma_db" if backend == "chroma" else "./numpy_index"
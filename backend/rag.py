@@ -1,38 +1,52 @@
 from fastapi import FastAPI
 from pydantic import BaseModel
-from langchain_community.vectorstores import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain.memory import ConversationBufferMemory
 from langchain.chains import ConversationalRetrievalChain
-from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
+from concurrency import LLMScheduler
+from index_versions import index_versions
+from llm_router import build_router
+from numpy_store import open_vectorstore
+from startup import install_probes, lazy, mark
 import os
 
+mark("imports")
 load_dotenv()
 
 app = FastAPI()
-
-# 1. Load embeddings + vectorstore
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001",google_api_key=os.getenv("GOOGLE_API_KEY"))
-vectorstore = Chroma(persist_directory="./chroma_db", embedding_function=embeddings)
-
-# 2. Retriever
-retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+# GET /live, /ready, /startup; the chain is built by the warm-up or on first use
+install_probes(app)
 
 # 3. LLM
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash",google_api_key=os.getenv("GOOGLE_API_KEY"), temperature=0)
+# Gemini first, Together as failover when TOGETHER_API_KEY is set (LLM_PROVIDERS reorders)
+llm = build_router(["gemini", "together"], temperature=0)
 
 # 4. Memory
 memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True, output_key="answer")
 
-# 5. Conversational Chain
-qa_chain = ConversationalRetrievalChain.from_llm(
-    llm=llm,
-    retriever=retriever,
-    memory=memory,
-    return_source_documents=True,
-    output_key="answer"
-)
+def build_qa_chain():
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+    # 1. Load embeddings + vectorstore
+    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001",google_api_key=os.getenv("GOOGLE_API_KEY"))
+    vectorstore = open_vectorstore(index_versions().current(), embeddings)  # VECTOR_BACKEND=chroma|numpy
+
+    # 2. Retriever
+    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+
+    # 5. Conversational Chain
+    return ConversationalRetrievalChain.from_llm(
+        llm=llm,
+        retriever=retriever,
+        memory=memory,
+        return_source_documents=True,
+        output_key="answer"
+    )
+
+qa_chain = lazy("qa_chain", build_qa_chain)
+
+# Bounded upstream concurrency (LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, see concurrency.py)
+llm_limiter = LLMScheduler()
 
 # Request schema
 class Query(BaseModel):
@@ -40,5 +54,8 @@ class Query(BaseModel):
 
 @app.post("/ask")
 async def ask(query: Query):
-    response = qa_chain.invoke({"question": query.question})
+    async with llm_limiter.slot():
+        response = await qa_chain.ainvoke({"question": query.question})
     return {"answer": response["answer"]}
+
+mark("module")
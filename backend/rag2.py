@@ -1,27 +1,27 @@
 from fastapi import FastAPI
 from pydantic import BaseModel
-from langchain_community.vectorstores import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
 from langchain.memory import ConversationBufferWindowMemory
 from langchain.prompts import ChatPromptTemplate
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.chains.retrieval import create_retrieval_chain
 from dotenv import load_dotenv
+from concurrency import LLMScheduler
+from index_versions import index_versions
+from llm_router import build_router
+from numpy_store import open_vectorstore
+from startup import install_probes, lazy, mark
 import os
 
+mark("imports")
 load_dotenv()
 
 app = FastAPI()
-
-# 1. Load embeddings + vectorstore
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001",google_api_key=os.getenv("GOOGLE_API_KEY"))
-vectorstore = Chroma(persist_directory="./chroma_db", embedding_function=embeddings)
-
-# 2. Retriever
-retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+# GET /live, /ready, /startup; the chain is built by the warm-up or on first use
+install_probes(app)
 
 # 3. LLM
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash",google_api_key=os.getenv("GOOGLE_API_KEY"), temperature=0)
+# Gemini first, Together as failover when TOGETHER_API_KEY is set (LLM_PROVIDERS reorders)
+llm = build_router(["gemini", "together"], temperature=0)
 
 # 4. Custom Prompt
 system_prompt = (
@@ -48,8 +48,23 @@ memory = ConversationBufferWindowMemory(
 # 6. Stuff documents chain (uses our custom prompt)
 doc_chain = create_stuff_documents_chain(llm, chat_prompt)
 
-# 7. Retrieval chain (wraps retriever + doc_chain)
-qa_chain = create_retrieval_chain(retriever, doc_chain)
+def build_qa_chain():
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+    # 1. Load embeddings + vectorstore
+    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001",google_api_key=os.getenv("GOOGLE_API_KEY"))
+    vectorstore = open_vectorstore(index_versions().current(), embeddings)  # VECTOR_BACKEND=chroma|numpy
+
+    # 2. Retriever
+    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+
+    # 7. Retrieval chain (wraps retriever + doc_chain)
+    return create_retrieval_chain(retriever, doc_chain)
+
+qa_chain = lazy("qa_chain", build_qa_chain)
+
+# Bounded upstream concurrency (LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, see concurrency.py)
+llm_limiter = LLMScheduler()
 
 # Request schema
 class Query(BaseModel):
@@ -57,11 +72,14 @@ class Query(BaseModel):
 
 @app.post("/ask2")
 async def ask(query: Query):
-    response = qa_chain.invoke({
-        "input": query.question,
-        "chat_history": memory.chat_memory.messages  # 👈 manually inject memory
-    })
+    async with llm_limiter.slot():
+        response = await qa_chain.ainvoke({
+            "input": query.question,
+            "chat_history": memory.chat_memory.messages  # 👈 manually inject memory
+        })
     # Save this exchange into memory
     memory.chat_memory.add_user_message(query.question)
     memory.chat_memory.add_ai_message(response["answer"])
     return {"answer": response["answer"]}
+
+mark("module")
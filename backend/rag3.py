@@ -1,73 +1,263 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
-from langchain_community.vectorstores import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain.memory import ConversationBufferWindowMemory
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain.prompts import ChatPromptTemplate
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.chains.retrieval import create_retrieval_chain
+from langchain_core.runnables import ConfigurableField, RunnablePassthrough
+from typing import List, Optional
 from dotenv import load_dotenv
-import zipfile
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.vectorstores import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from functools import partial
+import asyncio
+import hashlib
+import queue
+import uuid
+from answer_cache import SemanticAnswerCache
+from bm25 import BM25Index
+from concurrency import LLMScheduler
+from context import CONTEXT_MAX_TOKENS, approx_tokens, compress_context
+from cv_metadata import CandidateTable
+from embedding_cache import CachedEmbeddings
+from embedding_stage import EmbeddingStage
+from index_versions import ServingIndex, SwappableIndex, index_versions
+from jobs import JobQueue
+from llm_router import ProvidersUnavailable, build_router, providers_unavailable, register_routers
+from ingest import INGEST_SCHEMA, INGEST_WORKERS, iter_parsed, iter_sources
+from manifest import Manifest, chunk_ids, source_sha256
+from metrics import REGISTRY, StageTimer, install, register_caches, register_limiter, timed
+from numpy_store import close_vectorstore, open_vectorstore, search_by_vectors, vector_writer
+from retrievers import HYBRID_VECTOR_TIMEOUT, HybridRetriever, batch_retrieve
+from sessions import SessionStore
+from single_flight import SingleFlight, normalize
+from startup import built, install_probes, lazy, mark
+from uploads import UPLOAD_DIR, UPLOAD_EXTENSIONS, UploadError, receive_uploads
+from summarizer import CHAT_HISTORY_TOKENS, CHAT_MEMORY_MODE, HistorySummarizer
+from streaming import sse, sse_response
 import os
 
+mark("imports")
 load_dotenv()
 app = FastAPI()
+# Per-stage latency / token / cache metrics on GET /metrics, trace ids on every request
+install(app)
+# GET /live, /ready, /startup; the clients, index and chains below are built
+# on first use or by the warm-up that starts with the server (see startup.py)
+install_probes(app)
 
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001",google_api_key=os.getenv("GOOGLE_API_KEY"))
+def google_embeddings():
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(model="models/embedding-001",google_api_key=os.getenv("GOOGLE_API_KEY"))
 
-# 1. Load documents
-#zip_path_global = "../uploads"
+# Embeddings go through a persistent cache so rebuilds and repeated questions
+# don't pay for text that was already embedded.
+embeddings = CachedEmbeddings(lazy("embeddings", google_embeddings), model="models/embedding-001")
+
+# 1. Load documents: uploaded PDFs and zips are kept as-is in UPLOAD_DIR and
+# read in place (zip members included); PDFs extracted by older versions
+# are still picked up from extract_to.
 extract_to = "../content/cv"
+# Versioned index directories (VECTOR_BACKEND=chroma|numpy): each holds the
+# vector store, manifest, BM25 and candidate files, see index_versions.py
+versions = index_versions()
+answer_cache = SemanticAnswerCache()
 
-# Unzip
+def corpus_paths():
+    # Everything ever uploaded, oldest first so newer copies of a CV win
+    paths = []
+    for folder, extensions in ((extract_to, (".pdf",)), (UPLOAD_DIR, UPLOAD_EXTENSIONS)):
+        if os.path.isdir(folder):
+            paths += [os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith(extensions)]
+    return sorted(paths, key=os.path.getmtime)
 
-def unzip(zip_path):
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_to)
+class File(BaseModel):
+    path: str = ""
+    # Re-scan every uploaded file too, and drop CVs whose files are gone
+    prune: bool = False
 
-def load_pdfs_as_dicts(folder_path):
-    documents = []
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".pdf"):
-            loader = PyPDFLoader(os.path.join(folder_path, filename))
-            documents.append(loader.load())
-    return documents
+async def run_build(job):
+    # Disk and store work runs in threads so chat requests keep being served.
+    # The build updates a copy of the serving index (after any build another
+    # worker is running); /ask keeps using the old one until the new version
+    # is published and swapped in.
+    job.update(stage="copying")
+    path = await asyncio.to_thread(versions.prepare)
+    index = None
+    try:
+        index = await asyncio.to_thread(open_index, path)
+        stats = await update_index(index, job)
+    except BaseException:
+        if index is not None:
+            close_index(index)
+        versions.discard(path)
+        raise
+    if not (stats["changed"] or stats["removed"] or stats["reset"]):
+        close_index(index)
+        versions.discard(path)
+        return stats
+    versions.publish(path)
+    serving.swap(index)
+    answer_cache.invalidate()
+    return {**stats, "index": os.path.basename(path)}
 
-def split_files(docs):
-    # 2. Split into chunks
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunked_documents = []
+async def update_index(index, job):
+    vectorstore, keyword_index, candidates = index.vectorstore, index.keyword_index, index.candidates
+    manifest = Manifest(os.path.join(index.path, "manifest.json"))
+    paths = [job.params["path"]] if job.params.get("path") else []
+    inbox = job.payload  # paths of uploaded files as they finish arriving, then None
+    reset = not manifest.exists or manifest.schema != INGEST_SCHEMA
+    prune = job.params.get("prune", False)
+    if prune and not reset:
+        paths = corpus_paths() + paths
+    if reset:
+        # Store was built before the manifest existed, or with an older chunk
+        # metadata layout: drop the old vectors once and re-index every file
+        # (the embedding cache makes this cheap).
+        legacy = (await asyncio.to_thread(vectorstore.get, include=[]))["ids"]
+        if legacy:
+            await asyncio.to_thread(vectorstore.delete, ids=legacy)
+        for doc_id in list(keyword_index.docs):
+            keyword_index.remove(doc_id)
+        candidates.clear()
+        manifest.files = {}
+        manifest.schema = INGEST_SCHEMA
+        paths = corpus_paths() + paths
+    job.update(stage="indexing")
 
-    for doc in docs:
-        chunks = splitter.split_documents(doc)
-        for i, chunk in enumerate(chunks):
-            chunked_documents.append(chunk)
-    return chunked_documents
+    hashes = {}
+    unchanged = []
+    seen = {}  # name -> sha256 of every file found, changed or not
 
-class File(BaseModel):
-    path: str
+    def changed_sources():
+        # Runs on the parsing pool's feeder thread: hashes each PDF (zip
+        # members are streamed, never extracted) and passes on new or edited
+        # ones, including uploads that are still arriving.
+        def all_paths():
+            yield from paths
+            while inbox is not None and (path := inbox.get()) is not None:
+                yield path
+        for path in all_paths():
+            for name, source in iter_sources(path):
+                sha = source_sha256(source)
+                seen[name] = sha
+                if manifest.is_current(name, sha) or hashes.get(name) == sha:
+                    unchanged.append(name)
+                    continue
+                hashes[name] = sha
+                job.advance("files_total")
+                yield name, source
+
+    stale_ids = []
+
+    # Files are parsed across the worker pool; new chunks stream into the
+    # embedding stage, which embeds and writes them batch by batch while the
+    # remaining files are still being parsed (or uploaded).
+    def new_chunks():
+        for name, chunks in iter_parsed(changed_sources(), workers=INGEST_WORKERS):
+            ids = chunk_ids(name, [chunk.page_content for chunk in chunks])
+            if chunks:
+                cv = chunks[0].metadata
+                candidates.upsert(name, {"candidate": cv["candidate"], "role": cv["role"],
+                                         "skills": [s for s in cv["skills"].split(", ") if s]})
+            old_ids = set(manifest.chunks(name))
+            stale_ids.extend(old_ids - set(ids))
+            fresh = [(i, chunk) for i, chunk in zip(ids, chunks) if i not in old_ids]
+            job.advance("files_parsed")
+            job.advance("chunks_found", len(fresh))
+            for i, chunk in fresh:
+                keyword_index.add(i, chunk.page_content, chunk.metadata)
+                yield i, chunk
+            manifest.set(name, hashes[name], ids)
+
+    write = vector_writer(vectorstore)
+
+    def write_and_count(ids, docs, vectors):
+        write(ids, docs, vectors)
+        job.advance("chunks_embedded", len(ids))
+
+    stage = EmbeddingStage(embeddings, write_and_count)
+    added_chunks = await stage.run(new_chunks())
+    job.update(stage="saving")
+
+    removed = []
+    if prune:
+        # Files in the index that are no longer anywhere in the corpus
+        _, removed, _ = manifest.diff(seen)
+        for name in removed:
+            stale_ids.extend(manifest.remove(name))
+            candidates.remove(name)
+    if stale_ids:
+        await asyncio.to_thread(vectorstore.delete, ids=stale_ids)
+        for doc_id in stale_ids:
+            keyword_index.remove(doc_id)
+    # Vectors and keyword index are on disk before the manifest records them
+    # (persist is a no-op for Chroma, which writes through).
+    await asyncio.to_thread(vectorstore.persist)
+    await asyncio.to_thread(keyword_index.save)
+    if hashes or removed or reset:
+        manifest.version += 1
+    manifest.save()
+    index.version = manifest.version
+    return {
+        "changed": len(hashes),
+        "removed": len(removed),
+        "reset": reset,
+        "unchanged": len(unchanged),
+        "chunks_added": added_chunks,
+        "chunks_deleted": len(stale_ids),
+        "embedding": stage.stats,
+        "embedding_cache": {**embeddings.stats, "hit_rate": embeddings.hit_rate},
+    }
+
+build_jobs = JobQueue(run_build)
+
+@app.post("/build", status_code=202)
+async def build(file: File):
+    # Returns at once; poll GET /build/{job_id} for progress and the result.
+    job = build_jobs.submit("build", {"path": file.path, "prune": file.prune})
+    return {"job_id": job.id, "status": job.status}
 
-@app.post("/build")
-async def ask(file: File):
-    unzip(file.path)
-    docs = load_pdfs_as_dicts(extract_to)
-    chunked_documents = split_files(docs)
-    vectorstore = Chroma.from_documents(chunked_documents, embeddings, persist_directory="./chroma_db")
-    vectorstore.persist()
+@app.post("/upload", status_code=202)
+async def upload(request: Request):
+    # multipart/form-data with any number of PDF / zip files. Each file is
+    # streamed to UPLOAD_DIR and handed to the build job as soon as it is
+    # complete, so indexing starts before the upload has finished.
+    inbox = queue.Queue()
+    job = build_jobs.submit("upload", {"upload_id": uuid.uuid4().hex}, payload=inbox)
+    try:
+        files, skipped = await receive_uploads(request, inbox.put)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        inbox.put(None)
+    job.params = {**job.params, "files": [os.path.basename(path) for path in files]}
+    job.changed()
+    return {"job_id": job.id, "status": job.status, "files": job.params["files"], "skipped": skipped}
 
+@app.get("/build")
+async def list_builds():
+    return await asyncio.to_thread(build_jobs.list)
 
-# 1. Load embeddings + vectorstore
-#embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001",google_api_key=os.getenv("GOOGLE_API_KEY"))
-vectorstore = Chroma(persist_directory="./chroma_db", embedding_function=embeddings)
+@app.get("/build/{job_id}")
+async def build_status(job_id: str):
+    # Any worker answers, also for jobs another one runs (see jobs.py)
+    snapshot = await asyncio.to_thread(build_jobs.snapshot, job_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Unknown build job")
+    return snapshot
 
-# 2. Retriever
-retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+
+# Most candidates one filtered question is answered over (one chunk each)
+MAX_CANDIDATES = int(os.getenv("HYBRID_MAX_CANDIDATES", "8"))
+# Questions one /ask/batch request may carry, and how many of its LLM calls run at once
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "100"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
 
 # 3. LLM
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash",google_api_key=os.getenv("GOOGLE_API_KEY"), temperature=0)
+# Gemini first, Together as failover when TOGETHER_API_KEY is set (LLM_PROVIDERS reorders)
+llm = build_router(["gemini", "together"], temperature=0)
+# Every provider down or breaker-open -> 503 with Retry-After
+app.add_exception_handler(ProvidersUnavailable, providers_unavailable)
 
 # 4. Custom Prompt
 system_prompt = (
@@ -82,31 +272,335 @@ chat_prompt = ChatPromptTemplate.from_messages([
     ("human", "{input}"),
 ])
 
-# 5. Memory (window to avoid growing too big)
-memory = ConversationBufferWindowMemory(
-    memory_key="chat_history",
-    k=5,  # keep last 5 exchanges
-    return_messages=True,
-    output_key="answer"
-)
+# Upstream LLM calls in flight / queued per worker, shared fairly between
+# sessions, /ask before /ask/batch (see concurrency.py)
+llm_limiter = LLMScheduler()
+
+# 5. Memory per session (window, or rolling summary with CHAT_MEMORY_MODE=summary,
+# to avoid growing too big; sessions are evicted by LRU / idle TTL, see sessions.py)
+if CHAT_MEMORY_MODE == "summary":
+    sessions = SessionStore(window=None, max_tokens=4 * CHAT_HISTORY_TOKENS, name="rag_sessions",
+                            summarizer=HistorySummarizer(llm))
+else:
+    sessions = SessionStore(
+        window=5,  # keep last 5 exchanges
+        name="rag_sessions"
+    )
+
+# 6. Stuff documents chain (uses our custom prompt). The retrieved chunks are
+# compressed first: overlap removed, trimmed to the question-relevant
+# sentences, cut to CONTEXT_MAX_TOKENS (see context.py). When nothing was
+# retrieved (e.g. filters no CV matches) the LLM is told so.
+NO_MATCH = [Document(page_content="No matching candidates.")]
+doc_chain = RunnablePassthrough.assign(
+    context=lambda x: compress_context(x["input"], x["context"]) or NO_MATCH
+) | create_stuff_documents_chain(llm, chat_prompt)
+# Times the retrieve / prompt / llm runs of every QA chain and counts tokens
+stage_timer = StageTimer()
+
+def open_index(path):
+    """Vector store, keyword index, candidate table and QA chain of one index version."""
+    # 1. Load vectorstore
+    vectorstore = open_vectorstore(path, embeddings)
+    # Keyword (BM25) index over the same chunks, kept in sync by /build
+    keyword_index = BM25Index(os.path.join(path, "bm25.json"))
+    # Keyword index missing (e.g. store built before it existed): rebuild it
+    # from the chunks already in the vector store, no embedding calls needed.
+    if not len(keyword_index) and vectorstore.get(limit=1, include=[])["ids"]:
+        stored = vectorstore.get(include=["documents", "metadatas"])
+        for doc_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+            keyword_index.add(doc_id, text, metadata)
+        keyword_index.save()
+    # Candidate / role / skills per CV, used to narrow searches to matching files
+    candidates = CandidateTable(os.path.join(path, "candidates.sqlite3"))
+
+    # 2. Retriever: dense + BM25, fused by reciprocal rank. Filter, grouping
+    # and k can be set per request (see retrieval_config).
+    retriever = HybridRetriever(vectorstore=vectorstore, index=keyword_index, k=3).configurable_fields(
+        search_filter=ConfigurableField(id="search_filter"),
+        group_by=ConfigurableField(id="group_by"),
+        boost=ConfigurableField(id="boost"),
+        k=ConfigurableField(id="k"),
+    )
 
-# 6. Stuff documents chain (uses our custom prompt)
-doc_chain = create_stuff_documents_chain(llm, chat_prompt)
+    # 7. Retrieval chain (wraps retriever + doc_chain)
+    # (the configurable wrapper is a plain Runnable, so it is handed the question itself)
+    qa_chain = create_retrieval_chain((lambda x: x["input"]) | retriever, doc_chain).with_config(
+        callbacks=[stage_timer])
+    return ServingIndex(path, on_close=close_index, version=Manifest(os.path.join(path, "manifest.json")).version,
+                        vectorstore=vectorstore, keyword_index=keyword_index, candidates=candidates,
+                        retriever=retriever, qa_chain=qa_chain)
 
-# 7. Retrieval chain (wraps retriever + doc_chain)
-qa_chain = create_retrieval_chain(retriever, doc_chain)
+def close_index(index):
+    close_vectorstore(index.vectorstore)
+    index.candidates.close()
+
+def open_serving():
+    os.makedirs(versions.current(), exist_ok=True)
+    return SwappableIndex(open_index(versions.current()), versions, opener=open_index)
+
+# Index /ask reads from; replaced atomically after each build, here or in
+# another worker. Queries lease the index they start on, so a swap never
+# pulls it from under them.
+serving = lazy("index", open_serving)
+
+register_caches({"answer": answer_cache, "embedding": embeddings, "sessions": sessions})
+register_limiter(llm_limiter)
+register_routers({"rag": llm})
+REGISTRY.gauge("index_version", "Manifest version of the serving index",
+               lambda: {(): serving.current.version} if built(serving) else {})
+REGISTRY.gauge("build_jobs", "Remembered build jobs by status",
+               lambda: {(status,): sum(job.status == status for job in build_jobs.jobs.values())
+                        for status in ("queued", "running", "done", "failed")}, ["status"])
 
 # Request schema
 class Query(BaseModel):
     question: str
+    session_id: str = "default"
+    # Optional filters; when none are given, roles and skills the question
+    # mentions by name (e.g. "compare all cloud engineers") are used.
+    roles: Optional[List[str]] = None
+    skills: Optional[List[str]] = None
+    candidates: Optional[List[str]] = None
+
+def retrieval_config(query, candidates):
+    """Chain config narrowing retrieval to the matching CVs, one chunk per CV.
+
+    Filters sent with the query are applied as given; when no CV matches
+    them nothing is retrieved. Without them, roles the question names narrow
+    the search, and skills it names only rank the CVs listing them first, so
+    a CV that words a skill differently still counts. Returns None (plain
+    top-k over everything) when the question names nothing that matches.
+    """
+    roles, skills, boost = query.roles, query.skills, None
+    if not (roles or skills or query.candidates):
+        roles, named = candidates.match_question(query.question)
+        boost = named and candidates.rank_by_skills(named)
+    configurable = {}
+    if roles or skills or query.candidates:
+        files = candidates.find(roles, skills, query.candidates)
+        if files:
+            configurable = {"search_filter": {"file": {"$in": files}}, "k": min(len(files), MAX_CANDIDATES)}
+        elif query.roles or query.skills or query.candidates:
+            configurable = {"search_filter": {"file": {"$in": []}}, "k": 0}
+    if boost:
+        configurable = {"k": min(len(boost), MAX_CANDIDATES), **configurable, "boost": boost}
+    if not configurable:
+        return None
+    return {"configurable": {**configurable, "group_by": "file"}}
+
+def flight_key(query, version, chat_history=()):
+    # Identical questions (and filters) against the same index share one
+    # retrieval + LLM call. The leader answers with its own session's
+    # history, so only callers with the same history (e.g. none) share it.
+    filters = tuple(tuple(sorted(normalize(v) for v in values or ())) for values in
+                    (query.roles, query.skills, query.candidates))
+    digest = hashlib.sha256()
+    for message in chat_history:
+        digest.update(f"{message.type}\0{message.content}\0".encode("utf-8"))
+    return normalize(query.question), filters, version, digest.hexdigest()
+
+# Questions being answered right now, see single_flight.py
+in_flight = SingleFlight("ask")
+
+def explicit_filters(query):
+    # Answers to explicitly filtered questions depend on more than the
+    # question text, so they bypass the answer cache.
+    return bool(query.roles or query.skills or query.candidates)
+
+def cacheable(query, chat_history=()):
+    # Follow-ups ("what did he study?") are answered from the session's
+    # earlier turns, so only first questions are looked up in and stored to
+    # the answer cache.
+    return not (explicit_filters(query) or chat_history)
+
+async def embed_question(question):
+    # Question vector for the answer cache. If the embedding API is slow the
+    # cache is skipped, and the hybrid retriever falls back to BM25 as well.
+    try:
+        with timed("embed_question"):
+            return await asyncio.wait_for(embeddings.aembed_query(question), HYBRID_VECTOR_TIMEOUT)
+    except Exception:
+        return None
+
+def scheduler_user(query, request):
+    # Whose quota and fair share an /ask call counts against: its session,
+    # or for callers without one (all "default"), their address
+    if query.session_id != "default":
+        return query.session_id
+    return f"client:{request.client.host}" if request.client else None
+
+def prompt_tokens(query):
+    # Estimate charged to the session's token quota when the call is admitted
+    return approx_tokens(query.question) + CONTEXT_MAX_TOKENS
+
+async def answer_question(user, query, question_vector, chat_history):
+    # Runs detached from the request (see SingleFlight), so it leases the index itself
+    with serving.lease() as index:
+        config = await asyncio.to_thread(retrieval_config, query, index.candidates)
+        async with llm_limiter.slot(user, tokens=prompt_tokens(query)) as slot:
+            response = await index.qa_chain.ainvoke({
+                "input": query.question,
+                "chat_history": chat_history  # 👈 manually inject memory
+            }, config=config)
+            slot.charge(approx_tokens(response["answer"]))
+        if question_vector is not None:
+            answer_cache.store(query.question, question_vector, response["answer"], index.version)
+    return response["answer"]
+
+async def stream_answer(user, query, question_vector, chat_history):
+    with serving.lease() as index:
+        parts = []
+        config = await asyncio.to_thread(retrieval_config, query, index.candidates)
+        async with llm_limiter.slot(user, tokens=prompt_tokens(query)) as slot:
+            async for chunk in index.qa_chain.astream({
+                "input": query.question,
+                "chat_history": chat_history
+            }, config=config):
+                token = chunk.get("answer")
+                if token:
+                    parts.append(token)
+                    yield token
+            slot.charge(approx_tokens("".join(parts)))
+        if question_vector is not None:
+            answer_cache.store(query.question, question_vector, "".join(parts), index.version)
 
 @app.post("/ask")
-async def ask(query: Query):
-    response = qa_chain.invoke({
-        "input": query.question,
-        "chat_history": memory.chat_memory.messages  # 👈 manually inject memory
-    })
+async def ask(query: Query, request: Request):
+    # Near-duplicate questions against an unchanged index reuse the earlier
+    # answer. The question vector is cached, so the retriever below doesn't
+    # embed it a second time on a miss.
+    history = await sessions.aget(query.session_id)
+    user = scheduler_user(query, request)
+    with serving.lease() as index:
+        question_vector = await embed_question(query.question) if cacheable(query, history.messages) else None
+        cached = question_vector is not None and await answer_cache.alookup(question_vector, index.version)
+        if cached:
+            answer = cached[0]
+        else:
+            # Concurrent duplicates wait for the first one's answer, asked in
+            # that one's turn; a session over quota doesn't ride along
+            llm_limiter.check(user, tokens=prompt_tokens(query))
+            answer = await in_flight.do(flight_key(query, index.version, history.messages),
+                                        lambda: answer_question(user, query, question_vector, history.messages))
     # Save this exchange into memory
-    memory.chat_memory.add_user_message(query.question)
-    memory.chat_memory.add_ai_message(response["answer"])
-    return {"answer": response["answer"]}
+    history.add_messages([HumanMessage(content=query.question), AIMessage(content=answer)])
+    return {"answer": answer, "cached": bool(cached)}
+
+@app.post("/ask/stream")
+async def ask_stream(query: Query, request: Request):
+    # Same flow as /ask, but answer tokens are sent as server-sent events as
+    # soon as the LLM produces them.
+    history = await sessions.aget(query.session_id)
+    user = scheduler_user(query, request)
+    llm_limiter.check(user, tokens=prompt_tokens(query))  # a 429 before the stream starts
+    question_vector = await embed_question(query.question) if cacheable(query, history.messages) else None
+
+    async def events():
+        # The lease is held until the last token, so a swap mid-answer keeps
+        # this stream's index open.
+        with serving.lease() as index:
+            cached = question_vector is not None and await answer_cache.alookup(question_vector, index.version)
+            if cached:
+                answer = cached[0]
+                yield sse({"token": answer})
+            else:
+                # Concurrent duplicates get the first one's tokens as they
+                # arrive (from the start if they join late)
+                parts = []
+                try:
+                    async for token in in_flight.stream(flight_key(query, index.version, history.messages),
+                                                        lambda: stream_answer(user, query, question_vector, history.messages)):
+                        parts.append(token)
+                        yield sse({"token": token})
+                except Exception as e:
+                    yield sse({"error": str(e)})
+                    return
+                answer = "".join(parts)
+        history.add_messages([HumanMessage(content=query.question), AIMessage(content=answer)])
+        yield sse({"done": True, "cached": bool(cached)})
+
+    return sse_response(events())
+
+class BatchQuery(BaseModel):
+    # Screening questions, e.g. one per candidate / skill pair. They are
+    # answered without session history, so session_id is ignored; the LLM
+    # calls count against user_id's quota, behind interactive questions.
+    questions: List[Query]
+    user_id: str = "batch"
+
+def batch_retrievers(queries, index):
+    # Same filtering as /ask, one retriever per question
+    retrievers = []
+    for query in queries:
+        config = retrieval_config(query, index.candidates) or {}
+        settings = {"k": 3, **config.get("configurable", {})}
+        retrievers.append(HybridRetriever(vectorstore=index.vectorstore, index=index.keyword_index, **settings))
+    return retrievers
+
+async def answer_from_docs(user_id, query, docs, question_vector, version):
+    # The answer step of /ask, for context /ask/batch has already retrieved
+    async with llm_limiter.slot(user_id, "batch", tokens=prompt_tokens(query)) as slot:
+        answer = await doc_chain.ainvoke({"input": query.question, "context": docs, "chat_history": []},
+                                         config={"callbacks": [stage_timer]})
+        slot.charge(approx_tokens(answer))
+    if question_vector is not None:
+        answer_cache.store(query.question, question_vector, answer, version)
+    return answer
+
+@app.post("/ask/batch")
+async def ask_batch(batch: BatchQuery):
+    # All questions are embedded in one batched call and retrieved with one
+    # multi-vector search per distinct filter; chunks found for several
+    # questions are shared. The LLM calls then run BATCH_CONCURRENCY at a
+    # time, and each answer is sent as a server-sent event tagged with its
+    # question's index as soon as it is ready.
+    queries = batch.questions
+    if len(queries) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+    llm_limiter.check(batch.user_id, "batch")
+
+    async def events():
+        with serving.lease() as index:
+            texts = [query.question for query in queries]
+            try:
+                vectors = await embeddings.aembed_queries(texts)
+            except Exception:
+                vectors = [None] * len(queries)  # keyword retrieval only, no answer cache
+            retrievers = await asyncio.to_thread(batch_retrievers, queries, index)
+            docs, unique_chunks = await asyncio.to_thread(batch_retrieve, retrievers, texts, vectors,
+                                                          partial(search_by_vectors, index.vectorstore))
+            parallel = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+            async def answer(i):
+                query = queries[i]
+                vector = vectors[i] if cacheable(query) else None
+                try:
+                    cached = vector is not None and await answer_cache.alookup(vector, index.version)
+                    if cached:
+                        return {"index": i, "answer": cached[0], "cached": True}
+                    async with parallel:
+                        # Repeated questions (in this batch or a concurrent /ask) are answered once
+                        answer = await in_flight.do(flight_key(query, index.version),
+                                                    lambda: answer_from_docs(batch.user_id, query, docs[i], vector,
+                                                                             index.version))
+                    return {"index": i, "answer": answer, "cached": False}
+                except Exception as e:
+                    return {"index": i, "error": str(e)}
+
+            tasks = [asyncio.ensure_future(answer(i)) for i in range(len(queries))]
+            results = []
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    results.append(await next_done)
+                    yield sse(results[-1])
+            finally:
+                for task in tasks:
+                    task.cancel()
+        yield sse({"done": True, "questions": len(queries), "cached": sum(bool(r.get("cached")) for r in results),
+                   "errors": sum("error" in r for r in results),
+                   "chunks_retrieved": sum(len(d) for d in docs), "unique_chunks": unique_chunks})
+
+    return sse_response(events())
+
+mark("module")
@@ -0,0 +1,179 @@
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from metrics import timed
+from typing import Any, List, Optional
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "10"))
+HYBRID_VECTOR_TIMEOUT = float(os.getenv("HYBRID_VECTOR_TIMEOUT", "2.0"))
+RRF_K = 60
+
+
+def doc_key(doc):
+    return doc.metadata.get("source"), doc.metadata.get("page"), doc.page_content
+
+
+def reciprocal_rank_fusion(rankings, k=None, rrf_k=RRF_K):
+    # rankings: lists of Documents, best first. Score = sum of 1 / (rrf_k + rank).
+    scores, docs = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = doc_key(doc)
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in best]
+
+
+def metadata_matches(metadata, where):
+    # The subset of Chroma's "where" syntax used here: {"key": value},
+    # {"key": {"$eq"|"$ne"|"$in"|"$nin": ...}}, {"$and": [...]}, {"$or": [...]}.
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(metadata_matches(metadata, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(metadata_matches(metadata, c) for c in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, operand in condition.items():
+                if ((op == "$eq" and value != operand) or (op == "$ne" and value == operand)
+                        or (op == "$in" and value not in operand) or (op == "$nin" and value in operand)):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def group_first(docs, field, k):
+    # Keep the best-ranked chunk per `field` value (e.g. one chunk per candidate).
+    seen, grouped = set(), []
+    for doc in docs:
+        value = doc.metadata.get(field) or doc.metadata.get("source")
+        if value in seen:
+            continue
+        seen.add(value)
+        grouped.append(doc)
+        if len(grouped) >= k:
+            break
+    return grouped
+
+
+class HybridRetriever(BaseRetriever):
+    """Dense (vector store) + BM25 keyword retrieval fused with reciprocal rank fusion.
+
+    The keyword side never calls the embedding API, so if the vector side
+    fails or takes longer than vector_timeout the keyword results are
+    returned on their own.
+
+    search_filter is a Chroma "where" clause pushed down into the vector
+    search and applied to the keyword candidates too; group_by keeps only
+    the best chunk per metadata value so results cover k different CVs.
+    boost lists files, best first, whose chunks are ranked up (as a third
+    ranking in the fusion) without filtering out the others.
+    """
+
+    vectorstore: Any
+    index: Any
+    k: int = 3
+    fetch_k: int = HYBRID_FETCH_K
+    vector_timeout: float = HYBRID_VECTOR_TIMEOUT
+    search_filter: Optional[dict] = None
+    group_by: Optional[str] = None
+    boost: Optional[List[str]] = None
+
+    @property
+    def candidates_k(self):
+        # Grouping discards chunks from the same CV, so look further down the list.
+        return max(self.fetch_k, 4 * self.k) if self.group_by else max(self.fetch_k, self.k)
+
+    def keyword_docs(self, query):
+        with timed("keyword_search"):
+            ids = self.index.ids_where(self.search_filter) if self.search_filter else None
+            return [self.index.document(doc_id) for doc_id, _ in self.index.search(query, self.candidates_k, ids=ids)]
+
+    def vector_kwargs(self):
+        kwargs = {"k": self.candidates_k}
+        if self.search_filter:
+            kwargs["filter"] = self.search_filter
+        return kwargs
+
+    def finish(self, rankings):
+        if self.boost:
+            order = {file: rank for rank, file in enumerate(self.boost)}
+            pool = {doc_key(doc): doc for ranking in rankings for doc in ranking}.values()
+            rankings = rankings + [sorted((doc for doc in pool if doc.metadata.get("file") in order),
+                                          key=lambda doc: order[doc.metadata["file"]])]
+        fused = reciprocal_rank_fusion(rankings)
+        if self.group_by:
+            return group_first(fused, self.group_by, self.k)
+        return fused[:self.k]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun):
+        if not self.k:
+            return []  # a filter nothing matches
+        keyword = self.keyword_docs(query)
+        try:
+            with timed("vector_search"):  # includes the question embedding (cache or API)
+                dense = self.vectorstore.similarity_search(query, **self.vector_kwargs())
+        except Exception:
+            logger.exception("Vector search failed, using keyword results only")
+            return self.finish([keyword])
+        return self.finish([dense, keyword])
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun):
+        if not self.k:
+            return []
+        # BM25 scoring is CPU work: it runs in a worker thread, alongside the vector search
+        keyword = asyncio.ensure_future(asyncio.to_thread(self.keyword_docs, query))
+        try:
+            with timed("vector_search"):
+                dense = await asyncio.wait_for(self.vectorstore.asimilarity_search(query, **self.vector_kwargs()),
+                                               self.vector_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Vector search took over %.1fs, using keyword results only", self.vector_timeout)
+            return self.finish([await keyword])
+        except Exception:
+            logger.exception("Vector search failed, using keyword results only")
+            return self.finish([await keyword])
+        return self.finish([dense, await keyword])
+
+
+def batch_retrieve(retrievers, questions, vectors, search):
+    """Hybrid retrieval for many questions at once.
+
+    retrievers[i] is a HybridRetriever holding question i's filter, grouping
+    and k. Questions with the same filter share one multi-vector search
+    (search(vectors, k, filter) -> a Document list per vector); a question
+    whose vector is None gets keyword results only. A chunk retrieved for
+    several questions is the same Document object in each list. Returns
+    (Document lists, number of distinct chunks).
+    """
+    groups = {}
+    for i, (retriever, vector) in enumerate(zip(retrievers, vectors)):
+        if vector is not None and retriever.k:
+            key = (json.dumps(retriever.search_filter, sort_keys=True), retriever.candidates_k)
+            groups.setdefault(key, []).append(i)
+    dense = [[] for _ in questions]
+    with timed("batch_vector_search"):
+        for members in groups.values():
+            retriever = retrievers[members[0]]
+            try:
+                found = search([vectors[i] for i in members], retriever.candidates_k, retriever.search_filter)
+            except Exception:
+                logger.exception("Batch vector search failed, using keyword results only")
+                continue
+            for i, docs in zip(members, found):
+                dense[i] = docs
+    chunks = {}
+    results = []
+    for retriever, question, docs in zip(retrievers, questions, dense):
+        fused = retriever.finish([docs, retriever.keyword_docs(question)]) if retriever.k else []
+        results.append([chunks.setdefault(doc_key(doc), doc) for doc in fused])
+    return results, len(chunks)
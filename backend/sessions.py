@@ -0,0 +1,228 @@
+from collections import OrderedDict
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import SystemMessage, messages_from_dict, messages_to_dict
+from functools import partial
+from state import STATE_BACKEND, shared_state
+import asyncio
+import json
+import os
+import threading
+import time
+
+# Bounded per-session conversation store.
+#  - at most SESSION_MAX_SESSIONS sessions and SESSION_MAX_CHARS characters
+#    of history in memory; least recently used sessions are dropped first
+#  - sessions idle for SESSION_IDLE_TTL seconds are dropped
+#  - each session keeps its last `window` exchanges (and at most `max_tokens`),
+#    or, with a summarizer, folds older exchanges into a leading summary
+#    SystemMessage once over budget (see summarizer.py)
+#  - with a shared state backend (STATE_BACKEND, see state.py; or
+#    SESSION_DB_PATH, a SQLite file), every change is written behind to it,
+#    so dropped sessions are reloaded on their next turn, survive restarts and
+#    are seen by every worker: a session kept in memory is reloaded when
+#    another worker has changed it since; aget() does those reads in a worker
+#    thread, off the event loop and outside the store lock
+
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_MAX_CHARS = int(os.getenv("SESSION_MAX_CHARS", "20000000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "")
+SESSION_DB_TTL = float(os.getenv("SESSION_DB_TTL", str(7 * 24 * 3600)))
+
+
+def message_chars(message):
+    return len(message.content) if isinstance(message.content, str) else len(str(message.content))
+
+
+def approx_tokens(messages):
+    return sum(message_chars(m) for m in messages) // 4
+
+
+def dump_messages(messages):
+    return json.dumps(messages_to_dict(messages))
+
+
+def summary_head(messages):
+    # 1 if the history starts with a rolled-up summary, else 0
+    return 1 if messages and isinstance(messages[0], SystemMessage) else 0
+
+
+class SessionHistory(BaseChatMessageHistory):
+    """Chat history owned by a SessionStore; every change goes back to the store."""
+
+    def __init__(self, store, session_id, messages=None):
+        self.store = store
+        self.session_id = session_id
+        self.messages = list(messages or [])
+        self.chars = sum(message_chars(m) for m in self.messages)
+        self.last_used = time.time()
+        self.version = None  # of the stored copy this one matches
+
+    def add_message(self, message):
+        self.messages.append(message)
+        self.store.changed(self)
+
+    def add_messages(self, messages):
+        self.messages.extend(messages)
+        self.store.changed(self)
+
+    def clear(self):
+        self.messages = []
+        self.store.changed(self)
+
+    def replace_prefix(self, prefix, message):
+        # Swap the leading messages for `message`, unless the history changed
+        # underneath (trimmed or cleared) since `prefix` was read.
+        with self.store.lock:
+            current = self.messages[:len(prefix)]
+            if len(current) != len(prefix) or any(a is not b for a, b in zip(current, prefix)):
+                return False
+            self.messages[:len(prefix)] = [message]
+            self.store.changed(self)
+            return True
+
+
+class SessionStore:
+    def __init__(self, window=10, max_tokens=None, max_sessions=SESSION_MAX_SESSIONS,
+                 max_chars=SESSION_MAX_CHARS, idle_ttl=SESSION_IDLE_TTL, db_path=SESSION_DB_PATH,
+                 db_ttl=SESSION_DB_TTL, name="sessions", summarizer=None, state=None):
+        self.window = window
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer
+        self.max_sessions = max_sessions
+        self.max_chars = max_chars
+        self.idle_ttl = idle_ttl
+        self.db_ttl = db_ttl
+        self.prefix = f"{name}:"
+        self.sessions = OrderedDict()
+        self.chars = 0
+        self.last_sweep = time.time()
+        self.lock = threading.RLock()
+        self.stats = {"hits": 0, "loads": 0, "stale": 0, "created": 0, "evicted": 0, "expired": 0}
+        self.state = state or shared_state(STATE_BACKEND or (db_path and f"sqlite:///{db_path}"))
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, session_id):
+        if self.summarizer is not None:
+            self.summarizer.remember_loop()
+        history = self._cached(session_id, self._version(session_id))
+        return history or self._install(session_id, self._load(session_id))
+
+    async def aget(self, session_id):
+        """get() for the event loop: the shared state is read in a worker thread."""
+        if self.state is None:
+            return self.get(session_id)
+        if self.summarizer is not None:
+            self.summarizer.remember_loop()
+        history = self._cached(session_id, await asyncio.to_thread(self._version, session_id))
+        return history or self._install(session_id, await asyncio.to_thread(self._load, session_id))
+
+    def _cached(self, session_id, version):
+        # The session in memory, unless another worker has written a newer
+        # version (read beforehand, outside the lock) since
+        with self.lock:
+            self._sweep()
+            history = self.sessions.get(session_id)
+            if history is None:
+                return None
+            if self._stale(history, version):
+                self.stats["stale"] += 1
+                self.chars -= self.sessions.pop(session_id).chars
+                return None
+            self.stats["hits"] += 1
+            self.sessions.move_to_end(session_id)
+            history.last_used = time.time()
+            return history
+
+    def _install(self, session_id, loaded):
+        with self.lock:
+            history = self.sessions.get(session_id)
+            if history is None:
+                # Not loaded by a concurrent get() in the meantime
+                history = SessionHistory(self, session_id, loaded[0])
+                history.version = loaded[1]
+                self.sessions[session_id] = history
+                self.chars += history.chars
+                self._enforce(keep=session_id)
+            history.last_used = time.time()
+            return history
+
+    def changed(self, history):
+        with self.lock:
+            self._trim(history)
+            old = history.chars
+            history.chars = sum(message_chars(m) for m in history.messages)
+            history.last_used = time.time()
+            if self.sessions.get(history.session_id) is history:
+                self.chars += history.chars - old
+                self.sessions.move_to_end(history.session_id)
+                self._enforce(keep=history.session_id)
+            self._save(history)
+            if self.summarizer is not None:
+                self.summarizer.maybe_schedule(history)
+
+    def drop(self, session_id):
+        with self.lock:
+            history = self.sessions.pop(session_id, None)
+            if history is not None:
+                self.chars -= history.chars
+            if self.state is not None:
+                self.state.delete(self.prefix + session_id)
+
+    def _trim(self, history):
+        # Keep whole exchanges: the last `window` user/assistant pairs, then
+        # drop from the front until under the token budget. A leading summary
+        # message is always kept.
+        head = summary_head(history.messages)
+        turns = len(history.messages) - head
+        if self.window and turns > 2 * self.window:
+            del history.messages[head:head + turns - 2 * self.window]
+        if self.max_tokens:
+            while len(history.messages) - head > 2 and approx_tokens(history.messages) > self.max_tokens:
+                del history.messages[head:head + 2]
+
+    def _enforce(self, keep=None):
+        while self.sessions and (len(self.sessions) > self.max_sessions or self.chars > self.max_chars):
+            session_id = next(iter(self.sessions))
+            if session_id == keep:
+                if len(self.sessions) == 1:
+                    break
+                self.sessions.move_to_end(session_id)
+                continue
+            self.chars -= self.sessions.pop(session_id).chars
+            self.stats["evicted"] += 1
+
+    def _sweep(self):
+        now = time.time()
+        if now - self.last_sweep < min(60.0, self.idle_ttl):
+            return
+        self.last_sweep = now
+        for session_id in [s for s, h in self.sessions.items() if now - h.last_used > self.idle_ttl]:
+            self.chars -= self.sessions.pop(session_id).chars
+            self.stats["expired"] += 1
+
+    def _version(self, session_id):
+        # Only the version is read; this worker's own unwritten changes are the newest
+        return self.state.version(self.prefix + session_id) if self.state is not None else None
+
+    def _stale(self, history, version):
+        # A change made here after the version was read is newer still
+        return (self.state is not None and version != history.version
+                and not self.state.dirty(self.prefix + history.session_id))
+
+    def _load(self, session_id):
+        if self.state is not None:
+            entry = self.state.get(self.prefix + session_id)
+            if entry:
+                self.stats["loads"] += 1
+                return messages_from_dict(json.loads(entry[0])), entry[1]
+        self.stats["created"] += 1
+        return [], None
+
+    def _save(self, history):
+        if self.state is not None:
+            # Serialized by the writer thread, from a copy of the messages as they are now
+            history.version = self.state.put(self.prefix + history.session_id,
+                                             partial(dump_messages, list(history.messages)), self.db_ttl)
@@ -0,0 +1,108 @@
+from metrics import REGISTRY
+import asyncio
+
+# Coalescing of concurrent identical work. The first caller for a key starts
+# the work in its own task; callers arriving with the same key while it runs
+# await that task instead of repeating it. A streamed result is fanned out:
+# every subscriber gets all items from the first one, so a late joiner
+# replays what was already produced and then follows live. The work runs
+# detached from its callers, so one of them disconnecting does not cancel it
+# for the others; a stream with no subscribers left is cancelled.
+
+FLIGHTS = REGISTRY.counter("singleflight_calls_total", "Calls that started work (leader) or joined it (coalesced)",
+                           ["flight", "outcome"])
+
+
+def normalize(text):
+    # Case and whitespace don't change the question
+    return " ".join(str(text).casefold().split())
+
+
+class Broadcast:
+    """Items of one async iterator, replayed to any number of subscribers."""
+
+    def __init__(self, source, on_done):
+        self.items = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+        self.task.add_done_callback(lambda _: on_done())
+
+    async def _pump(self, source):
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._wake()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._wake()
+
+    def _wake(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def subscribe(self):
+        self.subscribers += 1
+        try:
+            i = 0
+            while True:
+                while i < len(self.items):
+                    yield self.items[i]
+                    i += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self.changed.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done:
+                self.task.cancel()
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}  # key -> Task
+        self.streams = {}  # key -> Broadcast
+        self.stats = {"leaders": 0, "coalesced": 0}
+
+    def _count(self, outcome):
+        self.stats[outcome] += 1
+        FLIGHTS.inc(flight=self.name, outcome="leader" if outcome == "leaders" else outcome)
+
+    async def do(self, key, fn):
+        """Result of fn() (a coroutine function), shared with concurrent calls for the same key."""
+        task = self.calls.get(key)
+        if task is None:
+            self._count("leaders")
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+            task.add_done_callback(lambda t: self._finished(self.calls, key, t))
+        else:
+            self._count("coalesced")
+        # shield: a caller that is cancelled leaves the work running for the rest
+        return await asyncio.shield(task)
+
+    async def stream(self, key, fn):
+        """Items of fn() (an async generator function), fanned out to concurrent calls for the same key."""
+        broadcast = self.streams.get(key)
+        if broadcast is None:
+            self._count("leaders")
+            broadcast = Broadcast(fn(), lambda: self.streams.pop(key, None))
+            self.streams[key] = broadcast
+        else:
+            self._count("coalesced")
+        async for item in broadcast.subscribe():
+            yield item
+
+    @staticmethod
+    def _finished(registry, key, task):
+        if registry.get(key) is task:
+            del registry[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every caller has gone
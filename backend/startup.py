@@ -0,0 +1,160 @@
+from metrics import REGISTRY
+import asyncio
+import logging
+import os
+import threading
+import time
+
+# Fast cold start. Heavy clients (LLM and embedding SDKs, the vector store,
+# chains over them) are registered with lazy() and built on first use
+# instead of at import, so a worker is accepting connections before they
+# exist. warm_up() builds them all; installed apps run it in the background
+# at startup (STARTUP_WARMUP=1) and GET /ready answers 200 only once it has
+# finished, while GET /live only says the process is up. GET /startup breaks
+# the cold start down by step and component.
+
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1") == "1"  # 0: build components on the first request
+
+logger = logging.getLogger(__name__)
+
+
+def process_age():
+    """Seconds since this process started (Linux), None where /proc is missing."""
+    try:
+        with open("/proc/self/stat") as f:
+            started = int(f.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        with open("/proc/uptime") as f:
+            return float(f.read().split()[0]) - started
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Lazy:
+    """Stands in for the object factory() returns, building it once on first attribute access."""
+
+    def __init__(self, name, factory):
+        self._name, self._factory = name, factory
+        self._value = None
+        self._built = False
+        self._lock = threading.Lock()
+        self._seconds = None
+        self._error = None
+
+    def _get(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    start = time.perf_counter()
+                    try:
+                        self._value = self._factory()
+                    except Exception as e:
+                        # Not cached: the next use tries again (e.g. once a key is set)
+                        self._error = repr(e)
+                        raise
+                    self._seconds = time.perf_counter() - start
+                    self._error = None
+                    self._built = True
+        return self._value
+
+    def __getattr__(self, attr):
+        return getattr(self._get(), attr)
+
+    def __repr__(self):
+        return f"Lazy({self._name!r}, built={self._built})"
+
+
+class Startup:
+    def __init__(self):
+        self.components = {}  # name -> Lazy, in registration order
+        self.steps = {}  # name -> seconds, see mark()
+        self.last_mark = None
+        self.warm_up_seconds = None
+        self.ready = threading.Event()
+
+    def lazy(self, name, factory):
+        # Names are unique per process; a module imported twice re-registers
+        self.components[name] = Lazy(name, factory)
+        return self.components[name]
+
+    def mark(self, step):
+        """Record the time since the previous mark (the first one: since the process started)."""
+        now = time.perf_counter()
+        if self.last_mark is None:
+            age = process_age()
+            self.steps[step] = age if age is not None else 0.0
+        else:
+            self.steps[step] = now - self.last_mark
+        self.last_mark = now
+
+    def warm_up(self):
+        """Build every registered component; True when all of them are."""
+        start = time.perf_counter()
+        ok = True
+        for name, component in list(self.components.items()):
+            try:
+                component._get()
+            except Exception:
+                ok = False
+                logger.exception("Warm-up of %s failed", name)
+        self.warm_up_seconds = time.perf_counter() - start
+        if ok:
+            self.ready.set()
+        return ok
+
+    def pending(self):
+        return [name for name, component in self.components.items() if not component._built]
+
+    def report(self):
+        return {
+            "ready": self.ready.is_set(),
+            "steps": {name: round(seconds, 4) for name, seconds in self.steps.items()},
+            "warm_up_seconds": self.warm_up_seconds and round(self.warm_up_seconds, 4),
+            "components": {name: {"built": c._built, "seconds": c._seconds and round(c._seconds, 4),
+                                  **({"error": c._error} if c._error else {})}
+                           for name, c in self.components.items()},
+        }
+
+
+def built(obj):
+    """False for a lazy component that hasn't been built yet (e.g. so metrics don't build it)."""
+    return not isinstance(obj, Lazy) or obj._built
+
+
+STARTUP = Startup()
+lazy = STARTUP.lazy
+mark = STARTUP.mark
+
+
+def install_probes(app, startup=STARTUP):
+    """GET /live, /ready and /startup on a FastAPI app, plus the background warm-up."""
+    from fastapi.responses import JSONResponse
+
+    REGISTRY.gauge("startup_seconds", "Cold start time by step and component",
+                   lambda: {**{("step", name): s for name, s in startup.steps.items()},
+                            **{("component", name): c._seconds for name, c in startup.components.items()
+                               if c._seconds is not None}}, ["kind", "name"])
+    REGISTRY.gauge("ready", "1 once every component is built", lambda: int(startup.ready.is_set()))
+
+    @app.on_event("startup")
+    async def warm_up():
+        if not STARTUP_WARMUP:
+            startup.ready.set()
+            return
+        # Kept on the app so the task isn't garbage collected mid-run
+        app.state.warm_up = asyncio.create_task(asyncio.to_thread(startup.warm_up))
+
+    @app.get("/live")
+    async def live():
+        return {"status": "ok"}
+
+    @app.get("/ready")
+    async def ready():
+        if not startup.ready.is_set() and not startup.pending():
+            startup.ready.set()  # a failed warm-up step has since been built on demand
+        if startup.ready.is_set():
+            return {"status": "ready"}
+        return JSONResponse({"status": "starting", "pending": startup.pending()}, status_code=503)
+
+    @app.get("/startup")
+    async def startup_report():
+        return startup.report()
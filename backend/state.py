@@ -0,0 +1,254 @@
+from metrics import REGISTRY
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# State shared by every worker (process) serving the app: conversation
+# history and cached answers, so a user's next turn can land on any worker.
+# A backend holds versioned key/value entries with an expiry, and append-only
+# logs read by cursor:
+#  - SQLiteState: one SQLite file in WAL mode, for the workers of one host
+#    (STATE_BACKEND=sqlite:///path/to/state.sqlite3)
+#  - RedisState: any client with the redis-py API (redis, valkey, fakeredis),
+#    for workers on several hosts (STATE_BACKEND=redis://host:6379/0)
+# SharedState sits in front of the backend and batches writes: put() and
+# append() return at once and a background thread writes everything changed
+# in the last STATE_FLUSH_INTERVAL seconds in one transaction / pipeline,
+# keeping only the latest value of a key. Its readers keep their own
+# in-memory copies (see sessions.py and answer_cache.py) and only check the
+# version, reloading an entry when another worker has written it since.
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "")  # "" = each worker keeps its own state
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "0.05"))  # 0 = write through
+STATE_FLUSH_BATCH = int(os.getenv("STATE_FLUSH_BATCH", "500"))  # pending writes that trigger an early flush
+STATE_SYNC_INTERVAL = float(os.getenv("STATE_SYNC_INTERVAL", "0.5"))  # seconds between reads of a log
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteState:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA busy_timeout=5000")  # other workers' writes
+        self.db.execute("CREATE TABLE IF NOT EXISTS state ("
+                        " key TEXT PRIMARY KEY, value TEXT NOT NULL, version TEXT NOT NULL, expires REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS state_expires ON state (expires)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS state_log ("
+                        " id INTEGER PRIMARY KEY AUTOINCREMENT, log TEXT NOT NULL, value TEXT NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS state_log_log ON state_log (log, id)")
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.db.execute("SELECT value, version FROM state WHERE key = ? AND expires > ?",
+                                   (key, time.time())).fetchone()
+
+    def version(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT version FROM state WHERE key = ? AND expires > ?",
+                                  (key, time.time())).fetchone()
+        return row and row[0]
+
+    def write(self, puts, deletes, logs):
+        """puts: [(key, value, version, ttl)], deletes: [key], logs: [(log, value, maxlen)]."""
+        now = time.time()
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?)",
+                                [(key, value, version, now + ttl) for key, value, version, ttl in puts])
+            self.db.executemany("DELETE FROM state WHERE key = ?", [(key,) for key in deletes])
+            self.db.executemany("INSERT INTO state_log (log, value) VALUES (?, ?)",
+                                [(log, value) for log, value, _ in logs])
+            for log, maxlen in {log: maxlen for log, _, maxlen in logs}.items():
+                self.db.execute("DELETE FROM state_log WHERE log = ? AND id <= "
+                                "(SELECT MAX(id) FROM state_log WHERE log = ?) - ?", (log, log, maxlen))
+            self.db.execute("DELETE FROM state WHERE expires <= ?", (now,))
+
+    def read_log(self, log, cursor, count):
+        """Values appended to log after cursor (None: from the start), and the new cursor."""
+        with self.lock:
+            rows = self.db.execute("SELECT id, value FROM state_log WHERE log = ? AND id > ? ORDER BY id LIMIT ?",
+                                   (log, cursor or 0, count)).fetchall()
+        return [value for _, value in rows], rows[-1][0] if rows else cursor
+
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class RedisState:
+    """Entries as hashes {value, version} with an expiry, logs as streams."""
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        import redis  # optional: pip install redis
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        value, version = self.client.hmget(key, ["value", "version"])
+        return None if value is None else (_text(value), _text(version))
+
+    def version(self, key):
+        return _text(self.client.hget(key, "version"))
+
+    def write(self, puts, deletes, logs):
+        pipe = self.client.pipeline(transaction=False)
+        for key, value, version, ttl in puts:
+            pipe.hset(key, mapping={"value": value, "version": version})
+            pipe.expire(key, max(1, int(ttl)))
+        if deletes:
+            pipe.delete(*deletes)
+        for log, value, maxlen in logs:
+            pipe.xadd(log, {"value": value}, maxlen=maxlen, approximate=True)
+        pipe.execute()
+
+    def read_log(self, log, cursor, count):
+        streams = self.client.xread({log: cursor or "0-0"}, count=count)
+        entries = streams[0][1] if streams else []
+        values = [_text(fields.get(b"value", fields.get("value"))) for _, fields in entries]
+        return values, _text(entries[-1][0]) if entries else cursor
+
+
+class SharedState:
+    def __init__(self, backend, flush_interval=STATE_FLUSH_INTERVAL, flush_batch=STATE_FLUSH_BATCH):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.pending = {}  # key -> (value or callable returning it, version, ttl), None to delete
+        self.logs = []  # (log, value, maxlen)
+        self.flushing = {}  # the batch being written, still this worker's latest values
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stats = {"writes": 0, "coalesced": 0, "flushes": 0, "flushed": 0, "errors": 0}
+        self.thread = None
+        if flush_interval > 0:
+            self.thread = threading.Thread(target=self._run, name="state-writer", daemon=True)
+            self.thread.start()
+        atexit.register(self.flush)
+
+    def _local(self, key):
+        # This worker's newest value of key, not yet in the backend (or None)
+        with self.lock:
+            if key in self.pending:
+                return True, self.pending[key]
+            if key in self.flushing:
+                return True, self.flushing[key]
+        return False, None
+
+    def get(self, key):
+        """(value, version) of key, None when missing."""
+        local, entry = self._local(key)
+        if local:
+            return None if entry is None else (_materialize(entry[0]), entry[1])
+        return self.backend.get(key)
+
+    def version(self, key):
+        local, entry = self._local(key)
+        if local:
+            return None if entry is None else entry[1]
+        return self.backend.version(key)
+
+    def dirty(self, key):
+        return self._local(key)[0]
+
+    def put(self, key, value, ttl):
+        """Store value (or a callable producing it, called at write time) under key; returns its version."""
+        version = uuid.uuid4().hex
+        self._enqueue(key, (value, version, ttl))
+        return version
+
+    def delete(self, key):
+        self._enqueue(key, None)
+
+    def append(self, log, value, maxlen):
+        with self.lock:
+            self.logs.append((log, value, maxlen))
+            self.stats["writes"] += 1
+        self._written()
+
+    def read_log(self, log, cursor, count=1000):
+        return self.backend.read_log(log, cursor, count)
+
+    def _enqueue(self, key, entry):
+        with self.lock:
+            if key in self.pending:
+                self.stats["coalesced"] += 1
+            self.pending[key] = entry
+            self.stats["writes"] += 1
+        self._written()
+
+    def _written(self):
+        if self.thread is None:
+            self.flush()
+        elif len(self.pending) + len(self.logs) >= self.flush_batch:
+            self.wake.set()
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Writing shared state failed, retrying")
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending and not self.logs:
+                    return
+                self.flushing, self.pending = self.pending, {}
+                logs, self.logs = self.logs, []
+            puts = [(key, _materialize(entry[0]), *entry[1:]) for key, entry in self.flushing.items()
+                    if entry is not None]
+            deletes = [key for key, entry in self.flushing.items() if entry is None]
+            try:
+                self.backend.write(puts, deletes, logs)
+                self.stats["flushes"] += 1
+                self.stats["flushed"] += len(puts) + len(deletes) + len(logs)
+            except Exception:
+                # Kept for the next flush, unless newer values have replaced them
+                self.stats["errors"] += 1
+                with self.lock:
+                    self.pending = {**self.flushing, **self.pending}
+                    self.logs = logs + self.logs
+                raise
+            finally:
+                with self.lock:
+                    self.flushing = {}
+
+
+def _materialize(value):
+    return value() if callable(value) else value
+
+
+_shared = {}
+
+
+def shared_state(url=STATE_BACKEND):
+    """The process-wide SharedState for url (sqlite:///path or redis://...), None for ""."""
+    if not url:
+        return None
+    if url not in _shared:
+        if url.startswith("sqlite:///"):
+            backend = SQLiteState(url[len("sqlite:///"):])
+        elif url.startswith(("redis://", "rediss://", "unix://")):
+            backend = RedisState.from_url(url)
+        else:
+            raise ValueError(f"Unsupported STATE_BACKEND {url!r}, expected sqlite:///path or redis://host")
+        _shared[url] = SharedState(backend)
+        REGISTRY.gauge("state_events_total", "Shared state writes and flushes",
+                       lambda: {(url.split(":")[0], event): value for url, state in _shared.items()
+                                for event, value in state.stats.items()}, ["backend", "event"], kind="counter")
+    return _shared[url]
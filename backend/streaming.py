@@ -0,0 +1,20 @@
+from fastapi.responses import StreamingResponse
+import json
+
+# Server-sent events: one JSON payload per "data:" line.
+#   {"token": "..."}  for each piece of the answer, in order
+#   {"done": true, ...} once the answer is complete
+#   {"error": "..."}  if generation failed midway
+
+
+def sse(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def sse_response(events):
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        # Stop proxies (nginx) from buffering the stream into one response.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
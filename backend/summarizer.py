@@ -0,0 +1,91 @@
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from sessions import approx_tokens, summary_head
+import asyncio
+import logging
+import os
+
+# Summary memory mode: recent exchanges stay verbatim, older ones are folded
+# into a running summary kept as a SystemMessage at the head of the session
+# history. Summarising only starts once the history exceeds its token budget
+# and runs as a background task after the turn, never inside the request.
+
+CHAT_MEMORY_MODE = os.getenv("CHAT_MEMORY_MODE", "window")  # window | summary
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "1500"))
+CHAT_SUMMARY_KEEP = int(os.getenv("CHAT_SUMMARY_KEEP", "3"))  # exchanges kept verbatim
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system",
+     "Progressively summarize the conversation. Extend the current summary with the new lines, "
+     "keeping names, candidates, skills, numbers and open questions. Reply with the summary only."),
+    ("human", "Current summary:\n{summary}\n\nNew lines of conversation:\n{lines}\n\nNew summary:"),
+])
+
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+
+class HistorySummarizer:
+    def __init__(self, llm, budget_tokens=CHAT_HISTORY_TOKENS, keep_recent=CHAT_SUMMARY_KEEP):
+        self.chain = SUMMARY_PROMPT | llm | StrOutputParser()
+        self.budget_tokens = budget_tokens
+        self.keep_recent = keep_recent
+        self.pending = {}
+        self.loop = None
+        self.stats = {"runs": 0, "failures": 0, "turns_folded": 0}
+
+    def foldable(self, messages):
+        # Messages that would be folded into the summary right now.
+        turns = messages[summary_head(messages):]
+        return turns[:max(0, len(turns) - 2 * self.keep_recent)]
+
+    def remember_loop(self):
+        # LangChain saves memory from executor threads (asave_context), where
+        # there is no running loop, so keep hold of the serving loop.
+        try:
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+
+    def maybe_schedule(self, history):
+        if history.session_id in self.pending:
+            return
+        if approx_tokens(history.messages) <= self.budget_tokens or not self.foldable(history.messages):
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            if self.loop is not None and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self._start, history)
+            return  # no loop at all (e.g. a script): stay verbatim until the next async turn
+        self._start(history)
+
+    def _start(self, history):
+        if history.session_id in self.pending:
+            return
+        task = asyncio.get_running_loop().create_task(self.summarize(history))
+        self.pending[history.session_id] = task
+        task.add_done_callback(lambda _: self.pending.pop(history.session_id, None))
+
+    async def summarize(self, history):
+        messages = list(history.messages)
+        old = self.foldable(messages)
+        if not old:
+            return
+        head = summary_head(messages)
+        summary = messages[0].content.removeprefix(SUMMARY_PREFIX) if head else ""
+        lines = "\n".join(
+            f"{'User' if isinstance(m, HumanMessage) else 'Assistant'}: {m.content}" for m in old
+        )
+        try:
+            new_summary = await self.chain.ainvoke({"summary": summary or "(none)", "lines": lines})
+        except Exception:
+            self.stats["failures"] += 1
+            logger.exception("History summarisation failed for session %s", history.session_id)
+            return
+        self.stats["runs"] += 1
+        self.stats["turns_folded"] += len(old) // 2
+        history.replace_prefix(messages[:head + len(old)], SystemMessage(content=SUMMARY_PREFIX + new_summary))
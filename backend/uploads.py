@@ -0,0 +1,108 @@
+import asyncio
+import os
+import uuid
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Streaming multipart/form-data receiver. The request body is parsed chunk by
+# chunk as it arrives and every file part is written straight to disk, so
+# memory stays constant whatever the upload size, and each file is handed on
+# (e.g. to a running build) as soon as its part is complete.
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "../uploads")
+UPLOAD_EXTENSIONS = (".pdf", ".zip")
+
+
+class UploadError(ValueError):
+    pass
+
+
+class UploadReceiver:
+    def __init__(self, directory, on_file):
+        self.directory = directory
+        self.on_file = on_file  # called with the final path of each completed file
+        self.files = []
+        self.skipped = []
+        self.header_field = b""
+        self.header_value = b""
+        self.headers = {}
+        self.out = None
+        self.tmp = None
+        self.target = None
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.part_begin,
+            "on_header_field": lambda data, start, end: setattr(self, "header_field", self.header_field + data[start:end]),
+            "on_header_value": lambda data, start, end: setattr(self, "header_value", self.header_value + data[start:end]),
+            "on_header_end": self.header_end,
+            "on_headers_finished": self.headers_finished,
+            "on_part_data": self.part_data,
+            "on_part_end": self.part_end,
+        }
+
+    def part_begin(self):
+        self.headers, self.out = {}, None
+
+    def header_end(self):
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field, self.header_value = b"", b""
+
+    def headers_finished(self):
+        _, options = parse_options_header(self.headers.get(b"content-disposition"))
+        filename = os.path.basename(options.get(b"filename", b"").decode("utf-8", "replace").replace("\\", "/"))
+        if not filename:
+            return  # a plain form field
+        if not filename.lower().endswith(UPLOAD_EXTENSIONS):
+            self.skipped.append(filename)
+            return
+        # Written under a temporary name and renamed once complete, so a
+        # half-received file is never picked up by a build.
+        self.target = os.path.join(self.directory, filename)
+        self.tmp = f"{self.target}.{uuid.uuid4().hex}.part"
+        self.out = open(self.tmp, "wb")
+
+    def part_data(self, data, start, end):
+        if self.out is not None:
+            self.out.write(data[start:end])
+
+    def part_end(self):
+        if self.out is None:
+            return
+        self.out.close()
+        self.out = None
+        os.replace(self.tmp, self.target)
+        self.files.append(self.target)
+        self.on_file(self.target)
+
+    def abort(self):
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+            os.remove(self.tmp)
+
+
+async def receive_uploads(request, on_file, directory=UPLOAD_DIR):
+    """Stream every PDF / zip file part of a multipart request into directory.
+
+    Returns (saved paths, skipped file names); parsing and disk writes run
+    off the event loop.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type"))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise UploadError("Expected a multipart/form-data upload")
+    os.makedirs(directory, exist_ok=True)
+    receiver = UploadReceiver(directory, on_file)
+    parser = MultipartParser(options[b"boundary"], receiver.callbacks())
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                await asyncio.to_thread(parser.write, chunk)
+        parser.finalize()
+    except BaseException:
+        receiver.abort()
+        raise
+    return receiver.files, receiver.skipped
@@ -0,0 +1,66 @@
+"""Per-request overhead of /langchain/chat's chain setup, before and after the shared pipeline.
+
+    python bench/chain_overhead.py --requests 2000 --users 50
+
+Both runs answer through the same prompt | llm | parser pipeline (with the
+StageTimer callbacks) and keep history in the same SessionStore; they only
+differ in when the pipeline is built. "before" builds it for every request,
+as get_chain_for_user used to; "after" reuses main.chat_chain and only looks
+up the user's history. The stub LLM answers instantly, so the timings are
+pure framework overhead.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+os.environ.setdefault("TOGETHER_API_KEY", "offline")
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+import main  # noqa: E402
+from fakes import FakeChatModel  # noqa: E402
+from sessions import SessionStore  # noqa: E402
+
+
+async def per_request_chain(llm, user_id):
+    return main.build_chat_chain(llm), await main.user_sessions.aget(user_id)
+
+
+async def shared_chain(llm, user_id):
+    return await main.get_chain_for_user(user_id)
+
+
+async def run(bind, llm, n, users):
+    main.chat_chain = main.build_chat_chain(llm)
+    main.user_sessions = SessionStore(window=10, db_path="")
+    setup = total = 0.0
+    for i in range(n):
+        started = time.perf_counter()
+        chain, history = await bind(llm, f"user-{i % users}")
+        setup += time.perf_counter() - started
+        answer = await chain.ainvoke({"input": f"question {i}", "history": history.messages})
+        history.add_messages([HumanMessage(content=f"question {i}"), AIMessage(content=answer)])
+        total += time.perf_counter() - started
+    return setup, total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+    llm = FakeChatModel(latency=0.0)
+    ms = lambda seconds: round(1000 * seconds / args.requests, 4)  # noqa: E731
+    setup_before, total_before = asyncio.run(run(per_request_chain, llm, args.requests, args.users))
+    setup_after, total_after = asyncio.run(run(shared_chain, llm, args.requests, args.users))
+    print(json.dumps({
+        "requests": args.requests,
+        "users": args.users,
+        "before": {"setup_ms_per_request": ms(setup_before), "total_ms_per_request": ms(total_before)},
+        "after": {"setup_ms_per_request": ms(setup_after), "total_ms_per_request": ms(total_after)},
+    }, indent=2))
@@ -0,0 +1,65 @@
+"""Cold start of the backend apps: time until a worker can serve and until it is ready.
+
+    python bench/cold_start.py --runs 5 --output cold_start.json
+
+Each run imports the app in a fresh interpreter (in a temporary working
+directory, with placeholder API keys: nothing is called over the network),
+then runs the warm-up that the server starts in the background. "serving"
+is process start -> app imported, i.e. when the port can be bound; "ready"
+adds the warm-up (the old eager import did all of it before serving). The
+per-component breakdown is the last run's GET /startup report.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+CHILD = """
+import json, sys, time
+sys.path[:0] = [{root!r}, {backend!r}]
+import {app}
+from startup import STARTUP, process_age
+serving = process_age()
+STARTUP.warm_up()
+print(json.dumps({{"serving": serving, "ready": process_age(), "report": STARTUP.report()}}))
+"""
+
+
+def run_once(app, workdir):
+    env = {**os.environ, "GOOGLE_API_KEY": "offline", "TOGETHER_API_KEY": "offline"}
+    code = CHILD.format(root=ROOT, backend=os.path.join(ROOT, "backend"), app=app)
+    out = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=env, capture_output=True, text=True,
+                         check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--apps", default="rag3,main")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    results = {}
+    for app in args.apps.split(","):
+        with tempfile.TemporaryDirectory() as workdir:
+            runs = [run_once(app, workdir) for _ in range(args.runs)]
+        results[app] = {
+            "serving_seconds": round(statistics.median(r["serving"] for r in runs), 3),
+            "ready_seconds": round(statistics.median(r["ready"] for r in runs), 3),
+            "startup": runs[-1]["report"],
+        }
+    report = json.dumps({"runs": args.runs, "apps": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
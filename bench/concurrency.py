@@ -0,0 +1,62 @@
+"""Concurrent throughput of the chat endpoints in main.py with stub LLMs.
+
+    python bench/concurrency.py --requests 200 --latency 0.5
+
+Runs the app in-process over ASGI and fires all requests at once: first with a
+blocking stub LLM (how the handlers behaved when they called sync clients on
+the event loop), then with the async stub the handlers now await.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+os.environ.setdefault("TOGETHER_API_KEY", "offline")
+
+import httpx  # noqa: E402
+import main  # noqa: E402
+from fakes import FakeChatModel, FakeTogetherClient  # noqa: E402
+from llm_router import ClientChatModel, LLMRouter  # noqa: E402
+
+
+async def fire(path, n, users):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        started = time.perf_counter()
+        responses = await asyncio.gather(*[
+            http.post(path, json={"user_id": f"user-{i % users}", "prompt": f"question {i}"})
+            for i in range(n)
+        ])
+        elapsed = time.perf_counter() - started
+    ok = sum(r.status_code == 200 for r in responses)
+    return {"path": path, "requests": n, "ok": ok, "seconds": round(elapsed, 3),
+            "requests_per_second": round(n / elapsed, 1)}
+
+
+async def run(args):
+    results = []
+    main.chat_chain = main.build_chat_chain(FakeChatModel(latency=args.latency, blocking=True))
+    blocking_n = min(args.requests, 10)  # serialised, so keep this short
+    results.append({"mode": "blocking", **await fire("/langchain/chat", blocking_n, args.users)})
+
+    main.chat_chain = main.build_chat_chain(FakeChatModel(latency=args.latency))
+    main.raw_llm = LLMRouter.from_models({"together": ClientChatModel(client=FakeTogetherClient(latency=args.latency),
+                                                                      model=main.LLM_MODEL)})
+    results.append({"mode": "async", **await fire("/langchain/chat", args.requests, args.users)})
+    results.append({"mode": "async", **await fire("/together/chat", args.requests, args.users)})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+    results = asyncio.run(run(args))
+    print(json.dumps({"latency": args.latency, "limiter": main.llm_limiter.stats(), "results": results}, indent=2))
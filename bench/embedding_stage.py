@@ -0,0 +1,48 @@
+"""Offline throughput of the build-path embedding stage.
+
+    python bench/embedding_stage.py --chunks 5000 --latency 0.2 --concurrency 8
+
+Uses backend/fakes.FakeEmbeddings (configurable latency and quota-error rate)
+and an in-memory writer, so no API key or vector store is needed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from langchain_core.documents import Document  # noqa: E402
+from embedding_stage import EmbeddingStage  # noqa: E402
+from fakes import FakeEmbeddings  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=0, help="requests/s, 0 = unlimited")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per embedding request")
+    parser.add_argument("--quota-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    embeddings = FakeEmbeddings(latency=args.latency, quota_error_rate=args.quota_error_rate)
+    written = []
+    stage = EmbeddingStage(embeddings, lambda ids, docs, vectors: written.extend(ids),
+                           batch_size=args.batch_size, concurrency=args.concurrency, rate=args.rate)
+    items = ((str(i), Document(page_content=f"chunk {i} " * 50)) for i in range(args.chunks))
+    count = asyncio.run(stage.run(items))
+
+    print(json.dumps({
+        "chunks": count,
+        "requests": embeddings.calls,
+        "chunks_per_second": round(count / stage.stats["seconds"], 1),
+        **vars(args),
+        **stage.stats,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
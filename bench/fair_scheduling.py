@@ -0,0 +1,96 @@
+"""Latency of ordinary users next to one heavy user, and of chat next to batch work.
+
+    python bench/fair_scheduling.py --slots 8 --heavy 300 --users 10 --latency 0.2
+
+All calls go through backend/concurrency.LLMScheduler to a fake chat model
+(backend/fakes.FakeChatModel, --latency per call). "heavy_user": one user fires
+--heavy calls at once, then --users others send --per-user calls each. It
+runs in arrival order (every call as the same user, how the limiter queued
+before), with fair queuing, and with fair queuing plus a --quota request
+quota and the default shedding, which turn most of the heavy user's calls away with 429.
+"batch_vs_interactive": --heavy batch calls are queued, then --users interactive
+calls arrive; compares their wait with and without priority classes.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from fastapi import HTTPException  # noqa: E402
+from langchain_core.messages import HumanMessage  # noqa: E402
+from concurrency import LLMScheduler  # noqa: E402
+from fakes import FakeChatModel  # noqa: E402
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 3) if values else None
+
+
+def summary(latencies, rejected):
+    return {"ok": len(latencies), "rejected": rejected, "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95), "max": percentile(latencies, 1.0)}
+
+
+async def call(scheduler, model, label, user, priority, results):
+    start = time.perf_counter()
+    try:
+        async with scheduler.slot(user, priority):
+            await model.ainvoke([HumanMessage(content="question")])
+        results[label]["latencies"].append(time.perf_counter() - start)
+    except HTTPException:
+        results[label]["rejected"] += 1
+
+
+async def scenario(args, scheduler, heavy_user, heavy_priority, user, priority):
+    """heavy_user(i) / user(u) name the scheduler user of the i-th heavy call / of user u."""
+    model = FakeChatModel(latency=args.latency)
+    results = {"heavy": {"latencies": [], "rejected": 0}, "others": {"latencies": [], "rejected": 0}}
+    heavy = [asyncio.ensure_future(call(scheduler, model, "heavy", heavy_user(i), heavy_priority, results))
+             for i in range(args.heavy)]
+    await asyncio.sleep(args.latency)  # the others arrive once the heavy calls are queued
+    await asyncio.gather(*[call(scheduler, model, "others", user(u), priority, results)
+                           for u in range(args.users) for _ in range(args.per_user)])
+    await asyncio.gather(*heavy)
+    return {label: summary(r["latencies"], r["rejected"]) for label, r in results.items()}
+
+
+async def run(args):
+    unlimited = {"requests_per_minute": 0, "tokens_per_minute": 0, "user_max_queued": 0, "max_queue": 10 ** 6,
+                 "slo": {"interactive": float("inf"), "batch": float("inf")}}
+    heavy = {
+        # Everyone looks the same to the scheduler: first come, first served
+        "arrival_order": await scenario(args, LLMScheduler(args.slots, **unlimited),
+                                        lambda i: None, "interactive", lambda u: None, "interactive"),
+        "fair": await scenario(args, LLMScheduler(args.slots, **unlimited),
+                               lambda i: "heavy", "interactive", lambda u: f"user-{u}", "interactive"),
+        "fair_with_quotas": await scenario(args, LLMScheduler(args.slots, max_queue=10 ** 6,
+                                                              requests_per_minute=args.quota),
+                                           lambda i: "heavy", "interactive", lambda u: f"user-{u}", "interactive"),
+    }
+    # Screening batches from a few users, then interactive questions
+    priority = {
+        "same_class": await scenario(args, LLMScheduler(args.slots, **unlimited),
+                                     lambda i: f"screener-{i % 5}", "interactive", lambda u: f"user-{u}",
+                                     "interactive"),
+        "interactive_first": await scenario(args, LLMScheduler(args.slots, **unlimited),
+                                            lambda i: f"screener-{i % 5}", "batch", lambda u: f"user-{u}",
+                                            "interactive"),
+    }
+    return {"heavy_user": heavy, "batch_vs_interactive": priority}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--slots", type=int, default=8, help="LLM calls at once (LLM_MAX_CONCURRENCY)")
+    parser.add_argument("--heavy", type=int, default=300, help="calls fired at once by the heavy user / batch")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--per-user", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--quota", type=int, default=120, help="USER_REQUESTS_PER_MINUTE in fair_with_quotas")
+    args = parser.parse_args()
+    print(json.dumps({"args": vars(args), "results": asyncio.run(run(args))}, indent=2))
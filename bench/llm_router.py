@@ -0,0 +1,83 @@
+"""Offline tail latency and availability of the LLM router.
+
+    python bench/llm_router.py --requests 300 --latency 0.1 --slow-rate 0.05 --error-rate 0.2
+
+Two backend/fakes.FakeChatModel providers: "primary" with a latency tail
+(--slow-rate calls take --slow-latency) and errors (--error-rate), "backup"
+without. Reports p50/p95/p99 and success rate for the primary alone, with
+failover, and with failover plus hedging.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+from fakes import FakeChatModel  # noqa: E402
+from llm_router import LLMRouter  # noqa: E402
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 3) if values else None
+
+
+async def measure(router, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await router.ainvoke([HumanMessage(content=f"question {i}")])
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    return {"ok": len(latencies), "errors": errors, "success_rate": round(len(latencies) / requests, 4),
+            "p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95), "p99": percentile(latencies, 0.99)}
+
+
+def providers(args):
+    primary = FakeChatModel(latency=args.latency, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                            error_rate=args.error_rate, seed=1)
+    return {"primary": primary, "backup": FakeChatModel(latency=args.latency, seed=2)}
+
+
+async def run(args):
+    results = {}
+    for mode in ("single", "failover", "hedged"):
+        models = providers(args)
+        if mode == "single":
+            models.pop("backup")
+        # Breakers would shed the flaky primary entirely; keep them out of the comparison
+        router = LLMRouter.from_models(models, hedge=mode == "hedged")
+        for provider in router.providers:
+            provider.breaker.max_failures = args.requests + 1
+        results[mode] = await measure(router, args.requests, args.concurrency)
+    # The injected errors must actually fire: the primary alone succeeds about
+    # 1 - error_rate of the time (within 4 standard deviations), failover always
+    expected = 1 - args.error_rate
+    spread = 4 * (args.error_rate * expected / args.requests) ** 0.5 + 1 / args.requests
+    assert abs(results["single"]["success_rate"] - expected) <= spread, results["single"]
+    assert results["failover"]["success_rate"] == 1.0, results["failover"]
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-latency", type=float, default=2.0)
+    parser.add_argument("--error-rate", type=float, default=0.2)
+    args = parser.parse_args()
+    print(json.dumps({"args": vars(args), "results": asyncio.run(run(args))}, indent=2))
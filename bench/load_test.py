@@ -0,0 +1,409 @@
+"""End-to-end offline load test of rag3 and main.py with stub providers.
+
+    python bench/load_test.py --synthetic 10000 --requests 500 --concurrency 32 --output load.json
+
+Both apps are served in-process by uvicorn on local sockets (so a streamed
+answer's first token is timed when its first event arrives, not when the
+response is complete), in a temporary working directory, with the
+deterministic fake embeddings and latency-configurable fake LLMs from
+backend/fakes.py. The knowledge base is built through POST /build from
+CVs_1page.zip, CVs_2pages.zip and a zip of generated one-page CVs, then
+concurrent questions are fired at /ask, /ask/batch (--batch-size per
+request), /ask/stream, /langchain/chat and /together/chat. The JSON report (ingest throughput, latency percentiles,
+RSS, per-stage means from /metrics) carries the git commit so runs can be
+compared across commits.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+import numpy as np  # noqa: E402
+
+BUNDLED = ("CVs_1page.zip", "CVs_2pages.zip")
+
+FIRST = ["Ahmed", "Sara", "Omar", "Mona", "Youssef", "Laila", "Karim", "Nour", "Hassan", "Dina",
+         "James", "Emma", "Lucas", "Olivia", "Mateo", "Sofia", "Ethan", "Amira", "Ali", "Hana"]
+LAST = ["Hassan", "Ibrahim", "Mostafa", "Saleh", "Fawzy", "Kamal", "Nasser", "Smith", "Garcia",
+        "Müller", "Rossi", "Khan", "Tanaka", "Silva", "Novak", "Haddad", "Farouk", "Adel"]
+ROLES = {
+    "Backend Engineer": ["python", "django", "fastapi", "postgresql", "redis", "docker", "rest apis", "celery"],
+    "Frontend Developer": ["javascript", "typescript", "react", "vue", "css", "html", "webpack", "jest"],
+    "Data Scientist": ["python", "pandas", "scikit-learn", "pytorch", "sql", "statistics", "tableau", "spark"],
+    "Cloud Engineer": ["aws", "terraform", "kubernetes", "docker", "ansible", "linux", "ci/cd", "azure"],
+    "Mobile Developer": ["kotlin", "swift", "flutter", "dart", "android", "ios", "firebase", "react native"],
+    "Machine Learning Engineer": ["python", "tensorflow", "pytorch", "mlops", "docker", "nlp", "computer vision", "sql"],
+    "DevOps Engineer": ["jenkins", "gitlab ci", "kubernetes", "terraform", "prometheus", "bash", "linux", "aws"],
+    "QA Engineer": ["selenium", "cypress", "pytest", "jira", "postman", "java", "test automation", "sql"],
+}
+COMPANIES = ["Vodafone", "Valeo", "Instabug", "Swvl", "Fawry", "IBM", "Siemens", "Orange", "Dell", "Microsoft"]
+UNIVERSITIES = ["Cairo University", "Ain Shams University", "Alexandria University", "Mansoura University",
+                "German University in Cairo", "American University in Cairo"]
+QUESTIONS = [
+    "Who has experience with {skill}?",
+    "Compare all {role}s",
+    "Which candidates know {skill} and {skill2}?",
+    "Summarise the experience of {name}",
+    "Who is the best fit for a {role} position?",
+    "What did {name} study?",
+]
+
+
+def synthetic_cv(rng, i):
+    role = rng.choice(sorted(ROLES))
+    skills = rng.sample(ROLES[role], 5) + rng.sample([s for r in ROLES.values() for s in r], 2)
+    name = f"{rng.choice(FIRST)} {rng.choice(LAST)} {i}"
+    lines = [name, role, f"Email: candidate{i}@example.com", ""]
+    lines.append(f"Summary: {role} with {rng.randint(1, 12)} years of experience building production systems.")
+    lines.append(f"Skills: {', '.join(dict.fromkeys(skills))}")
+    lines.append("")
+    lines.append("Experience")
+    for _ in range(rng.randint(2, 4)):
+        start = rng.randint(2010, 2022)
+        lines.append(f"{role} at {rng.choice(COMPANIES)} ({start} - {start + rng.randint(1, 3)})")
+        for _ in range(3):
+            lines.append(f"- Delivered {rng.choice(skills)} work on a {rng.choice(['payments', 'search', 'mobile', 'analytics', 'platform'])} "
+                         f"team, improving {rng.choice(['latency', 'reliability', 'throughput', 'cost'])} by {rng.randint(5, 60)}%.")
+    lines.append("")
+    lines.append("Education")
+    lines.append(f"B.Sc. Computer Science, {rng.choice(UNIVERSITIES)}, {rng.randint(2005, 2020)}")
+    return name, role, lines
+
+
+def pdf_bytes(lines):
+    # Smallest one-page PDF with a text stream that pypdf extracts line by line
+    def escape(text):
+        return text.encode("latin-1", "replace").decode("latin-1").replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    content = "BT /F1 9 Tf 12 TL 40 760 Td " + " ".join(f"({escape(line)}) Tj T*" for line in lines) + " ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+        "/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        f"<< /Length {len(content.encode('latin-1'))} >>\nstream\n{content}\nendstream",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def write_synthetic_zip(path, n, seed):
+    """n generated CVs in one zip; returns the candidate names and roles to ask about."""
+    rng = random.Random(seed)
+    names, roles = [], set()
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for i in range(n):
+            name, role, lines = synthetic_cv(rng, i)
+            archive.writestr(f"synthetic/cv_{i:06d}.pdf", pdf_bytes(lines))
+            names.append(name)
+            roles.add(role)
+    return names, sorted(roles)
+
+
+def rss_mb(pid="self"):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:  # a worker that just exited
+        return 0.0
+
+
+def workers_rss_mb():
+    # The ingest process pool's workers
+    return sum(rss_mb(child.pid) for child in multiprocessing.active_children())
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentiles(seconds):
+    if not seconds:
+        return {}
+    ms = np.array(seconds) * 1000
+    return {f"p{q}_ms": round(float(np.percentile(ms, q)), 2) for q in (50, 95, 99)} | {
+        "max_ms": round(float(ms.max()), 2)}
+
+
+class RssSampler:
+    """Peak RSS (this process, and its worker processes combined) while a phase runs."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = rss_mb()
+        self.workers_peak = 0.0
+        self.task = None
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, rss_mb())
+            self.workers_peak = max(self.workers_peak, workers_rss_mb())
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self.task.cancel()
+        self.peak = max(self.peak, rss_mb())
+
+
+@contextlib.asynccontextmanager
+async def serve(app):
+    """Base URL of app served by uvicorn on a free local port, on this event loop."""
+    import uvicorn
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    # No lifespan: components are built on first use, as over plain ASGI
+    server = uvicorn.Server(uvicorn.Config(app, lifespan="off", log_level="warning", access_log=False))
+    task = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        if task.done():
+            task.result()  # raises why it didn't start
+        await asyncio.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{sock.getsockname()[1]}"
+    finally:
+        server.should_exit = True
+        await task
+        sock.close()
+
+
+async def ingest(http, path):
+    # The first build of an empty index re-reads every file in UPLOAD_DIR
+    started = time.perf_counter()
+    job_id = (await http.post("/build", json={"path": path})).json()["job_id"]
+    while True:
+        job = (await http.get(f"/build/{job_id}")).json()
+        if job["status"] in ("done", "failed"):
+            break
+        await asyncio.sleep(0.2)
+    if job["status"] == "failed":
+        raise RuntimeError(f"build failed: {job['error']}")
+    seconds = time.perf_counter() - started
+    progress, result = job["progress"], job["result"]
+    return {
+        "seconds": round(seconds, 2),
+        "files": progress["files_total"],
+        "chunks": result["chunks_added"],
+        "files_per_second": round(progress["files_total"] / seconds, 1),
+        "chunks_per_second": round(result["chunks_added"] / seconds, 1),
+        "embedding": result.get("embedding"),
+    }
+
+
+async def fire(http, path, bodies, concurrency, stream=False):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, first_tokens, errors = [], [], 0
+
+    async def one(body):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if stream:
+                    failed, first = True, None
+                    async with http.stream("POST", path, json=body) as response:
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            payload = json.loads(line[5:])
+                            if "token" in payload and first is None:
+                                first = time.perf_counter() - started
+                            failed = "error" in payload
+                    if first is not None:
+                        first_tokens.append(first)
+                    if failed or response.status_code != 200:
+                        errors += 1
+                        return
+                else:
+                    response = await http.post(path, json=body)
+                    if response.status_code != 200:
+                        errors += 1
+                        return
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    with RssSampler() as sampler:
+        started = time.perf_counter()
+        await asyncio.gather(*[one(body) for body in bodies])
+        elapsed = time.perf_counter() - started
+    report = {"requests": len(bodies), "errors": errors, "seconds": round(elapsed, 2),
+              "requests_per_second": round(len(bodies) / elapsed, 1), **percentiles(latencies),
+              "peak_rss_mb": round(sampler.peak, 1)}
+    if stream:
+        report["first_token"] = percentiles(first_tokens)
+    return report
+
+
+def questions(rng, n, names, roles):
+    skills = sorted({skill for role_skills in ROLES.values() for skill in role_skills})
+    out = []
+    for i in range(n):
+        template = rng.choice(QUESTIONS)
+        out.append(template.format(skill=rng.choice(skills), skill2=rng.choice(skills), role=rng.choice(roles),
+                                   name=rng.choice(names) if names else "the first candidate"))
+    return out
+
+
+def stage_means():
+    from metrics import STAGE_SECONDS
+    return {key[0]: {"count": row[-1], "mean_ms": round(1000 * row[-2] / row[-1], 3)}
+            for key, row in sorted(STAGE_SECONDS.values.items()) if row[-1]}
+
+
+async def run(args, names, roles):
+    import httpx
+    import main
+    import rag3
+    from fakes import FakeChatModel, FakeTogetherClient
+    from llm_router import ClientChatModel, LLMRouter
+
+    main.chat_chain = main.build_chat_chain(FakeChatModel(latency=args.llm_latency, token_latency=args.token_latency))
+    main.raw_llm = LLMRouter.from_models({"together": ClientChatModel(client=FakeTogetherClient(latency=args.llm_latency),
+                                                                      model=main.LLM_MODEL)})
+    report = {"rss_mb_after_import": round(rss_mb(), 1)}
+
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with serve(rag3.app) as rag_url, serve(main.app) as chat_url, \
+            httpx.AsyncClient(base_url=rag_url, timeout=None, limits=limits) as rag_http, \
+            httpx.AsyncClient(base_url=chat_url, timeout=None, limits=limits) as chat_http:
+        with RssSampler() as sampler:
+            report["ingest"] = await ingest(rag_http, args.corpus[0])
+        report["ingest"]["peak_rss_mb"] = round(sampler.peak, 1)
+        report["ingest"]["peak_workers_rss_mb"] = round(sampler.workers_peak, 1)
+
+        # A fresh question list per endpoint, so one endpoint doesn't warm the
+        # answer cache for the next; repeats within a list are realistic.
+        def rag_bodies():
+            return [{"question": q, "session_id": f"user-{i % args.users}"}
+                    for i, q in enumerate(questions(rng, args.requests, names, roles))]
+
+        def chat_bodies():
+            return [{"user_id": f"user-{i % args.users}", "prompt": q}
+                    for i, q in enumerate(questions(rng, args.requests, names, roles))]
+
+        def batch_bodies():
+            items = [{"question": q} for q in questions(rng, args.requests, names, roles)]
+            return [{"questions": items[i:i + args.batch_size], "user_id": f"user-{i // args.batch_size % args.users}"}
+                    for i in range(0, len(items), args.batch_size)]
+
+        # Batches in flight so that as many LLM calls run at once as on /ask
+        batches = max(1, args.concurrency // rag3.BATCH_CONCURRENCY)
+        report["load"] = {
+            "rag3 /ask": await fire(rag_http, "/ask", rag_bodies(), args.concurrency),
+            "rag3 /ask/batch": await fire(rag_http, "/ask/batch", batch_bodies(), batches),
+            "rag3 /ask/stream": await fire(rag_http, "/ask/stream", rag_bodies(), args.concurrency, stream=True),
+            "main /langchain/chat": await fire(chat_http, "/langchain/chat", chat_bodies(), args.concurrency),
+            "main /langchain/chat/stream": await fire(chat_http, "/langchain/chat/stream", chat_bodies(),
+                                                      args.concurrency, stream=True),
+            "main /together/chat": await fire(chat_http, "/together/chat", chat_bodies(), args.concurrency),
+        }
+    batch = report["load"]["rag3 /ask/batch"]
+    batch["questions_per_second"] = round(args.requests / batch["seconds"], 1)
+    report["stages"] = stage_means()
+    report["caches"] = {"answer": dict(rag3.answer_cache.stats), "embedding": dict(rag3.embeddings.stats)}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--synthetic", type=int, default=10000, help="generated CVs added to the bundled zips")
+    parser.add_argument("--no-bundled", action="store_true", help="index only the generated CVs")
+    parser.add_argument("--requests", type=int, default=500, help="questions per endpoint")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=50, help="questions per /ask/batch request")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds before the fake LLM answers")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="seconds between streamed tokens")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per fake embedding request")
+    parser.add_argument("--embed-rate", type=float, default=0.0, help="EMBED_RATE for the build (0 = unlimited)")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--backend", default=os.getenv("VECTOR_BACKEND", "chroma"), choices=("chroma", "numpy"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="keep the index and uploads here instead of a temp directory")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="rag-load-"))
+    uploads = os.path.join(workdir, "uploads")
+    os.makedirs(os.path.join(workdir, "backend"), exist_ok=True)
+    os.makedirs(uploads, exist_ok=True)
+
+    started = time.perf_counter()
+    names, roles = [], sorted(ROLES)
+    args.corpus = []
+    if args.synthetic:
+        args.corpus.append(os.path.join(uploads, "synthetic.zip"))
+        names, roles = write_synthetic_zip(args.corpus[-1], args.synthetic, args.seed)
+    if not args.no_bundled:
+        for name in BUNDLED:
+            args.corpus.append(shutil.copy(os.path.join(ROOT, name), uploads))
+    if not args.corpus:
+        parser.error("nothing to index: use --synthetic N or drop --no-bundled")
+    corpus_seconds = time.perf_counter() - started
+
+    # The apps resolve their data paths relative to the working directory
+    # (../uploads, ./indexes, ./*.sqlite3), so everything lands in workdir.
+    os.chdir(os.path.join(workdir, "backend"))
+    os.environ.update({"GOOGLE_API_KEY": "offline", "TOGETHER_API_KEY": "offline", "UPLOAD_DIR": uploads,
+                       "VECTOR_BACKEND": args.backend, "EMBED_RATE": str(args.embed_rate)})
+
+    import langchain_google_genai
+    from fakes import FakeChatModel, FakeEmbeddings
+    langchain_google_genai.GoogleGenerativeAIEmbeddings = lambda model, **kwargs: FakeEmbeddings(
+        dim=args.dim, latency=args.embed_latency, model=model)
+    langchain_google_genai.ChatGoogleGenerativeAI = lambda **kwargs: FakeChatModel(
+        latency=args.llm_latency, token_latency=args.token_latency)
+
+    try:
+        report = asyncio.run(run(args, names, roles))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report = {
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "workdir", "corpus")},
+        "corpus_seconds": round(corpus_seconds, 2),
+        **report,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Conversation history shared by several worker processes through backend/state.py.
+
+    python bench/shared_state.py --workers 4 --sessions 200 --turns 5
+
+"writes": turns per second a single store saves with every change written
+through (STATE_FLUSH_INTERVAL=0) and written behind in batches. "reads":
+SessionStore.get() when the session is in memory (only its version is
+checked), when another worker changed it (reloaded), and with no shared
+state at all. "workers": --workers processes take turns answering each
+session, as when a load balancer sends a user's turns to any worker, with
+--think seconds between a user's turns; "lost_turns" counts turns that
+were missing from the history the next worker saw.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+from sessions import SessionStore  # noqa: E402
+from state import SQLiteState, SharedState  # noqa: E402
+
+
+def turn(history, i):
+    history.add_messages([HumanMessage(content=f"question {i} " + "x" * 200),
+                          AIMessage(content=f"answer {i} " + "y" * 800)])
+
+
+def store(path, flush_interval):
+    return SessionStore(window=None, name="bench", state=SharedState(SQLiteState(path), flush_interval=flush_interval))
+
+
+def writes(args, workdir):
+    results = {}
+    for mode, interval in (("write_through", 0), ("write_behind", 0.05)):
+        sessions = store(os.path.join(workdir, f"{mode}.sqlite3"), interval)
+        started = time.perf_counter()
+        for i in range(args.sessions * args.turns):
+            turn(sessions.get(f"user-{i % args.sessions}"), i)
+        elapsed = time.perf_counter() - started
+        sessions.state.flush()
+        results[mode] = {"turns_per_second": round(args.sessions * args.turns / elapsed), **sessions.state.stats}
+    return results
+
+
+def timed_gets(sessions, ids):
+    started = time.perf_counter()
+    for session_id in ids:
+        sessions.get(session_id)
+    return round((time.perf_counter() - started) / len(ids) * 1e6, 1)
+
+
+def reads(args, workdir):
+    path = os.path.join(workdir, "reads.sqlite3")
+    a, b = store(path, 0), store(path, 0)
+    ids = [f"user-{i}" for i in range(args.sessions)]
+    local = SessionStore(window=None, name="bench")
+    for i, session_id in enumerate(ids):
+        for _ in range(args.turns):
+            turn(a.get(session_id), i)
+            turn(local.get(session_id), i)
+    timed_gets(b, ids)  # b now holds every session
+    in_memory = timed_gets(b, ids)
+    for i, session_id in enumerate(ids):
+        turn(a.get(session_id), i)  # changed by the other worker
+    return {"in_memory_us": in_memory, "changed_elsewhere_us": timed_gets(b, ids),
+            "process_local_us": timed_gets(local, ids)}
+
+
+def worker(path, inbox, outbox):
+    sessions = store(path, 0.05)
+    for session_id, i in iter(inbox.get, None):
+        history = sessions.get(session_id)
+        seen = len(history.messages) // 2
+        turn(history, i)
+        outbox.put(seen)
+    sessions.state.flush()
+
+
+def workers(args, workdir):
+    path = os.path.join(workdir, "workers.sqlite3")
+    context = multiprocessing.get_context("spawn")
+    outbox = context.Queue()
+    inboxes = [context.Queue() for _ in range(args.workers)]
+    procs = [context.Process(target=worker, args=(path, inbox, outbox)) for inbox in inboxes]
+    for proc in procs:
+        proc.start()
+    rng = random.Random(0)
+    lost = 0
+    started = time.perf_counter()
+    for i in range(args.turns):
+        # Every session takes its i-th turn on a random worker, --think after its last one
+        time.sleep(args.think)
+        for s in range(args.sessions):
+            rng.choice(inboxes).put((f"user-{s}", i))
+        lost += sum(i - outbox.get() for _ in range(args.sessions))
+    elapsed = time.perf_counter() - started
+    for inbox in inboxes:
+        inbox.put(None)
+    for proc in procs:
+        proc.join()
+    return {"workers": args.workers, "turns": args.sessions * args.turns, "lost_turns": lost,
+            "seconds": round(elapsed, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--think", type=float, default=0.2, help="seconds between a user's turns")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        results = {"writes": writes(args, workdir), "reads": reads(args, workdir), "workers": workers(args, workdir)}
+    print(json.dumps({"args": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
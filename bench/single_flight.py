@@ -0,0 +1,91 @@
+"""Upstream calls saved by coalescing concurrent identical requests.
+
+    python bench/single_flight.py --requests 200 --distinct 10 --latency 0.5
+
+Fires a burst of --requests concurrent calls spread over --distinct prompts
+at main.py's /together/chat (fake Together client), at the question
+embedding cache (fake embeddings) and at a fanned-out token stream (fake
+chat model), and counts the upstream calls each made.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+os.environ.setdefault("TOGETHER_API_KEY", "offline")
+
+import httpx  # noqa: E402
+import main  # noqa: E402
+from embedding_cache import CachedEmbeddings  # noqa: E402
+from fakes import FakeChatModel, FakeEmbeddings, FakeTogetherClient  # noqa: E402
+from langchain_core.messages import HumanMessage  # noqa: E402
+from llm_router import ClientChatModel, LLMRouter  # noqa: E402
+from single_flight import SingleFlight  # noqa: E402
+
+
+def prompts(args):
+    # Same question, typed a little differently by different people
+    return [f"  Question {i % args.distinct}?" if i % 2 else f"question {i % args.distinct}?"
+            for i in range(args.requests)]
+
+
+async def chat(args):
+    together = FakeTogetherClient(latency=args.latency)
+    main.raw_llm = LLMRouter.from_models({"together": ClientChatModel(client=together, model=main.LLM_MODEL)})
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        started = time.perf_counter()
+        responses = await asyncio.gather(*[http.post("/together/chat", json={"user_id": f"user-{i}", "prompt": p})
+                                           for i, p in enumerate(prompts(args))])
+    return {"requests": args.requests, "ok": sum(r.status_code == 200 for r in responses),
+            "upstream_calls": together.calls, "seconds": round(time.perf_counter() - started, 3)}
+
+
+async def embeddings(args, workdir):
+    fake = FakeEmbeddings(latency=args.latency)
+    cache = CachedEmbeddings(fake, model="fake", path=os.path.join(workdir, "embeddings.sqlite3"))
+    await asyncio.gather(*[cache.aembed_query(f"question {i % args.distinct}?") for i in range(args.requests)])
+    return {"requests": args.requests, "upstream_calls": fake.calls, **cache.flights.stats}
+
+
+async def stream(args):
+    model = FakeChatModel(latency=args.latency, token_latency=0.01)
+    flights = SingleFlight("bench_stream")
+    calls = 0
+
+    async def tokens(prompt):
+        nonlocal calls
+        calls += 1
+        async for chunk in model.astream([HumanMessage(content=prompt)]):
+            yield chunk.content
+
+    async def consume(i):
+        # Staggered, so later subscribers join mid-stream and replay
+        await asyncio.sleep(0.001 * i)
+        prompt = f"question {i % args.distinct}?"
+        return "".join([t async for t in flights.stream(prompt, lambda: tokens(prompt))])
+
+    answers = await asyncio.gather(*[consume(i) for i in range(args.requests)])
+    return {"requests": args.requests, "upstream_calls": calls, "complete_answers": sum(bool(a) for a in answers),
+            **flights.stats}
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        return {"together_chat": await chat(args), "embed_query": await embeddings(args, workdir),
+                "stream": await stream(args)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+    print(json.dumps({"args": vars(args), "results": asyncio.run(run(args))}, indent=2))
@@ -0,0 +1,150 @@
+"""Query latency, load time, memory and recall: Chroma vs the NumPy index.
+
+    python bench/vector_store.py --vectors 5000 --dim 768 --queries 200
+
+Each backend is built once in a temp directory from the same synthetic unit
+vectors, then measured in a fresh subprocess (so load time and RSS are
+cold). Queries are stored vectors plus noise; recall@k is measured against
+exact float32 search. No API key is needed: searches go by vector.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import numpy as np  # noqa: E402
+from fakes import FakeEmbeddings  # noqa: E402
+
+BACKENDS = ("chroma", "numpy-float32", "numpy-int8")
+
+
+def synthetic(n, dim, queries, seed=0):
+    rng = np.random.default_rng(seed)
+    # A few hundred clusters, like chunks of CVs sharing a role
+    centers = rng.normal(size=(max(1, n // 20), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)
+    picks = rng.integers(0, n, queries)
+    probes = vectors[picks] + 0.3 * rng.normal(size=(queries, dim)).astype(np.float32)
+    return vectors, probes
+
+
+def open_store(backend, directory, dim):
+    embeddings = FakeEmbeddings(dim=dim)
+    if backend == "chroma":
+        from langchain_community.vectorstores import Chroma
+        # Cosine space, to match the NumPy index
+        return Chroma(persist_directory=directory, embedding_function=embeddings,
+                      collection_metadata={"hnsw:space": "cosine"})
+    from numpy_store import NumpyVectorStore
+    return NumpyVectorStore(directory, embeddings, dtype=backend.split("-")[1])
+
+
+def build(backend, directory, vectors):
+    store = open_store(backend, directory, vectors.shape[1])
+    ids = [str(i) for i in range(len(vectors))]
+    start = time.perf_counter()
+    for lo in range(0, len(vectors), 1000):
+        hi = lo + 1000
+        texts = [f"chunk {i}" for i in range(lo, min(hi, len(vectors)))]
+        metadatas = [{"file": f"cv{i // 10}.pdf"} for i in range(lo, min(hi, len(vectors)))]
+        if backend == "chroma":
+            store._collection.upsert(ids=ids[lo:hi], embeddings=vectors[lo:hi].tolist(),
+                                     documents=texts, metadatas=metadatas)
+        else:
+            store.write_vectors(ids[lo:hi], texts, metadatas, vectors[lo:hi])
+    store.persist()
+    return time.perf_counter() - start
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def measure(backend, directory, dim, probes, k, batch):
+    # Runs in a fresh interpreter: everything here is cold.
+    before = rss_mb()
+    start = time.perf_counter()
+    store = open_store(backend, directory, dim)
+    store.similarity_search_by_vector(probes[0].tolist(), k=k)
+    load = time.perf_counter() - start
+
+    latencies, results = [], []
+    for probe in probes:
+        t = time.perf_counter()
+        docs = store.similarity_search_by_vector(probe.tolist(), k=k)
+        latencies.append(time.perf_counter() - t)
+        results.append([int(doc.page_content.split()[1]) for doc in docs])
+
+    batched = None
+    if backend != "chroma":
+        t = time.perf_counter()
+        for lo in range(0, len(probes), batch):
+            store.similarity_search_by_vectors(probes[lo:lo + batch], k=k)
+        batched = (time.perf_counter() - t) / len(probes)
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "load_seconds": round(load, 3),
+        "query_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+        "query_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+        "batched_query_ms": round(batched * 1000, 4) if batched is not None else None,
+        "rss_mb": round(rss_mb() - before, 1),
+        "results": results,
+    }
+
+
+def disk_mb(directory):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(directory) for f in files) / 2**20
+
+
+def recall(results, exact):
+    return float(np.mean([len(set(r) & set(e)) / len(e) for r, e in zip(results, exact)]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=32, help="queries per batched NumPy search")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--measure", help=argparse.SUPPRESS)  # internal: backend to measure in this process
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    vectors, probes = synthetic(args.vectors, args.dim, args.queries)
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.directory, args.dim, probes, args.k, args.batch)))
+        return
+
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    exact = np.argsort(-(probes @ unit.T), axis=1)[:, :args.k].tolist()
+
+    report = {"vectors": args.vectors, "dim": args.dim, "queries": args.queries, "k": args.k, "backends": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in args.backends.split(","):
+            directory = os.path.join(tmp, backend)
+            build_seconds = build(backend, directory, vectors)
+            out = subprocess.run([sys.executable, __file__, "--measure", backend, "--directory", directory,
+                                  "--vectors", str(args.vectors), "--dim", str(args.dim),
+                                  "--queries", str(args.queries), "-k", str(args.k), "--batch", str(args.batch)],
+                                 check=True, capture_output=True, text=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            report["backends"][backend] = {
+                "build_seconds": round(build_seconds, 3),
+                "disk_mb": round(disk_mb(directory), 1),
+                f"recall_at_{args.k}": round(recall(result.pop("results"), exact), 4),
+                **result,
+            }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
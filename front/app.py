@@ -1,20 +1,95 @@
 import streamlit as st
 import requests
-import os
+import json
+import time
+import uuid
 from datetime import datetime
 
 st.set_page_config(page_title="Chatbot", page_icon="🤖", layout="wide")  # Changed to wide layout
 
-# Define paths
-UPLOAD_FOLDER = "../uploads"  # You can change this to your desired path
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+API_URL = "http://127.0.0.1:8000"
+
+def bot_bubble(content):
+    return f""" 
+    <div class='chat-container'> 
+        <div class='message'> 
+            <div class='botIcon'>🤖</div> 
+            <div class='bot-bubble'>{content}</div> 
+        </div> 
+    </div> 
+    """
+
+def stream_answer(question):
+    # Yields answer tokens from the server-sent event stream of /ask/stream.
+    # (connect, read) timeout: read applies between tokens, not to the whole answer.
+    with requests.post(
+        f"{API_URL}/ask/stream",
+        json={"question": question, "session_id": st.session_state.session_id},
+        stream=True,
+        timeout=(5, 60)
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            if "error" in event:
+                raise RuntimeError(event["error"])
+            if "token" in event:
+                yield event["token"]
+
+def multipart_chunks(files, boundary, chunk_size=1 << 20):
+    # multipart/form-data body produced piece by piece, so requests sends it
+    # chunked instead of building the whole body in memory first.
+    for f in files:
+        f.seek(0)
+        yield (f'--{boundary}\r\nContent-Disposition: form-data; name="files"; filename="{f.name}"\r\n'
+               f'Content-Type: {f.type or "application/octet-stream"}\r\n\r\n').encode()
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            yield chunk
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+def upload_files(files):
+    # All files go in one streamed request; the backend starts indexing each
+    # one as soon as it has arrived and returns the build job id.
+    boundary = uuid.uuid4().hex
+    return requests.post(
+        f"{API_URL}/upload",
+        data=multipart_chunks(files, boundary),
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        timeout=(5, 300)
+    )
 
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
 if "processing" not in st.session_state:
     st.session_state.processing = False
 if "admin_mode" not in st.session_state:
     st.session_state.admin_mode = False
+if "build_job" not in st.session_state:
+    st.session_state.build_job = None
+
+def show_build_progress(job_id):
+    # Polls the build job until it finishes; the server keeps answering chat meanwhile.
+    status_box = st.empty()
+    bar = st.progress(0.0)
+    while True:
+        job = requests.get(f"{API_URL}/build/{job_id}", timeout=10).json()
+        progress = job["progress"]
+        total = progress["chunks_found"] / progress["files_parsed"] * progress["files_total"] if progress["files_parsed"] else 0
+        bar.progress(min(1.0, progress["chunks_embedded"] / total) if total else 0.0)
+        eta = f", ~{job['eta_seconds']:.0f}s left" if job["eta_seconds"] is not None else ""
+        status_box.info(
+            f"Build {job['status']} ({progress['stage']}): "
+            f"{progress['files_parsed']}/{progress['files_total']} files parsed, "
+            f"{progress['chunks_embedded']} chunks embedded{eta}"
+        )
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(1)
 
 # Sidebar for admin controls
 with st.sidebar:
@@ -36,39 +111,33 @@ with st.sidebar:
         )
         
         if uploaded_files:
-            for uploaded_file in uploaded_files:
-                # Create a unique filename with timestamp
-                #timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                #file_path = os.path.join(UPLOAD_FOLDER, f"{timestamp}_{uploaded_file.name}")
-                file_path = os.path.join(UPLOAD_FOLDER, f"{uploaded_file.name}")
-                
-                # Save the file
-                with open(file_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                
-                st.success(f"Saved file: {uploaded_file.name}")
-            
             # Build button
             if st.button("Build Knowledge Base") and uploaded_files:
                 try:
-                    # Assuming you want to process just the first file
-                    file_path = os.path.join(UPLOAD_FOLDER, uploaded_files[0].name).replace("\\", "/")
+                    # Uploads every selected file; progress is polled below
+                    response = upload_files(uploaded_files)
                     
-                    response = requests.post(
-                        "http://127.0.0.1:8000/build",
-                        json={
-                            "path": file_path  # Single string path
-                        },
-                        timeout=60
-                    )
-                    
-                    if response.status_code == 200:
-                        st.success(f"Processed file: {file_path}")
+                    if response.status_code == 202:
+                        result = response.json()
+                        st.session_state.build_job = result["job_id"]
+                        for name in result["skipped"]:
+                            st.warning(f"Skipped (not a PDF or ZIP): {name}")
                     else:
                         st.error(f"Error: {response.text}")
                         
                 except Exception as e:
                     st.error(f"Connection error: {str(e)}")
+
+        if st.session_state.build_job:
+            try:
+                job = show_build_progress(st.session_state.build_job)
+                st.session_state.build_job = None
+                if job["status"] == "done":
+                    st.success(f"Processed files: {', '.join(job['params'].get('files') or [job['params'].get('path', '')])}")
+                else:
+                    st.error(f"Build failed: {job['error']}")
+            except Exception as e:
+                st.error(f"Connection error: {str(e)}")
     else:
         st.info("Admin mode is OFF")
 
@@ -191,18 +260,12 @@ if not st.session_state.admin_mode:
             </div> 
             """, unsafe_allow_html=True) 
         else: 
-            st.markdown(f""" 
-            <div class='chat-container'> 
-                <div class='message'> 
-                    <div class='botIcon'>🤖</div> 
-                    <div class='bot-bubble'>{msg['content']}</div> 
-                </div> 
-            </div> 
-            """, unsafe_allow_html=True)
+            st.markdown(bot_bubble(msg['content']), unsafe_allow_html=True)
 
-    # Show thinking animation if processing
+    # Show thinking animation if processing; the streamed answer replaces it
+    answer_placeholder = st.empty()
     if st.session_state.processing:
-        st.markdown(f""" 
+        answer_placeholder.markdown(f""" 
         <div class='chat-container'> 
             <div class='message'> 
                 <div class='botIcon'>🤖</div> 
@@ -228,18 +291,16 @@ if not st.session_state.admin_mode:
         # Get the last user message
         user_message = st.session_state.messages[-1]["content"]
         
-        # Get bot response
+        # Get bot response, rendering tokens as they arrive
+        bot_response = ""
         try:
-            response = requests.post(
-                "http://127.0.0.1:8000/ask",
-                json={"question": user_message},
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                bot_response = response.json()["answer"]
-            else:
+            for token in stream_answer(user_message):
+                bot_response += token
+                answer_placeholder.markdown(bot_bubble(bot_response + " ▌"), unsafe_allow_html=True)
+            if not bot_response:
                 bot_response = "Sorry, I encountered an error processing your request."
+        except requests.HTTPError:
+            bot_response = "Sorry, I encountered an error processing your request."
         except Exception as e:
             bot_response = f"Error connecting to the bot service: {str(e)}"
         
@@ -252,4 +313,4 @@ if not st.session_state.admin_mode:
 elif st.session_state.admin_mode:
     st.header("Admin Mode Active")
     st.write("You can upload files and build the knowledge base from the sidebar.")
-    st.write(f"Files will be saved to: {os.path.abspath(UPLOAD_FOLDER)}")
+    st.write("Uploaded files are stored by the backend (UPLOAD_DIR) and indexed as they arrive.")
@@ -1,20 +1,57 @@
-from together import Together
 from fastapi import FastAPI
 from dotenv import load_dotenv
 from pydantic import BaseModel
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import LLMChain
-from langchain_together import ChatTogether
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.output_parsers import StrOutputParser
+import httpx
 import os
-
+import sys
+
+# Shared helpers live next to the RAG apps in backend/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from concurrency import LLMScheduler
+from llm_router import (TOGETHER_MODEL, ClientChatModel, ProvidersUnavailable, build_router, providers_unavailable,
+                        register_routers)
+from metrics import StageTimer, install, register_caches, register_limiter
+from sessions import SessionStore, approx_tokens
+from single_flight import SingleFlight, normalize
+from startup import install_probes, lazy, mark
+from summarizer import CHAT_HISTORY_TOKENS, CHAT_MEMORY_MODE, HistorySummarizer
+from streaming import sse, sse_response
+
+mark("imports")
 load_dotenv()
 
 app = FastAPI()
-
-LLM_MODEL = "meta-llama/Llama-3.3-70B-Instruct-Turbo-Free"
+# Per-stage latency / token metrics on GET /metrics, trace ids on every request
+install(app)
+# Every provider down or breaker-open -> 503 with Retry-After
+app.add_exception_handler(ProvidersUnavailable, providers_unavailable)
+# GET /live, /ready, /startup; SDK clients are built on first use or by the
+# warm-up that starts with the server (see startup.py)
+install_probes(app)
+
+LLM_MODEL = TOGETHER_MODEL
 TOGETHER_API_KEY = os.getenv("TOGETHER_API_KEY")
-client = Together(api_key=TOGETHER_API_KEY)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+
+# One pooled HTTP client for every upstream call: both endpoints and all users
+# reuse the same keep-alive connections to Together.
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+    timeout=httpx.Timeout(120.0, connect=10.0),
+)
+
+def together_client():
+    from together import AsyncTogether
+    return AsyncTogether(api_key=TOGETHER_API_KEY, http_client=http_client)
+
+client = lazy("together_client", together_client)
+
+# Upstream LLM calls in flight / queued per worker, shared fairly between
+# users and subject to their quotas (see concurrency.py)
+llm_limiter = LLMScheduler()
 
 class Chat_Request(BaseModel):
     user_id: str
@@ -23,12 +60,12 @@ class Chat_Request(BaseModel):
 class Chat_Response(BaseModel):
     answer: str
 
-# Create Together AI LLM wrapper
-llm = ChatTogether(
-    model=LLM_MODEL,
-    api_key=TOGETHER_API_KEY,
-    temperature=0.7
-)
+# Together first, Gemini as failover when GOOGLE_API_KEY is set (LLM_PROVIDERS reorders)
+llm = build_router(["together", "gemini"], temperature=0.7, http_async_client=http_client, name="chat")
+# /together/chat calls the Together SDK client directly, behind the same failover
+raw_llm = build_router(["together", "gemini"], temperature=0.7, name="raw",
+                       together=ClientChatModel(client=client, model=LLM_MODEL))
+stage_timer = StageTimer()
 
 # Create ChatPromptTemplate with system role and message history
 prompt_template = ChatPromptTemplate.from_messages([
@@ -37,32 +74,70 @@ prompt_template = ChatPromptTemplate.from_messages([
     ("user", "{input}")
 ])
 
-# Memory store per user
-user_memories = {}
-
-def get_chain_for_user(user_id: str):
-    # Get or create memory for the user
-    if user_id not in user_memories:
-        user_memories[user_id] = ConversationBufferMemory(
-            memory_key="history",
-            return_messages=True  # IMPORTANT: ChatPromptTemplate needs messages, not plain text
-        )
-    memory = user_memories[user_id]
-
-    # Create a chain with memory
-    chain = LLMChain(
-        llm=llm,
-        prompt=prompt_template,
-        memory=memory
-    )
-    return chain
+# Memory store per user: bounded (LRU + idle TTL + global cap), optionally
+# persisted to SQLite. CHAT_MEMORY_MODE=window keeps the last
+# CHAT_HISTORY_WINDOW exchanges; =summary keeps recent exchanges verbatim and
+# rolls older ones into a summary once over CHAT_HISTORY_TOKENS.
+if CHAT_MEMORY_MODE == "summary":
+    user_sessions = SessionStore(window=None, max_tokens=4 * CHAT_HISTORY_TOKENS, name="chat_sessions",
+                                 summarizer=HistorySummarizer(llm))
+else:
+    user_sessions = SessionStore(window=int(os.getenv("CHAT_HISTORY_WINDOW", "10")), name="chat_sessions")
+
+def build_chat_chain(llm):
+    # StageTimer records prompt / llm (and first-token) latency and token counts
+    return (prompt_template | llm | StrOutputParser()).with_config(callbacks=[stage_timer])
+
+# Prompt -> LLM pipeline, built once and shared by every user
+chat_chain = build_chat_chain(llm)
+
+register_caches({"sessions": user_sessions})
+register_limiter(llm_limiter)
+register_routers({"chat": llm, "raw": raw_llm})
+
+def prompt_tokens(request, history):
+    # Estimate charged to the user's token quota when the call is admitted
+    return approx_tokens(history.messages) + len(request.prompt) // 4
+
+async def get_chain_for_user(user_id: str):
+    # Nothing is constructed per request: the shared pipeline is paired with
+    # the user's history, which is passed in as the "history" input.
+    return chat_chain, await user_sessions.aget(user_id)
 
 @app.post("/langchain/chat", response_model=Chat_Response)
 async def chat_with_history(request: Chat_Request):
-    chain = get_chain_for_user(request.user_id)
-    result = chain.run(input=request.prompt)
+    chain, history = await get_chain_for_user(request.user_id)
+    async with llm_limiter.slot(request.user_id, tokens=prompt_tokens(request, history)) as slot:
+        result = await chain.ainvoke({"input": request.prompt, "history": history.messages})
+        slot.charge(len(result) // 4)
+    history.add_messages([HumanMessage(content=request.prompt), AIMessage(content=result)])
     return Chat_Response(answer=result)
 
+@app.post("/langchain/chat/stream")
+async def chat_with_history_stream(request: Chat_Request):
+    # Streams tokens as server-sent events; the exchange is saved to the
+    # user's memory once the full answer is in.
+    chain, history = await get_chain_for_user(request.user_id)
+    tokens = prompt_tokens(request, history)
+    llm_limiter.check(request.user_id, tokens=tokens)  # a 429 before the stream starts
+
+    async def events():
+        parts = []
+        try:
+            async with llm_limiter.slot(request.user_id, tokens=tokens) as slot:
+                async for token in chain.astream({"input": request.prompt, "history": history.messages}):
+                    if token:
+                        parts.append(token)
+                        yield sse({"token": token})
+                slot.charge(sum(map(len, parts)) // 4)
+        except Exception as e:
+            yield sse({"error": str(e)})
+            return
+        history.add_messages([HumanMessage(content=request.prompt), AIMessage(content="".join(parts))])
+        yield sse({"done": True})
+
+    return sse_response(events())
+
 """
 {
     "user_id": "test_user_1",
@@ -79,18 +154,30 @@ async def chat_with_history(request: Chat_Request):
 
 """
 
+# Prompts being answered right now by /together/chat, see single_flight.py
+in_flight = SingleFlight("together_chat")
+
+async def complete(user_id, prompt):
+    async with llm_limiter.slot(user_id, tokens=len(prompt) // 4) as slot:
+        message = await raw_llm.ainvoke([HumanMessage(content=prompt)], config={"callbacks": [stage_timer]})
+        slot.charge(len(message.content) // 4)
+    return message.content
+
 @app.post("/together/chat", response_model=Chat_Response)
 async def chat_with_llma(request: Chat_Request):
-    response = client.chat.completions.create(
-        model=LLM_MODEL,
-        messages=[
-            {
-                "role": "user",
-                "content": request.prompt
-            }
-        ]
-    )
-    return Chat_Response(answer=response.choices[0].message.content) 
+    # Stateless, so the same prompt sent concurrently (by any user) is asked
+    # once, in the turn and on the quota of whoever sent it first. The check
+    # keeps a user over quota from riding along on someone else's call.
+    llm_limiter.check(request.user_id, tokens=len(request.prompt) // 4)
+    answer = await in_flight.do((normalize(request.prompt), LLM_MODEL),
+                                lambda: complete(request.user_id, request.prompt))
+    return Chat_Response(answer=answer)
+
+mark("module")
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await http_client.aclose()
 
 # @app.get("/")
 # def read_root():